@@ -1,10 +1,17 @@
+from typing import Optional
+
 from flask_apispec import MethodResource, doc, use_kwargs
 from psycopg2.errors import UniqueViolation, OperationalError, InterfaceError
 
 from shared.utils import initialize_micro_service, marshal_with_flask_enforced
-from shared.exceptions import DoesNotExist, get_409_already_exists, get_404_does_not_exist, get_401_authentication_error, get_500_database_error
+from shared.exceptions import DoesNotExist, ServiceOverloaded, get_409_already_exists, get_404_does_not_exist, get_401_authentication_error, get_500_database_error, get_503_service_overloaded
 from shared.APIResponses import GenericResponseMessages as E_MSG, make_response_message
-from schemas import AccountResponseSchema, MicroservicesResponseSchema, RegisterBodySchema, AuthenticationBodySchema, AuthenticationResponseSchema
+from shared.models import make_response_serialized
+from shared.caching import cached
+from shared.sessionTokens import issue_session_token
+from models import Account as AccountModel
+from passwords import PasswordHasher
+from schemas import AccountResponseSchema, AccountsResponseSchema, AccountSearchQuerySchema, RegisterBodySchema, RegisterResponseSchema, AuthenticationBodySchema, AuthenticationResponseSchema
 
 
 MICROSERVICE_NAME = "accounts"
@@ -15,7 +22,24 @@ APISPEC_CONFIG = {
     'APISPEC_TITLE': 'Microservices Accounts',
     'APISPEC_VERSION': '1.0'
 }
-app, api, docs, conn = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG)
+app, api, docs, db = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG)
+
+# Passwords are stored as salted scrypt hashes, computed off the request threads
+hasher = PasswordHasher(n=app.config["PASSWORD_SCRYPT_N"],
+                        r=app.config["PASSWORD_SCRYPT_R"],
+                        p=app.config["PASSWORD_SCRYPT_P"],
+                        workers=app.config["PASSWORD_HASH_WORKERS"],
+                        max_queue=app.config["PASSWORD_HASH_QUEUE"])
+
+
+def new_session_token(username: str) -> Optional[str]:
+    """Issue a session token for an authenticated user, which every microservice
+    and GUI worker verifies locally, see :func:`shared.sessionTokens.verify_session_token`.
+
+    :param username: The username of the authenticated user
+    :return: The session token, or None if no SESSION_SECRET is configured
+    """
+    return issue_session_token(username, app.config["SESSION_SECRET"], app.config["SESSION_TTL"])
 
 
 class Account(MethodResource):
@@ -36,14 +60,15 @@ class Account(MethodResource):
         'username': {'description': 'The username of the chosen account'}
     })
     @marshal_with_flask_enforced(AccountResponseSchema, code=200)
+    @cached(tags=("user:{username}",))
     def get(self, username: str):
         """The query endpoint of a specific account.
 
         :return: The primary account information
         """
 
-        with conn.cursor() as curs:
-            curs.execute("SELECT * FROM account WHERE username = %s;", (username,))
+        with db.cursor() as curs:
+            curs.execute("SELECT username FROM account WHERE username = %s;", (username,))
             res = curs.fetchone()
 
         # DoesNotExist exception response is handled
@@ -51,29 +76,61 @@ class Account(MethodResource):
         if res == None:
             raise DoesNotExist(f"The user '{username}' does not exist")
 
-        return make_response_message(E_MSG.SUCCESS, 200, username=res[0])
+        return make_response_serialized(E_MSG.SUCCESS, 200, model=AccountModel.from_row(res))
 
     @doc(description='Create an Account resource with the specified credentials', params={
         'username': {'description': 'New account\'s username'},
         'password': {'description': 'New account\'s password'}
     })
     @use_kwargs(RegisterBodySchema, location='form')
-    @marshal_with_flask_enforced(MicroservicesResponseSchema, code=201)
+    @marshal_with_flask_enforced(RegisterResponseSchema, code=201)
     def post(self, username: str, **kwargs):
         """The creation endpoint of an account.
 
-        :return: Whether the creation succeeded
+        :return: Whether the creation succeeded, and a session token of the new user
         """
 
-        password = kwargs["password"]
+        password_hash = hasher.hash(kwargs["password"])
 
         # Duplicate username exception response is handled
         # by UniqueViolation error handler
-        with conn.cursor() as curs:
-            curs.execute('INSERT INTO account ("username", "password") VALUES (%s, %s);', (username, password))
-            conn.commit()
+        with db.cursor() as curs:
+            curs.execute('INSERT INTO account ("username", "password") VALUES (%s, %s);', (username, password_hash))
+            db.commit()
 
-        return make_response_message(E_MSG.SUCCESS, 201)
+        return make_response_message(E_MSG.SUCCESS, 201, session_token=new_session_token(username))
+
+
+class AccountSearch(MethodResource):
+    """The api endpoint that represents the collection of accounts whose username starts with a prefix.
+
+    It is meant for autocompleting usernames, e.g. when adding a friend.
+    """
+    @staticmethod
+    def route() -> str:
+        """Get the route to the AccountSearch resource.
+
+        :return: The route string
+        """
+        return "/accounts/"
+
+    @doc(description='Get the first accounts, ordered by username, whose username starts with a prefix.')
+    @use_kwargs(AccountSearchQuerySchema, location='query')
+    @marshal_with_flask_enforced(AccountsResponseSchema, code=200)
+    def get(self, **kwargs):
+        """The query endpoint of the account search.
+
+        :return: The matching accounts
+        """
+        prefix, limit = kwargs["prefix"], kwargs["limit"]
+
+        # A range scan of at most limit entries of the text_pattern_ops index, whose order is that of ~<~
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with db.cursor() as curs:
+            curs.execute("SELECT username FROM account WHERE username LIKE %s ORDER BY username USING ~<~ LIMIT %s;", (pattern, limit))
+            rows = curs.fetchall()
+
+        return make_response_serialized(E_MSG.SUCCESS, 200, result=AccountModel.dumps_rows(rows))
 
 
 class Authentication(MethodResource):
@@ -103,29 +160,43 @@ class Authentication(MethodResource):
     def post(self, username: str, **kwargs):
         """The query endpoint of a single user's authentication flow.
 
-        :return: A proof of authentication
+        :return: A proof of authentication, and a session token of the user
         """
 
         password = kwargs["password"]
 
-        with conn.cursor() as curs:
-            curs.execute("SELECT * FROM account WHERE username = %s AND password = %s;", (username, password))
+        with db.cursor() as curs:
+            curs.execute("SELECT password FROM account WHERE username = %s;", (username,))
             res = curs.fetchone()
 
+        stored_hash = res[0] if res is not None else None
+        matches, rehash = hasher.verify(password, stored_hash)
+
         # Considers both existing and non-existing user
-        if res == None:
+        if not matches:
             return get_401_authentication_error("username and password do not match", append_error=True, authentication_data=False)
 
-        return make_response_message(E_MSG.SUCCESS, 200, authentication_data=True)
+        # Upgrade plaintext passwords and hashes of an outdated cost, unless the password changed meanwhile
+        if rehash:
+            with db.cursor() as curs:
+                curs.execute("UPDATE account SET password = %s WHERE username = %s AND password = %s;",
+                             (hasher.hash(password), username, stored_hash))
+                db.commit()
+
+        return make_response_message(E_MSG.SUCCESS, 200, authentication_data=True, session_token=new_session_token(username))
 
 
 @app.errorhandler(DoesNotExist)
 def handle_does_not_exist(e):
     return get_404_does_not_exist(e, append_error=True)
 
+@app.errorhandler(ServiceOverloaded)
+def handle_service_overloaded(e):
+    return get_503_service_overloaded(e, append_error=True, retry_after=app.config["ADMISSION_RETRY_AFTER"])
+
 @app.errorhandler(UniqueViolation)
 def handle_db_unique_violation(e):
-    conn.rollback()
+    db.rollback()
     return get_409_already_exists(e)
 
 @app.errorhandler(InterfaceError)
@@ -142,8 +213,10 @@ def handle_db_operational_error(e):
 
 # Add resources
 api.add_resource(Account, Account.route())
+api.add_resource(AccountSearch, AccountSearch.route())
 api.add_resource(Authentication, Authentication.route())
 
 # Register apispec docs
 docs.register(Account)
+docs.register(AccountSearch)
 docs.register(Authentication)
@@ -0,0 +1,12 @@
+from shared.models import RowModel, Column
+
+
+class Account(RowModel):
+    """The primary account information of an *account* table row.
+
+    The password column is deliberately not part of the model, so
+    it can never be serialized into a response.
+    """
+    columns = (
+        Column("username", str, 0),
+    )
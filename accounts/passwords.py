@@ -0,0 +1,115 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Optional, Tuple
+
+from shared.exceptions import ServiceOverloaded
+from shared.metrics import Counter, Histogram
+
+
+PASSWORD_HASHES = Histogram("password_hash_duration_seconds", "The time spent hashing passwords, per operation", ("operation",))
+PASSWORD_REHASHES = Counter("password_rehash_total", "The amount of stored passwords upgraded on login, per former scheme", ("scheme",))
+
+# The scheme prefix of scrypt hashes, every other stored password is a legacy plaintext password
+SCRYPT_SCHEME = "scrypt"
+
+
+class PasswordHasher:
+    """Salted, tunable-cost scrypt password hashing, off the request threads.
+
+    Hashes are stored as ``scrypt$<n>$<r>$<p>$<salt>$<hash>``, with the
+    base64 encoded salt and hash, so the cost of every stored hash is known
+    and a hash of an outdated cost is upgraded on the next login, see
+    :meth:`verify`. Passwords stored before hashing was introduced are
+    still accepted, and upgraded the same way.
+
+    The hashing runs on a dedicated thread pool per process: scrypt
+    releases the GIL, so the request threads keep serving other requests
+    meanwhile. At most *max_queue* hashes wait for a thread; beyond that
+    :class:`shared.exceptions.ServiceOverloaded` is raised, so a burst of
+    logins is shed instead of piling up.
+    """
+    def __init__(self, n: int, r: int, p: int, workers: int, max_queue: int):
+        """
+        :param n: The scrypt CPU/memory cost, a power of 2
+        :param r: The scrypt block size
+        :param p: The scrypt parallelization
+        :param workers: The amount of hashing threads of a process
+        :param max_queue: The maximum amount of hashes waiting for a hashing thread
+        """
+        self.n = n
+        self.r = r
+        self.p = p
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Verified against when the user does not exist, so unknown users take as long as known ones
+        self._dummy = self._scrypt(b"", os.urandom(16), n, r, p)
+
+    def _scrypt(self, password: bytes, salt: bytes, n: int, r: int, p: int) -> str:
+        key = hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * p + 1024 * 1024, dklen=32)
+        return "$".join((SCRYPT_SCHEME, str(n), str(r), str(p),
+                         base64.b64encode(salt).decode("ascii"), base64.b64encode(key).decode("ascii")))
+
+    def _run(self, operation: str, func, *args):
+        """Run a hashing function on the hashing threads, and wait for its result."""
+        if not self._slots.acquire(blocking=False):
+            raise ServiceOverloaded("too many concurrent password hashes")
+        try:
+            # Executor threads never survive a fork, so every process gets its own executor
+            if self._pid != os.getpid():
+                with self._lock:
+                    if self._pid != os.getpid():
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+                        self._pid = os.getpid()
+            start = perf_counter()
+            result = self._executor.submit(func, *args).result()
+            PASSWORD_HASHES.labels(operation).observe(perf_counter() - start)
+            return result
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        """Hash a password at the current cost, with a fresh salt.
+
+        :param password: The plaintext password
+        :return: The hash to store
+        """
+        return self._run("hash", self._scrypt, password.encode(), os.urandom(16), self.n, self.r, self.p)
+
+    def _verify(self, password: str, stored: str) -> Tuple[bool, bool]:
+        scheme, _, parameters = stored.partition("$")
+        if scheme != SCRYPT_SCHEME:
+            # A legacy plaintext password
+            return hmac.compare_digest(password.encode(), stored.encode()), True
+
+        try:
+            n, r, p, salt, _ = parameters.split("$")
+            n, r, p = int(n), int(r), int(p)
+            matches = hmac.compare_digest(self._scrypt(password.encode(), base64.b64decode(salt, validate=True), n, r, p), stored)
+        # Explicitly set output values, to ensure graceful failure is handled appropriately
+        except (ValueError, OverflowError, MemoryError):
+            return False, False     # A malformed stored hash matches no password
+        return matches, (n, r, p) != (self.n, self.r, self.p)
+
+    def verify(self, password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+        """Verify a password against its stored hash.
+
+        :param password: The plaintext password to verify
+        :param stored: The stored hash, or None if the user does not exist
+        :return: (Whether the password matches, whether the stored hash should be replaced by :meth:`hash`)
+        """
+        if stored is None:
+            self._run("verify", self._verify, password, self._dummy)
+            return False, False
+        matches, outdated = self._run("verify", self._verify, password, stored)
+        if matches and outdated:
+            PASSWORD_REHASHES.labels(SCRYPT_SCHEME if stored.startswith(SCRYPT_SCHEME + "$") else "plaintext").inc()
+        return matches, matches and outdated
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
 
 from shared.schemas import MicroservicesResponseSchema, MicroservicesResultSchema
 
@@ -15,6 +15,23 @@ class AccountResponseSchema(MicroservicesResponseSchema, AccountSchema):
     pass
 
 
+class AccountsResponseSchema(MicroservicesResultSchema):
+    """The output format of the account search endpoint"""
+    result = fields.List(fields.Nested(AccountSchema), required=True, default=[], metadata={
+        'description': 'The accounts whose username starts with the prefix, in order',
+    })
+
+
+class AccountSearchQuerySchema(Schema):
+    """The query parameters of an account search"""
+    prefix = fields.String(required=True, location='query', validate=validate.Length(min=1), metadata={
+        'description': 'The prefix of the usernames to search for',
+    })
+    limit = fields.Integer(required=False, load_default=10, location='query', validate=validate.Range(min=1, max=100), metadata={
+        'description': 'The maximum amount of accounts to return',
+    })
+
+
 class RegisterBodySchema(Schema):
     """The form body of an account registration"""
     password = fields.String(required=True, location='form', metadata={
@@ -22,6 +39,13 @@ class RegisterBodySchema(Schema):
     })
 
 
+class RegisterResponseSchema(MicroservicesResponseSchema):
+    """The output format of the account registration endpoint"""
+    session_token = fields.String(required=False, allow_none=True, metadata={
+        'description': 'A signed, expiring session token of the registered user, see shared.sessionTokens, null if no SESSION_SECRET is configured'
+    })
+
+
 class AuthenticationBodySchema(Schema):
     """The form body of an account authentication"""
     password = fields.String(required=True, location='form', metadata={
@@ -34,3 +58,6 @@ class AuthenticationResponseSchema(MicroservicesResponseSchema):
     authentication_data = fields.Boolean(required=True, metadata={
         'description': 'The proof of authentication'
     })
+    session_token = fields.String(required=False, allow_none=True, metadata={
+        'description': 'A signed, expiring session token of the authenticated user, see shared.sessionTokens, null if no SESSION_SECRET is configured'
+    })
@@ -10,4 +10,5 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "accounts" <<-EOSQL
         username TEXT PRIMARY KEY,
         password TEXT NOT NULL
     );
+    CREATE INDEX account_username_prefix ON account (username text_pattern_ops);
 EOSQL
@@ -5,8 +5,8 @@ from datetime import datetime
 from flask_apispec import MethodResource, doc, use_kwargs
 
 from shared.utils import initialize_micro_service, marshal_with_flask_enforced
-from shared.microserviceInteractions import require_user_exists
-from shared.exceptions import DoesNotExist, MicroserviceConnectionError, get_409_already_exists, get_404_does_not_exist, get_500_database_error, get_502_bad_gateway_error
+from shared.microserviceInteractions import require_user_exists, response_json, service_get
+from shared.exceptions import DoesNotExist, MicroserviceConnectionError, ServiceOverloaded, get_409_already_exists, get_404_does_not_exist, get_500_database_error, get_502_bad_gateway_error, get_503_service_overloaded
 from shared.APIResponses import GenericResponseMessages as E_MSG, make_response_error, make_response_message
 from schemas import MicroservicesResponseSchema, ActivityFeedResponseSchema, ActivityFeedBodySchema
 
@@ -19,7 +19,8 @@ APISPEC_CONFIG = {
     'APISPEC_TITLE': 'Microservices Activity Feed',
     'APISPEC_VERSION': '1.0'
 }
-app, api, docs, conn = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG)
+DEPENDENCIES = ["accounts", "friends", "playlists", "playlists_sharing"]
+app, api, docs, db = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG, DEPENDENCIES)
 
 class ActivityFeed(MethodResource):
     """The api endpoint that represents a single activity feed resource.
@@ -57,11 +58,11 @@ class ActivityFeed(MethodResource):
         # Fetch all friends of the user for which to construct the feed
         friends_names: list = []  # A list of all the user's friends
         try:
-            response = requests.get(f"http://friends:5000/friends/{username}")
+            response = service_get("friends", f"/friends/{username}", hedge=True)
             if response.status_code == 200:
                 friends_names = [
                     friend_name
-                    for friend_info in response.json().get("result", list())
+                    for friend_info in response_json(response).get("result", list())
                     if (friend_name := friend_info.get("friend_name", None)) is not None
                 ]
 
@@ -75,7 +76,7 @@ class ActivityFeed(MethodResource):
 
             # Fetch all friends of the friend from which to construct the feed
             try:
-                response = requests.get(f"http://friends:5000/friends/{friend_name}")
+                response = service_get("friends", f"/friends/{friend_name}", hedge=True)
                 if response.status_code == 200:
                     activity_feed.extend([
                         (
@@ -83,7 +84,7 @@ class ActivityFeed(MethodResource):
                             "Added Friend",
                             f"{friend_name} added {friend_info['friend_name']} as a friend"
                         )
-                        for friend_info in response.json().get("result", list())
+                        for friend_info in response_json(response).get("result", list())
                         if "created" in friend_info and "friend_name" in friend_info
                     ])
                     activity_feed = filtered_activity_feed()
@@ -94,9 +95,9 @@ class ActivityFeed(MethodResource):
 
             # Fetch friend's playlists
             try:
-                response = requests.get(f"http://playlists:5000/playlists/{friend_name}")
+                response = service_get("playlists", f"/playlists/{friend_name}", hedge=True)
                 if response.status_code == 200:
-                    for playlist in response.json().get("result", list()):
+                    for playlist in response_json(response).get("result", list()):
 
                         # Skip malformed
                         if "id" not in playlist or "title" not in playlist:
@@ -119,7 +120,7 @@ class ActivityFeed(MethodResource):
             for playlist_id, playlist_title in playlists:
                 # Fetch friend's playlist's songs
                 try:
-                    response = requests.get(f"http://playlists:5000/playlists/{playlist_id}")
+                    response = service_get("playlists", f"/playlists/{playlist_id}", hedge=True)
                     if response.status_code == 200:
                         activity_feed.extend([
                             (
@@ -127,7 +128,7 @@ class ActivityFeed(MethodResource):
                                 f"Song added to playlist",
                                 f"{friend_name} added the song {playlist_song['title']} by {playlist_song['artist']} to their playlist called {playlist_title}"
                             )
-                            for playlist_song in response.json().get("result", list())
+                            for playlist_song in response_json(response).get("result", list())
                             if "artist" in playlist_song and "title" in playlist_song
                         ])
                         activity_feed = filtered_activity_feed()
@@ -139,9 +140,9 @@ class ActivityFeed(MethodResource):
 
             # Fetch the playlist sharing information of the friend
             try:
-                response = requests.get(f"http://playlists_sharing:5000/playlists/{friend_name}/shared?usernameIdentity=owner")
+                response = service_get("playlists_sharing", f"/playlists/{friend_name}/shared?usernameIdentity=owner", hedge=True)
                 if response.status_code == 200:
-                    for playlist_share in response.json().get("result", list()):
+                    for playlist_share in response_json(response).get("result", list()):
 
                         # Skip malformed
                         if "recipient" not in playlist_share or "created" not in playlist_share or\
@@ -188,6 +189,10 @@ def handle_db_connection_error(e):
     """
     return get_502_bad_gateway_error(e, append_error=True)
 
+@app.errorhandler(ServiceOverloaded)
+def handle_service_overloaded(e):
+    return get_503_service_overloaded(e, append_error=True, retry_after=app.config["ADMISSION_RETRY_AFTER"])
+
 
 # Add resources
 api.add_resource(ActivityFeed, ActivityFeed.route())
@@ -0,0 +1,119 @@
+"""Load test the admission control against a local stand-in service, see :mod:`shared.admission`.
+
+Usage: ::
+
+    python3 benchmarks/admission.py [seconds] [clients ...]
+
+The stand-in is a threaded Flask server with a single route, whose
+requests each hold one of 8 backend slots, like the pooled database
+connections of a worker, for 50 ms. It thus saturates at 160 requests per
+second. Every amount of *clients*, 4 to 128 by default, sends requests
+back to back for *seconds* seconds, 5 by default, and gives up on a
+request after 500 ms, the latency objective. A shed request is retried
+after 50 ms.
+
+The stand-in runs once without admission control and once with the
+admission settings of the shared config, or ``ADMISSION_ADAPTIVE=1`` for
+adaptive limits. Per run and amount of clients, the goodput, i.e. the
+successful requests within the objective per second, the shed and timed
+out requests per second, and the p50 and p99 latency of the successful
+requests are printed. With admission control, the goodput should stay
+flat beyond saturation, while without it collapses once queueing alone
+takes longer than the objective.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+import requests
+
+from flask import Flask
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.admission import register_admission_control
+from shared.config import config
+
+
+BACKEND_SLOTS = 8
+SERVICE_TIME = 0.050
+OBJECTIVE = 0.5
+SHED_BACKOFF = 0.05
+
+
+def stand_in(admission: bool) -> Flask:
+    app = Flask("stand-in")
+    app.config.update(config)
+    if not admission:
+        app.config["ADMISSION_LIMIT"] = 0
+    register_admission_control(app)
+    backend = threading.BoundedSemaphore(BACKEND_SLOTS)
+
+    @app.route("/work")
+    def work():
+        with backend:
+            time.sleep(SERVICE_TIME)
+        return "done"
+
+    return app
+
+
+def client(url: str, deadline: float, outcomes: dict, latencies: list, lock: threading.Lock) -> None:
+    session = requests.Session()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            status = session.get(url, timeout=OBJECTIVE).status_code
+            outcome = "good" if status == 200 else "shed" if status == 503 else "error"
+        except requests.exceptions.Timeout:
+            outcome = "timeout"
+        except requests.exceptions.ConnectionError:
+            outcome = "error"
+        latency = time.perf_counter() - start
+        with lock:
+            outcomes[outcome] += 1
+            if outcome == "good":
+                latencies.append(latency)
+        if outcome == "shed":
+            time.sleep(SHED_BACKOFF)
+
+
+def percentile(latencies: list, fraction: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float("nan")
+
+
+def run(admission: bool, clients: int, seconds: float) -> None:
+    server = make_server("127.0.0.1", 0, stand_in(admission), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/work"
+
+    outcomes, latencies, lock = { "good": 0, "shed": 0, "timeout": 0, "error": 0 }, [], threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=client, args=(url, deadline, outcomes, latencies, lock)) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+    # Let the abandoned requests of the run drain, so they do not load the next one
+    time.sleep(OBJECTIVE + 1.0)
+
+    print(f"{'admission' if admission else 'unlimited':>9} {clients:4} clients: goodput {outcomes['good'] / seconds:6.0f}/s, "
+          f"shed {outcomes['shed'] / seconds:6.0f}/s, timed out {outcomes['timeout'] / seconds:5.0f}/s, "
+          f"p50 {percentile(latencies, 0.5) * 1000:6.1f} ms, p99 {percentile(latencies, 0.99) * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    amounts = [int(amount) for amount in sys.argv[2:]] or [4, 8, 16, 32, 64, 128]
+    print(f"{BACKEND_SLOTS} backend slots of {SERVICE_TIME * 1000:.0f} ms, objective {OBJECTIVE * 1000:.0f} ms, "
+          f"admission limit {config['ADMISSION_LIMIT']}, queue {config['ADMISSION_QUEUE']}, "
+          f"{'adaptive' if config['ADMISSION_ADAPTIVE'] else 'fixed'}")
+    for admission in (False, True):
+        for clients in amounts:
+            run(admission, clients, seconds)
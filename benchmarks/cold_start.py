@@ -0,0 +1,86 @@
+"""Measure the time from a cold start of a microservice to its first successful request, see :mod:`shared.server`.
+
+Usage: ::
+
+    python3 benchmarks/cold_start.py <app path> [path] [runs]
+
+Starts the microservice at *app path*, e.g. ``songs/app.py``, with
+``python3 -m shared.server`` on a free local port, *runs* times, 5 by
+default. Its configured server mode, workers and threads apply, see
+:mod:`shared.server`. From the moment the process is spawned, it is polled
+every 10 ms until:
+
+* ``/healthz`` answers 200, i.e. a worker serves requests
+* ``/readyz`` answers 200, i.e. the microservice's database is reachable
+* *path*, ``/healthz`` by default, answers 2xx, the first successful request
+
+A stage that did not succeed within 60 seconds is reported as missed.
+The database host of a microservice is that of its persistence container,
+so a run against a database runs on the docker compose network: ::
+
+    docker compose run --rm -v "$PWD:/repo" -w /repo songs python3 benchmarks/cold_start.py songs/app.py /songs/page/
+
+The median time to every stage is printed.
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+DEADLINE = 60.0
+POLL_INTERVAL = 0.01
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cold_start(app_path: str, path: str) -> dict:
+    """Start the microservice once, and get the seconds until every stage succeeded, None for a missed stage."""
+    port = free_port()
+    stages = { "healthz": "/healthz", "readyz": "/readyz", "request": path }
+    reached = dict.fromkeys(stages)
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "shared.server", app_path], cwd=ROOT,
+                              env={ **os.environ, "SERVER_BIND": f"127.0.0.1:{port}" },
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while None in reached.values() and time.perf_counter() - start < DEADLINE:
+            for stage, stage_path in stages.items():
+                if reached[stage] is not None:
+                    continue
+                try:
+                    status = requests.get(f"http://127.0.0.1:{port}{stage_path}", timeout=1.0).status_code
+                # Not listening yet, or not answering in time
+                except requests.exceptions.RequestException:
+                    break
+                if 200 <= status < 300:
+                    reached[stage] = time.perf_counter() - start
+            time.sleep(POLL_INTERVAL)
+    finally:
+        server.terminate()
+        server.wait()
+    return reached
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    app_path = sys.argv[1]
+    path = sys.argv[2] if len(sys.argv) > 2 else "/healthz"
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    results = [cold_start(app_path, path) for _ in range(runs)]
+    print(f"{app_path}, median of {runs} cold starts")
+    for stage in ("healthz", "readyz", "request"):
+        timings = [result[stage] for result in results if result[stage] is not None]
+        missed = f", missed {runs - len(timings)} times" if len(timings) < runs else ""
+        label = f"{stage} {path}" if stage == "request" else stage
+        print(f"{label:>30}: " + (f"{statistics.median(timings) * 1000:7.0f} ms" if timings else "    never") + missed)
@@ -0,0 +1,114 @@
+"""Measure the shared friend graph snapshot, see :mod:`friends.graph`.
+
+Usage: ::
+
+    python3 benchmarks/friend_graph.py [relations] [users] [workers]
+
+*relations* synthetic friend relations, 1 000 000 by default, between
+*users* users, 10 000 by default, are loaded into a snapshot, like the
+friends microservice loads its friend table. Then *workers* fresh
+processes, 4 by default, one after another, map the snapshot and query
+the friend list, reverse lookup and mutual friends of 1000 random users
+each, and keep running until all workers are done.
+
+The time to build the snapshot and its size are printed, and per worker:
+the time to map it, the p50 and p99 query latencies, and how much the
+memory that the worker keeps for itself (private) and its proportional
+share of the memory it shares with the other workers (pss) grew, from
+before mapping the snapshot to after the queries, read from
+``/proc/<pid>/smaps_rollup``.
+"""
+import importlib.util
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+spec = importlib.util.spec_from_file_location("friends_graph", os.path.join(ROOT, "friends", "graph.py"))
+graph_module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(graph_module)
+FriendGraph = graph_module.FriendGraph
+
+
+def relations(amount: int, users: int):
+    """Generate distinct synthetic friend relations, oldest first."""
+    rng, seen, start = random.Random(0), set(), datetime(2023, 1, 1)
+    while len(seen) < amount:
+        user, friend = rng.randrange(users), rng.randrange(users)
+        if user != friend and (user, friend) not in seen:
+            seen.add((user, friend))
+            yield f"user{user}", f"user{friend}", start + timedelta(seconds=len(seen))
+
+
+def memory() -> dict:
+    """Get the private and proportional memory of the calling process, in MB."""
+    values = {}
+    with open("/proc/self/smaps_rollup") as file:
+        for line in file:
+            name, _, rest = line.partition(":")
+            if name in ("Pss", "Private_Clean", "Private_Dirty"):
+                values[name] = int(rest.split()[0]) / 1024
+    return { "private": values["Private_Clean"] + values["Private_Dirty"], "pss": values["Pss"] }
+
+
+def percentiles(timings: list) -> str:
+    ordered = sorted(timings)
+    return f"{statistics.median(ordered) * 1e6:6.0f} / {ordered[int(0.99 * (len(ordered) - 1))] * 1e6:6.0f} µs"
+
+
+def worker(directory: str, users: int) -> None:
+    graph = FriendGraph(lambda since: [], directory, refresh_interval=5.0, reload_interval=3600.0)
+    graph._pid = os.getpid()
+    before = memory()
+    start = time.perf_counter()
+    graph._attach(graph._latest())
+    mapped = time.perf_counter() - start
+
+    rng, timings = random.Random(os.getpid()), { "friend list": [], "reverse lookup": [], "mutual friends": [] }
+    for _ in range(1000):
+        username, othername = f"user{rng.randrange(users)}", f"user{rng.randrange(users)}"
+        for name, query in (("friend list", lambda: graph.friends(username)), ("reverse lookup", lambda: graph.added_by(username)),
+                            ("mutual friends", lambda: graph.mutual_friends(username, othername))):
+            start = time.perf_counter()
+            query()
+            timings[name].append(time.perf_counter() - start)
+    used = memory()
+    print(f"worker {os.getpid()}: mapped in {mapped * 1000:.1f} ms, private +{used['private'] - before['private']:.1f} MB, "
+          f"pss +{used['pss'] - before['pss']:.1f} MB, " + ", ".join(f"{name} {percentiles(values)}" for name, values in timings.items()),
+          flush=True)
+    # Keep mapping the snapshot until the other workers are done
+    sys.stdin.read()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--worker"]:
+        worker(sys.argv[2], int(sys.argv[3]))
+        sys.exit()
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    rows = relations(amount, users)
+    with tempfile.TemporaryDirectory() as directory:
+        builder = FriendGraph(lambda since: rows, directory, refresh_interval=5.0, reload_interval=3600.0)
+        start = time.perf_counter()
+        snapshot = builder._build()
+        print(f"{amount} relations between {users} users: built in {time.perf_counter() - start:.1f} s, "
+              f"{os.path.getsize(snapshot) / 2 ** 20:.0f} MB snapshot")
+        del rows, builder
+
+        children = []
+        for _ in range(workers):
+            children.append(subprocess.Popen([sys.executable, __file__, "--worker", directory, str(users)],
+                                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True))
+            print(children[-1].stdout.readline(), end="")
+        for child in children:
+            child.communicate()
@@ -0,0 +1,64 @@
+"""Simulate the tail latency of hedged requests, see :class:`shared.hedging.Hedger`.
+
+Usage: ::
+
+    python3 benchmarks/hedging.py [requests] [slow fraction]
+
+Every simulated request takes 5 to 10 ms, except for a *slow fraction* of
+them, 3% by default, which take 200 ms. The requests are sent one after
+another, once without and once with hedging, using the hedging settings of
+the shared config. The p50, p99 and the fraction of extra requests are
+printed for both runs.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.config import config
+from shared.hedging import Hedger
+
+
+def simulated_request(slow_fraction: float) -> int:
+    time.sleep(0.2 if random.random() < slow_fraction else random.uniform(0.005, 0.010))
+    return 200
+
+
+def percentile(latencies: list, fraction: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(requests: int, slow_fraction: float, hedger: Hedger = None) -> None:
+    sent = 0
+
+    def request():
+        nonlocal sent
+        sent += 1
+        return simulated_request(slow_fraction)
+
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        if hedger is None:
+            request()
+        else:
+            hedger.call("simulated", request)
+        latencies.append(time.perf_counter() - start)
+
+    # Skip the requests sent before the hedger knew enough latencies
+    measured = latencies[config["HEDGE_MIN_SAMPLES"]:]
+    print(f"{'hedged' if hedger is not None else 'plain':>6}: p50 {percentile(measured, 0.5) * 1000:6.1f} ms, "
+          f"p99 {percentile(measured, 0.99) * 1000:6.1f} ms, extra requests {(sent - requests) / requests:.1%}")
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    slow_fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.03
+    random.seed(0)
+    run(requests, slow_fraction)
+    random.seed(0)
+    run(requests, slow_fraction, Hedger(percentile=config["HEDGE_PERCENTILE"], max_ratio=config["HEDGE_MAX_RATIO"],
+                                        min_samples=config["HEDGE_MIN_SAMPLES"]))
@@ -0,0 +1,70 @@
+"""Compare the orjson backed json provider to the stdlib json module it replaced, see :mod:`shared.serialization`.
+
+Usage: ::
+
+    python3 benchmarks/json_provider.py [items] [repeats]
+
+For the largest response type of every microservice, a synthetic response
+body of *items* list items, 10000 by default, is encoded and decoded
+*repeats* times, 20 by default, in two ways:
+
+* stdlib: ``json.dumps``, calling ``datetime.isoformat()`` per datetime,
+  and ``json.loads``, like Flask's default provider and ``requests.Response.json``
+* provider: the datetimes as is, encoded by ``dumps_bytes`` and decoded by
+  ``loads``, like ``FastJSONProvider`` and ``response_json``
+
+The median encoding and decoding times are printed for both. Without
+orjson installed, the provider falls back onto the stdlib json module, so
+both are expected to be on par.
+"""
+import json
+import os
+import statistics
+import sys
+import time
+
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.serialization import dumps_bytes, loads, orjson
+
+
+def cases(items: int) -> list:
+    """Get (microservice, response) per largest response type."""
+    created = [datetime(2023, 1, 1) + timedelta(seconds=i) for i in range(items)]
+    result = lambda rows: { "message": "Successful", "result": rows }
+    return [
+        ("songs", [[f"title {i}", f"artist {i % 500}"] for i in range(items)]),
+        ("accounts", result([{ "username": f"user{i}" } for i in range(items)])),
+        ("friends", result([{ "friend_name": f"user{i}", "created": created[i] } for i in range(items)])),
+        ("playlists", { **result([{ "artist": f"artist {i % 500}", "title": f"title {i}", "created": created[i] } for i in range(items)]),
+                        "id": 1, "owner": "bob", "title": "playlist", "created": created[0] }),
+        ("playlists_sharing", result([{ "recipient": "bob", "id": i, "owner": f"user{i}", "created": created[i],
+                                        "title": f"playlist {i}", "playlist_created": created[i] } for i in range(items)])),
+        ("activity_feed", result([{ "title": "Added a friend", "description": f"user{i} added bob as a friend",
+                                    "date": created[i] } for i in range(items)])),
+    ]
+
+
+def median(func, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"{items} items, median of {repeats}, provider backed by {'orjson ' + orjson.__version__ if orjson is not None else 'the stdlib json module'}")
+    for name, response in cases(items):
+        stdlib_encode = median(lambda: json.dumps(response, default=datetime.isoformat).encode("utf-8"), repeats)
+        fast_encode = median(lambda: dumps_bytes(response), repeats)
+        body = dumps_bytes(response)
+        stdlib_decode = median(lambda: json.loads(body), repeats)
+        fast_decode = median(lambda: loads(body), repeats)
+        print(f"{name:>17}: encode {stdlib_encode * 1000:7.2f} -> {fast_encode * 1000:6.2f} ms, "
+              f"decode {stdlib_decode * 1000:7.2f} -> {fast_decode * 1000:6.2f} ms, {len(body) / 2 ** 10:6.0f} KB")
@@ -0,0 +1,103 @@
+"""Measure the cost of the request instrumentation and of merging the worker snapshots, see :mod:`shared.metrics`.
+
+Usage: ::
+
+    python3 benchmarks/metrics.py [workers] [statements] [requests]
+
+Two costs are measured:
+
+* per request: *requests* requests, 20000 by default, to a route that
+  returns a constant, through the Flask test client, of an app with and
+  without :func:`shared.metrics.register_metrics`. The difference of the
+  median latencies is the cost of the instrumentation, i.e. the timer, the
+  in-flight gauge, the latency histogram and the request counter
+* per scrape: the metrics are populated with 20 routes of 4 status codes
+  and *statements* query fingerprints, 100 by default, and a snapshot of
+  them is written for every one of *workers* worker processes, 9 by
+  default, i.e. ``2 * 4 cores + 1``. The median time of collecting and
+  merging the snapshots, and of rendering the merged metrics, is printed,
+  together with the size of a single snapshot
+
+The workers are stand-in ``sleep`` processes, which merely keep their
+snapshots from being retired.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.config import config
+from shared.metrics import QUERY_DURATION, REGISTRY, REQUEST_DURATION, REQUESTS_TOTAL, register_metrics
+from shared.workerSnapshots import WORKER_SNAPSHOTS
+
+
+def median(func, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def request_latency(instrumented: bool, requests: int) -> float:
+    """Get the median latency of a request to a constant route, in seconds."""
+    app = Flask("instrumented" if instrumented else "plain")
+    app.config.update(config)
+    app.config["WORKER_STATE_DIR"] = ""
+    if instrumented:
+        register_metrics(app)
+
+    @app.route("/constant/<string:username>")
+    def constant(username: str):
+        return "constant"
+
+    client = app.test_client()
+    return median(lambda: client.get("/constant/bob"), requests)
+
+
+def populate(statements: int) -> None:
+    """Give the metrics the label sets of a busy microservice."""
+    for route in range(20):
+        for status in ("200", "404", "409", "503"):
+            REQUESTS_TOTAL.labels("GET", f"/route/{route}", status).inc()
+        REQUEST_DURATION.labels("GET", f"/route/{route}").observe(0.01)
+    for statement in range(statements):
+        QUERY_DURATION.labels(f"SELECT * FROM table_{statement} WHERE id = ?").observe(0.001)
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 9
+    statements = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+
+    plain, instrumented = request_latency(False, requests), request_latency(True, requests)
+    print(f"per request, median of {requests}: {plain * 1e6:.1f} us plain, {instrumented * 1e6:.1f} us instrumented "
+          f"({(instrumented - plain) * 1e6:+.1f} us)")
+
+    populate(statements)
+    processes = [subprocess.Popen(["sleep", "600"]) for _ in range(workers - 1)]
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            WORKER_SNAPSHOTS.configure(directory, interval=3600.0)
+            WORKER_SNAPSHOTS.write("metrics")
+            path = os.path.join(directory, f"metrics.{os.getpid()}.json")
+            with open(path) as file:
+                snapshot = file.read()
+            for process in processes:
+                with open(os.path.join(directory, f"metrics.{process.pid}.json"), "w") as file:
+                    file.write(snapshot)
+
+            merge = median(REGISTRY.aggregate, 200)
+            render = median(REGISTRY.render, 200)
+            print(f"per scrape, {workers} workers, {statements} statements, median of 200: merged in {merge * 1000:.2f} ms, "
+                  f"merged and rendered in {render * 1000:.2f} ms, {len(snapshot) / 2 ** 10:.0f} KB per snapshot")
+    finally:
+        for process in processes:
+            process.kill()
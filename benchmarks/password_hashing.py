@@ -0,0 +1,75 @@
+"""Measure the login throughput of the accounts password hashing, see :class:`accounts.passwords.PasswordHasher`.
+
+Usage: ::
+
+    python3 benchmarks/password_hashing.py [clients] [seconds]
+
+*clients* threads, 8 by default, verify passwords back to back for
+*seconds* seconds, 10 by default, at the hashing cost and thread count of
+the shared config, like logins on a single worker process. Meanwhile, a
+request thread repeatedly serializes an account, like ``Account.get``,
+to show that the hashing leaves the GIL to the request threads. The
+logins per second, the amount of logins shed with a 503, and the p50 of
+the request thread are printed.
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "accounts"))
+
+from shared.config import config
+from shared.exceptions import ServiceOverloaded
+from shared.serialization import dumps_bytes
+from passwords import PasswordHasher
+
+
+def login_client(hasher: PasswordHasher, stored: str, deadline: float, counts: dict, lock: threading.Lock) -> None:
+    while time.perf_counter() < deadline:
+        try:
+            hasher.verify("correct horse battery staple", stored)
+            outcome = "verified"
+        except ServiceOverloaded:
+            outcome = "shed"
+            time.sleep(0.01)
+        with lock:
+            counts[outcome] += 1
+
+
+def request_thread(deadline: float, latencies: list) -> None:
+    account = { "username": "bob", "password": "scrypt$...", "created_datetime": "2023-01-01T00:00:00" }
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        for _ in range(100):
+            dumps_bytes({ "success": True, "result": account })
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    hasher = PasswordHasher(n=config["PASSWORD_SCRYPT_N"], r=config["PASSWORD_SCRYPT_R"], p=config["PASSWORD_SCRYPT_P"],
+                            workers=config["PASSWORD_HASH_WORKERS"], max_queue=config["PASSWORD_HASH_QUEUE"])
+    stored = hasher.hash("correct horse battery staple")
+
+    # The request thread's baseline, without any hashing
+    baseline = []
+    request_thread(time.perf_counter() + 1.0, baseline)
+
+    counts, lock, latencies = { "verified": 0, "shed": 0 }, threading.Lock(), []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=login_client, args=(hasher, stored, deadline, counts, lock)) for _ in range(clients)]
+    threads.append(threading.Thread(target=request_thread, args=(deadline, latencies)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"{os.cpu_count()} cpu, n={config['PASSWORD_SCRYPT_N']}, r={config['PASSWORD_SCRYPT_R']}, p={config['PASSWORD_SCRYPT_P']}, "
+          f"{config['PASSWORD_HASH_WORKERS']} hashing threads, {clients} clients")
+    print(f"logins: {counts['verified'] / seconds:.1f}/s, shed: {counts['shed']}")
+    print(f"request thread p50: {sorted(latencies)[len(latencies) // 2] * 1000:.2f} ms while hashing, "
+          f"{sorted(baseline)[len(baseline) // 2] * 1000:.2f} ms without")
@@ -0,0 +1,111 @@
+"""Measure the planning time that prepared statements save on the read paths, see :mod:`shared.preparedStatements`.
+
+Usage: ::
+
+    python3 benchmarks/prepared_statements.py <friends|playlists> [host] [executions]
+
+Connects to the database of the microservice at *host*, ``localhost`` by
+default, with the credentials of the shared config. The database must
+hold data, e.g. that of a running deployment. From a container on the
+docker compose network: ::
+
+    docker compose run --rm -v "$PWD:/repo" -w /repo friends python3 benchmarks/prepared_statements.py friends friends_persistence
+
+For every read path statement of the microservice, its parameters are
+sampled from the stored rows, and then:
+
+* its planning time is read from ``EXPLAIN (ANALYZE, SUMMARY)``, once per
+  sample; this is the time a prepared statement no longer spends, once
+  PostgreSQL uses its generic plan
+* it is executed *executions* times, 1000 by default, cycling through the
+  samples, on a connection without prepared statements and on one that
+  prepares it on its first execution
+
+The median planning time and the median execution time of both
+connections are printed per statement.
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.config import config
+from shared.database import Database
+
+
+# Per microservice: (name, read path statement, sql that samples its parameters)
+READ_PATHS = {
+    "friends": [
+        ("friend list", "SELECT * FROM friend WHERE username = %s;",
+         "SELECT DISTINCT username FROM friend LIMIT 100;"),
+        ("friended by", "SELECT username, friendname, created_datetime FROM friend WHERE friendname = %s;",
+         "SELECT DISTINCT friendname FROM friend LIMIT 100;"),
+        ("friend", "SELECT * FROM friend WHERE username = %s AND friendname = %s;",
+         "SELECT username, friendname FROM friend LIMIT 100;"),
+        ("mutual friends", "SELECT mine.friendname FROM friend mine JOIN friend theirs ON mine.friendname = theirs.friendname "
+                           "WHERE mine.username = %s AND theirs.username = %s ORDER BY mine.friendname;",
+         "SELECT mine.username, theirs.username FROM friend mine JOIN friend theirs ON mine.friendname = theirs.friendname "
+         "WHERE mine.username <> theirs.username LIMIT 100;"),
+    ],
+    "playlists": [
+        ("playlists of a user", "SELECT * FROM playlist WHERE owner_username = %s;",
+         "SELECT DISTINCT owner_username FROM playlist LIMIT 100;"),
+        ("playlist", "SELECT * FROM playlist WHERE id = %s;",
+         "SELECT id FROM playlist LIMIT 100;"),
+        ("playlist songs", "SELECT * FROM playlist_song WHERE playlist_id = %s;",
+         "SELECT DISTINCT playlist_id FROM playlist_song LIMIT 100;"),
+    ],
+}
+
+
+def planning_time(conn, query: str, samples: list) -> float:
+    """Get the median planning time of a statement, in seconds."""
+    timings = []
+    with conn.cursor() as curs:
+        for sample in samples:
+            curs.execute(f"EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {query.rstrip().rstrip(';')};", sample)
+            timings.append(curs.fetchone()[0][0]["Planning Time"] / 1000)
+    conn.rollback()
+    return statistics.median(timings)
+
+
+def execution_time(conn, query: str, samples: list, executions: int) -> float:
+    """Get the median execution time of a statement, including fetching its rows, in seconds."""
+    timings = []
+    with conn.cursor() as curs:
+        for i in range(executions):
+            start = time.perf_counter()
+            curs.execute(query, samples[i % len(samples)])
+            curs.fetchall()
+            timings.append(time.perf_counter() - start)
+    conn.rollback()
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in READ_PATHS:
+        sys.exit(__doc__)
+    service = sys.argv[1]
+    host = sys.argv[2] if len(sys.argv) > 2 else "localhost"
+    executions = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+    unprepared = Database(service, config["POSTGRES_USER"], config["POSTGRES_PASSWORD"], host).connect()
+    prepared = Database(service, config["POSTGRES_USER"], config["POSTGRES_PASSWORD"], host,
+                        statement_cache_size=len(READ_PATHS[service]), prepare_threshold=1).connect()
+    print(f"{service} at {host}, median of {executions} executions")
+    for name, query, sampling in READ_PATHS[service]:
+        with unprepared.cursor() as curs:
+            curs.execute(sampling)
+            samples = [tuple(row) for row in curs.fetchall()]
+        unprepared.rollback()
+        if not samples:
+            print(f"{name:>20}: no rows to sample parameters from")
+            continue
+
+        planning = planning_time(unprepared, query, samples)
+        plain = execution_time(unprepared, query, samples, executions)
+        by_name = execution_time(prepared, query, samples, executions)
+        print(f"{name:>20}: planning {planning * 1000:6.3f} ms, executed {plain * 1000:6.3f} ms unprepared, "
+              f"{by_name * 1000:6.3f} ms prepared ({(plain - by_name) * 1000:+.3f} ms saved)")
@@ -0,0 +1,90 @@
+"""Compare the row model serializers to the per-row dicts and marshmallow round trip they replaced, see :mod:`shared.models`.
+
+Usage: ::
+
+    python3 benchmarks/row_models.py [rows] [repeats]
+
+For the list response of every row model, *rows* synthetic cursor rows,
+10000 by default, are serialized into a response body *repeats* times, 20
+by default, in two ways:
+
+* dicts: a dict per row with ``datetime.isoformat()``, serialized by the
+  stdlib json module, then validated and marshalled by the response schema,
+  like ``marshal_with_flask_enforced`` does for a plain json response
+* models: ``dumps_rows`` of the row model, wrapped by ``make_response_serialized``
+
+The median time and the peak memory allocated by a single serialization,
+measured with ``tracemalloc``, are printed for both.
+"""
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+from shared.models import make_response_serialized
+
+
+def load(service: str, module: str):
+    """Import a module of a microservice, whose module names clash with those of the others."""
+    spec = importlib.util.spec_from_file_location(f"{service}_{module}", os.path.join(ROOT, service, f"{module}.py"))
+    loaded = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(loaded)
+    return loaded
+
+
+def cases(rows: int) -> list:
+    """Get (name, rows, row model, response schema, per-row dict) per list response."""
+    accounts, friends = (load("accounts", "models"), load("accounts", "schemas")), (load("friends", "models"), load("friends", "schemas"))
+    playlists, sharing = (load("playlists", "models"), load("playlists", "schemas")), (load("playlists_sharing", "models"), load("playlists_sharing", "schemas"))
+    created = [datetime(2023, 1, 1) + timedelta(seconds=i) for i in range(rows)]
+    return [
+        ("accounts", [(f"user{i}", "scrypt$...") for i in range(rows)], accounts[0].Account, accounts[1].AccountsResponseSchema,
+         lambda row: { "username": row[0] }),
+        ("friends", [("bob", f"user{i}", created[i]) for i in range(rows)], friends[0].Friend, friends[1].FriendsResponseSchema,
+         lambda row: { "friend_name": row[1], "created": row[2].isoformat() }),
+        ("playlists", [(i, "bob", f"playlist {i}", created[i]) for i in range(rows)], playlists[0].Playlist, playlists[1].PlaylistsResponseSchema,
+         lambda row: { "id": row[0], "owner": row[1], "title": row[2], "created": row[3].isoformat() }),
+        ("playlists_sharing", [("bob", i, f"user{i}", created[i]) for i in range(rows)], sharing[0].PlaylistShare, sharing[1].SharedPlaylistsResponseSchema,
+         lambda row: { "recipient": row[0], "id": row[1], "owner": row[2], "created": row[3].isoformat() }),
+    ]
+
+
+def with_dicts(rows: list, schema, to_dict) -> bytes:
+    body = json.dumps({ "message": "Successful", "result": [to_dict(row) for row in rows] })
+    instance = schema()
+    return json.dumps(instance.dump(instance.load(json.loads(body)))).encode("utf-8")
+
+
+def with_models(rows: list, model) -> bytes:
+    return make_response_serialized("Successful", 200, result=model.dumps_rows(rows)).get_data()
+
+
+def measure(serialize, repeats: int) -> tuple:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        serialize()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    serialize()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"{rows} rows, median of {repeats}")
+    for name, data, model, schema, to_dict in cases(rows):
+        for label, serialize in (("dicts", lambda: with_dicts(data, schema, to_dict)), ("models", lambda: with_models(data, model))):
+            seconds, peak = measure(serialize, repeats)
+            print(f"{name:>17} {label:>6}: {seconds * 1000:8.2f} ms, peak {peak / 2 ** 20:7.2f} MB")
@@ -1,11 +1,18 @@
-from flask_apispec import MethodResource, doc
+import tempfile
+
+from flask_apispec import MethodResource, doc, use_kwargs
 from psycopg2.errors import UniqueViolation, OperationalError, InterfaceError
 
 from shared.utils import initialize_micro_service, marshal_with_flask_enforced
 from shared.microserviceInteractions import require_user_exists
-from shared.exceptions import DoesNotExist, MicroserviceConnectionError, get_409_already_exists, get_404_does_not_exist, get_500_database_error, get_502_bad_gateway_error
+from shared.exceptions import DoesNotExist, MicroserviceConnectionError, ServiceOverloaded, get_409_already_exists, get_404_does_not_exist, get_500_database_error, get_502_bad_gateway_error, get_503_service_overloaded
 from shared.APIResponses import GenericResponseMessages as E_MSG, make_response_error, make_response_message
-from schemas import FriendResponseSchema, FriendsResponseSchema, MicroservicesResponseSchema
+from shared.models import make_response_serialized
+from shared.caching import cached, invalidate
+from shared.replicas import reads_from_primary, register_read_own_writes
+from models import Friend as FriendModel, AddedBy as AddedByModel, Suggestion as SuggestionModel
+from graph import FriendGraph
+from schemas import AddedByResponseSchema, FriendResponseSchema, FriendsResponseSchema, MicroservicesResponseSchema, MutualFriendsResponseSchema, SuggestionsQuerySchema, SuggestionsResponseSchema
 
 
 MICROSERVICE_NAME = "friends"
@@ -16,7 +23,34 @@ APISPEC_CONFIG = {
     'APISPEC_TITLE': 'Microservices Friends',
     'APISPEC_VERSION': '1.0'
 }
-app, api, docs, conn = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG)
+DEPENDENCIES = ["accounts"]
+app, api, docs, db = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG, DEPENDENCIES)
+
+
+def load_friend_relations(since):
+    """Stream the friend relations created at or after a datetime, all relations if None."""
+    # Runs in the background loader, which returns its connection to the pool after every load
+    with db.checked_out():
+        # A named cursor streams the rows, instead of fetching all relations at once
+        with db.cursor(name="friend_graph") as curs:
+            curs.itersize = FriendGraph.LOAD_BATCH
+            if since is None:
+                curs.execute("SELECT username, friendname, created_datetime FROM friend;")
+            else:
+                curs.execute("SELECT username, friendname, created_datetime FROM friend WHERE created_datetime >= %s;", (since,))
+            yield from curs
+
+
+# All friend relations in memory, in both directions. The graph trails the
+# primary by up to a refresh interval, like a replica, so the reads that
+# must see the primary, e.g. right after a write, query the database
+# instead. Its responses are not cached, since the graph answers faster
+# than the cache, apart from the friend suggestions. Its snapshots are
+# shared by the workers of the server, through their shared directory
+graph = FriendGraph(load_friend_relations, app.config["WORKER_STATE_DIR"] or tempfile.mkdtemp(prefix="friend-graph-"),
+                    refresh_interval=app.config["FRIEND_GRAPH_REFRESH"], reload_interval=app.config["FRIEND_GRAPH_RELOAD"])
+if not db.replicas:
+    register_read_own_writes(app, window=app.config["READ_YOUR_WRITES_WINDOW"])
 
 
 class Friends(MethodResource):
@@ -43,17 +77,14 @@ class Friends(MethodResource):
         :return: The account's friend list
         """
 
-        with conn.cursor() as curs:
-            curs.execute("SELECT * FROM friend WHERE username = %s;", (username,))
-            res = [
-                {
-                    "friend_name": friend_name,
-                    "created": created.isoformat(),
-                }
-                for _, friend_name, created in curs.fetchall()
-            ]
+        rows = graph.friends(username) if not reads_from_primary() else None
+        if rows is None:
+            with db.cursor() as curs:
+                curs.execute("SELECT * FROM friend WHERE username = %s;", (username,))
+                rows = curs.fetchall()
+        res = FriendModel.dumps_rows(rows)
 
-        return make_response_message(E_MSG.SUCCESS, 200, result=res)
+        return make_response_serialized(E_MSG.SUCCESS, 200, result=res)
 
 
 class Friend(MethodResource):
@@ -81,7 +112,7 @@ class Friend(MethodResource):
         :return: The specified friend relation information
         """
 
-        with conn.cursor() as curs:
+        with db.cursor() as curs:
             curs.execute("SELECT * FROM friend WHERE username = %s AND friendname = %s;", (username, friendname))
             res = curs.fetchone()
 
@@ -90,7 +121,7 @@ class Friend(MethodResource):
         if res == None:
             raise DoesNotExist(f"the user '{username}' has not added the user '{friendname}' as a friend")
 
-        return make_response_message(E_MSG.SUCCESS, 200, friend_name=res[1], created=res[2].isoformat())
+        return make_response_serialized(E_MSG.SUCCESS, 200, model=FriendModel.from_row(res))
 
     @doc(description='Create a single Friend resource, which represents a friend relation between two users.', params={
         'username': {'description': 'The username of the sender (initiator) of the friend relation'},
@@ -106,25 +137,132 @@ class Friend(MethodResource):
         if username == friendname:
             return make_response_error(E_MSG.ERROR, "A user cannot add themselves as a friend", 400)
 
-        require_user_exists(username)
-        require_user_exists(friendname)
+        require_user_exists(username, max_stale=300)
+        require_user_exists(friendname, max_stale=300)
 
         # Duplicate username-friendname exception response is handled
         # by UniqueViolation error handler
-        with conn.cursor() as curs:
-            curs.execute('INSERT INTO friend ("username", "friendname") VALUES (%s, %s);', (username, friendname))
-            conn.commit()
+        with db.cursor() as curs:
+            curs.execute('INSERT INTO friend ("username", "friendname") VALUES (%s, %s) RETURNING created_datetime;', (username, friendname))
+            created = curs.fetchone()[0]
+            db.commit()
+
+        graph.add(username, friendname, created)
+        invalidate(f"user:{username}")
 
         return make_response_message(E_MSG.SUCCESS, 201)
 
 
+class AddedBy(MethodResource):
+    """The api endpoint that represents the collection of Friend resources of which a user is the receiver."""
+    @staticmethod
+    def route() -> str:
+        """Get the route to the AddedBy resource.
+
+        :return: The route string
+        """
+        return "/friended_by/<string:username>"
+
+    @doc(description='Get the collection of Friend resources of which a user is the receiver, which represents the users that added the user as a friend.', params={
+        'username': {'description': 'The username of the receiver (target) of the friend relations'}
+    })
+    @marshal_with_flask_enforced(AddedByResponseSchema, code=200)
+    def get(self, username: str):
+        """The query endpoint of the users that added a specific account as a friend.
+
+        :return: The friend relations of which the account is the receiver
+        """
+
+        edges = graph.added_by(username) if not reads_from_primary() else None
+        if edges is None:
+            with db.cursor() as curs:
+                curs.execute("SELECT username, friendname, created_datetime FROM friend WHERE friendname = %s;", (username,))
+                rows = curs.fetchall()
+        else:
+            rows = [(sender, username, created) for sender, created in edges]
+        res = AddedByModel.dumps_rows(rows)
+
+        return make_response_serialized(E_MSG.SUCCESS, 200, result=res)
+
+
+class MutualFriends(MethodResource):
+    """The api endpoint that represents the mutual friends of two users."""
+    @staticmethod
+    def route() -> str:
+        """Get the route to the MutualFriends resource.
+
+        :return: The route string
+        """
+        return f"{Friends.route()}/mutual/<string:othername>"
+
+    @doc(description='Get the users that two users both added as a friend.', params={
+        'username': {'description': 'The username of the one user'},
+        'othername': {'description': 'The username of the other user'}
+    })
+    @marshal_with_flask_enforced(MutualFriendsResponseSchema, code=200)
+    def get(self, username: str, othername: str):
+        """The query endpoint of the mutual friends of two specific accounts.
+
+        :return: The mutual friends, and their amount
+        """
+
+        mutual = graph.mutual_friends(username, othername) if not reads_from_primary() else None
+        if mutual is None:
+            with db.cursor() as curs:
+                curs.execute("SELECT mine.friendname FROM friend mine JOIN friend theirs ON mine.friendname = theirs.friendname "
+                             "WHERE mine.username = %s AND theirs.username = %s ORDER BY mine.friendname;", (username, othername))
+                mutual = [row[0] for row in curs.fetchall()]
+
+        return make_response_message(E_MSG.SUCCESS, 200, result=mutual, count=len(mutual))
+
+
+class Suggestions(MethodResource):
+    """The api endpoint that represents the suggested friends of a user.
+
+    The users that the user's friends added are ranked by their amount of
+    mutual friends with the user, and then by how recently they were added.
+    """
+    @staticmethod
+    def route() -> str:
+        """Get the route to the Suggestions resource.
+
+        :return: The route string
+        """
+        return "/friend_suggestions/<string:username>"
+
+    @doc(description='Get the suggested friends of a user, ranked by their amount of mutual friends and the recency of those friendships.', params={
+        'username': {'description': 'The username of the account to suggest friends to'}
+    })
+    @use_kwargs(SuggestionsQuerySchema, location='query')
+    @marshal_with_flask_enforced(SuggestionsResponseSchema, code=200)
+    # The user's own friend relations invalidate its suggestions, those of its friends only expire them
+    @cached(tags=("user:{username}",), ttl=app.config["FRIEND_SUGGESTIONS_TTL"])
+    def get(self, username: str, limit: int):
+        """The query endpoint of the suggested friends of a specific account.
+
+        :return: The suggested friends, best first
+        """
+
+        rows = graph.suggestions(username, limit) if not reads_from_primary() else None
+        if rows is None:
+            with db.cursor() as curs:
+                curs.execute("SELECT theirs.friendname, COUNT(*) AS mutual_friends, MAX(theirs.created_datetime) AS latest "
+                             "FROM friend mine JOIN friend theirs ON theirs.username = mine.friendname "
+                             "WHERE mine.username = %s AND theirs.friendname <> %s "
+                             "AND NOT EXISTS (SELECT 1 FROM friend known WHERE known.username = %s AND known.friendname = theirs.friendname) "
+                             "GROUP BY theirs.friendname ORDER BY mutual_friends DESC, latest DESC LIMIT %s;", (username, username, username, limit))
+                rows = curs.fetchall()
+
+        return make_response_serialized(E_MSG.SUCCESS, 200, result=SuggestionModel.dumps_rows(rows))
+
+
 @app.errorhandler(DoesNotExist)
 def handle_does_not_exist(e):
     return get_404_does_not_exist(e, append_error=True)
 
 @app.errorhandler(UniqueViolation)
 def handle_db_unique_violation(e):
-    conn.rollback()
+    db.rollback()
     return get_409_already_exists(e)
 
 @app.errorhandler(InterfaceError)
@@ -149,11 +287,21 @@ def handle_db_connection_error(e):
     """
     return get_502_bad_gateway_error(e, append_error=True)
 
+@app.errorhandler(ServiceOverloaded)
+def handle_service_overloaded(e):
+    return get_503_service_overloaded(e, append_error=True, retry_after=app.config["ADMISSION_RETRY_AFTER"])
+
 
 # Add resources
 api.add_resource(Friends, Friends.route())
 api.add_resource(Friend, Friend.route())
+api.add_resource(AddedBy, AddedBy.route())
+api.add_resource(Suggestions, Suggestions.route())
+api.add_resource(MutualFriends, MutualFriends.route())
 
 # Register apispec docs
 docs.register(Friends)
 docs.register(Friend)
+docs.register(AddedBy)
+docs.register(Suggestions)
+docs.register(MutualFriends)
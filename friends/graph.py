@@ -0,0 +1,516 @@
+import fcntl
+import heapq
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import psycopg2
+
+from shared.metrics import Counter as MetricCounter, Gauge
+
+
+FRIEND_GRAPH_EDGES = Gauge("friend_graph_edges", "The amount of friend relations in the in-memory friend graph of a worker")
+FRIEND_GRAPH_ERRORS = MetricCounter("friend_graph_load_errors_total", "The amount of failed friend graph loads, per kind of load", ("load",))
+
+logger = logging.getLogger("friends.graph")
+
+# Friendship times are stored as microseconds since this (naive, like the friend table's) datetime
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# A friend table row: (username, friendname, created_datetime)
+Edge = Tuple[str, str, datetime]
+
+
+class _Snapshot:
+    """A friend graph snapshot file, mapped read-only, so all workers share its pages.
+
+    The file holds the users and relations of a full load, see
+    :func:`_write_snapshot`, in sections that are 8 byte aligned:
+
+    * a header: magic, users, relations, hash table slots, name bytes, recent relations, newest friendship time
+    * an open addressing hash table of user ids, by the crc32 of their username
+    * the utf-8 usernames, and their offsets, in user id order
+    * per direction, the offsets of every user's relations, and the ids and friendship times of all relations
+    * the (user id, friend id, friendship time) of the relations within COMMIT_DELAY of the newest one
+    """
+    MAGIC = b"FRGRAPH1"
+    HEADER = struct.Struct("=8s6q")
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.users, self.edges, slots, name_bytes, recent, newest = _Snapshot.HEADER.unpack_from(self._map)
+        if magic != _Snapshot.MAGIC:
+            raise OSError(f"{path} is no friend graph snapshot")
+        self.newest = EPOCH + newest * MICROSECOND if self.edges else None
+
+        view, offset = memoryview(self._map), _Snapshot.HEADER.size
+
+        def section(typecode: str, count: int) -> memoryview:
+            nonlocal offset
+            size = count * struct.calcsize(typecode)
+            values = view[offset:offset + size].cast(typecode)
+            offset += -(-size // 8) * 8
+            return values
+
+        self._slots = section("i", slots)
+        self._name_offsets = section("q", self.users + 1)
+        self._names = section("B", name_bytes)
+        self._offsets, self._ids, self._created = {}, {}, {}
+        for forward in (True, False):
+            self._offsets[forward] = section("q", self.users + 1)
+            self._ids[forward] = section("i", self.edges)
+            self._created[forward] = section("q", self.edges)
+        self._recent = section("q", 3 * recent)
+
+    def id_of(self, username: str) -> Optional[int]:
+        name, mask = username.encode(), len(self._slots) - 1
+        slot = zlib.crc32(name) & mask
+        while (user := self._slots[slot]) >= 0:
+            if self._names[self._name_offsets[user]:self._name_offsets[user + 1]] == name:
+                return user
+            slot = (slot + 1) & mask
+        return None
+
+    def name_of(self, user: int) -> str:
+        return str(self._names[self._name_offsets[user]:self._name_offsets[user + 1]], "utf-8")
+
+    def degree(self, user: int, forward: bool) -> int:
+        offsets = self._offsets[forward]
+        return offsets[user + 1] - offsets[user]
+
+    def extend(self, user: int, forward: bool, ids: array, micros: array) -> None:
+        """Append the relations of a user, in one direction, to the id and friendship time buffers."""
+        start, end = self._offsets[forward][user], self._offsets[forward][user + 1]
+        ids.frombytes(self._ids[forward][start:end].cast("B"))
+        micros.frombytes(self._created[forward][start:end].cast("B"))
+
+    def recent(self) -> Dict[Tuple[int, int], int]:
+        """Get the friendship time of every relation within COMMIT_DELAY of the newest one."""
+        triples = self._recent
+        return { (triples[i], triples[i + 1]): triples[i + 2] for i in range(0, len(triples), 3) }
+
+
+class _Adjacency:
+    """The interned usernames and the relations of a friend graph, in both directions.
+
+    The users and relations of a *base* snapshot, if any, are shared and
+    never modified. Users and relations added on top of it are kept in
+    per-user ``array`` buffers of this process, and new users are assigned
+    the ids following those of the snapshot.
+    """
+    def __init__(self, base: Optional[_Snapshot] = None):
+        self.base = base
+        self.first = base.users if base is not None else 0
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.forward: Dict[int, array] = {}
+        self.forward_created: Dict[int, array] = {}
+        self.reverse: Dict[int, array] = {}
+        self.reverse_created: Dict[int, array] = {}
+        self.edges = 0
+
+    @property
+    def users(self) -> int:
+        return self.first + len(self.names)
+
+    @property
+    def total_edges(self) -> int:
+        return self.edges + (self.base.edges if self.base is not None else 0)
+
+    def id_of(self, username: str) -> Optional[int]:
+        user = self.ids.get(username)
+        if user is None and self.base is not None:
+            user = self.base.id_of(username)
+        return user
+
+    def name_of(self, user: int) -> str:
+        return self.names[user - self.first] if user >= self.first else self.base.name_of(user)
+
+    def intern(self, username: str) -> int:
+        """Get the id of a username, assigning one if new."""
+        user = self.id_of(username)
+        if user is None:
+            user = self.ids[username] = self.users
+            self.names.append(username)
+        return user
+
+    def append(self, user: int, friend: int, micros: int) -> None:
+        """Add a relation, which must not be known yet."""
+        for ids, created, key, other in ((self.forward, self.forward_created, user, friend),
+                                         (self.reverse, self.reverse_created, friend, user)):
+            if key not in ids:
+                ids[key], created[key] = array("i"), array("q")
+            ids[key].append(other)
+            created[key].append(micros)
+        self.edges += 1
+
+    def degree(self, user: int, forward: bool) -> int:
+        added = len((self.forward if forward else self.reverse).get(user, ()))
+        return added + (self.base.degree(user, forward) if self.base is not None and user < self.first else 0)
+
+    def edges_of(self, user: int, forward: bool) -> Tuple[array, array]:
+        """Get copies of the ids and friendship times of the relations of a user, in one direction."""
+        ids, micros = array("i"), array("q")
+        if self.base is not None and user < self.first:
+            self.base.extend(user, forward, ids, micros)
+        if user in (self.forward if forward else self.reverse):
+            ids.extend((self.forward if forward else self.reverse)[user])
+            micros.extend((self.forward_created if forward else self.reverse_created)[user])
+        return ids, micros
+
+
+def _write_snapshot(path: str, graph: _Adjacency, newest: Optional[datetime], recent: Dict[Tuple[int, int], int]) -> None:
+    """Write a fully loaded graph, without a base snapshot, into a snapshot file, see :class:`_Snapshot`."""
+    names = [name.encode() for name in graph.names]
+    slots = 1
+    while slots < 2 * len(names):
+        slots *= 2
+    table = array("i", [-1]) * slots
+    for user, name in enumerate(names):
+        slot = zlib.crc32(name) & (slots - 1)
+        while table[slot] >= 0:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = user
+
+    with open(path, "wb") as file:
+        def section(*chunks) -> None:
+            size = sum(file.write(chunk) for chunk in chunks)
+            file.write(bytes(-size % 8))
+
+        file.write(_Snapshot.HEADER.pack(_Snapshot.MAGIC, len(names), graph.edges, slots, sum(map(len, names)), len(recent),
+                                         (newest - EPOCH) // MICROSECOND if newest is not None else 0))
+        section(table)
+        section(array("q", accumulate(map(len, names), initial=0)))
+        section(*names)
+        empty = array("i")
+        for ids, created in ((graph.forward, graph.forward_created), (graph.reverse, graph.reverse_created)):
+            section(array("q", accumulate((len(ids.get(user, empty)) for user in range(len(names))), initial=0)))
+            section(*(ids[user] for user in range(len(names)) if user in ids))
+            section(*(created[user] for user in range(len(names)) if user in created))
+        section(array("q", [value for (user, friend), micros in recent.items() for value in (user, friend, micros)]))
+
+
+class FriendGraph:
+    """All friend relations in memory, in both directions.
+
+    Every username is interned to an integer id. Per user, the ids of the
+    users it added (forward edges) and of the users that added it (reverse
+    edges) are kept in compact buffers, each with a parallel buffer of
+    friendship times. An edge costs 24 bytes and no Python object, so
+    millions of relations fit in memory, and friend lists, reverse lookups
+    and mutual friends are answered without the database.
+
+    A single worker process at a time loads all relations, in a background
+    thread, and writes them to a snapshot file in *directory*, which is
+    shared by the workers of the server, see :class:`_Snapshot`. Every
+    worker maps the newest snapshot read-only, so its pages are shared,
+    and the relations are kept in memory once rather than per worker. The
+    snapshot is rebuilt every *reload_interval* seconds, which picks up
+    the relations that the polls missed, see :attr:`COMMIT_DELAY`. A failed
+    load is discarded and retried by whichever worker gets to it first.
+
+    On top of the snapshot, every worker polls for the relations created
+    since, every *refresh_interval* seconds, to pick up those added through
+    other processes and replicas. Relations added through the process
+    itself are added immediately, see :meth:`add`. These are kept by the
+    worker itself. Until a snapshot is mapped, every query returns None, so
+    the caller falls back to the database.
+    """
+    # Relations are polled from slightly before the newest known one, since
+    # a relation's created_datetime is its transaction's start, not its commit.
+    # A relation committed later than this after its start is missed by the
+    # polls, until the next snapshot
+    COMMIT_DELAY = timedelta(seconds=60)
+
+    # The amount of relations fetched per round trip while loading
+    LOAD_BATCH = 10000
+
+    def __init__(self, load: Callable[[Optional[datetime]], Iterable[Edge]], directory: str,
+                 refresh_interval: float, reload_interval: float):
+        """
+        :param load: Load the relations created at or after a datetime, all relations if None
+        :param directory: The directory shared by the workers of the server, to keep the snapshots in
+        :param refresh_interval: The time between two polls for new relations, in seconds
+        :param reload_interval: The maximum age of a snapshot, after which it is rebuilt, in seconds
+        """
+        self.load = load
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._graph: Optional[_Adjacency] = None
+        self._snapshot: Optional[str] = None
+        self._newest: Optional[datetime] = None
+        # The relations created within COMMIT_DELAY of the newest one, which overlapping polls return again
+        self._recent: Dict[Tuple[int, int], int] = {}
+
+    def _ensure_worker(self) -> None:
+        """Start the background loader of the calling process, if not started yet."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._reset()
+            threading.Thread(target=self._load_edges, name="friend-graph", daemon=True).start()
+
+    def _load_edges(self) -> None:
+        while True:
+            load = "full"
+            try:
+                snapshot = self._latest()
+                if snapshot is None or self._age(snapshot) >= self.reload_interval:
+                    snapshot = self._build() or snapshot
+                load = "poll"
+                if snapshot is not None and snapshot != self._snapshot:
+                    self._attach(snapshot)
+                if self._graph is not None:
+                    self._poll()
+            # Explicitly set output values, to ensure graceful failure is handled appropriately
+            except (psycopg2.Error, OSError) as e:
+                # Retry the full load from scratch, or the poll from the newest relation added so far
+                FRIEND_GRAPH_ERRORS.labels(load).inc()
+                logger.warning("Friend graph %s load failed: %s", load, e)
+            time.sleep(self.refresh_interval)
+
+    def _snapshots(self) -> List[str]:
+        """Get the paths of all snapshot files, oldest first."""
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("friend_graph.") and name.endswith(".bin"))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _latest(self) -> Optional[str]:
+        snapshots = self._snapshots()
+        return snapshots[-1] if snapshots else None
+
+    @staticmethod
+    def _age(snapshot: str) -> float:
+        """Get the time since the load of a snapshot started, in seconds."""
+        return time.time() - int(os.path.basename(snapshot).split(".")[1]) / 1e9
+
+    def _build(self) -> Optional[str]:
+        """Load all relations into a new snapshot, unless another worker is building one.
+
+        :return: The path of the newest snapshot, or None if another worker is building one
+        """
+        with open(os.path.join(self.directory, ".friend_graph.lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Mapped once the other worker has written it
+            except BlockingIOError:
+                return None
+            latest = self._latest()
+            if latest is not None and self._age(latest) < self.reload_interval:
+                return latest
+
+            started = time.time_ns()
+            graph, newest, recent = self._load_all()
+            path = os.path.join(self.directory, f"friend_graph.{started:020d}.bin")
+            _write_snapshot(path + ".tmp", graph, newest, recent)
+            # Replaced atomically, so no worker maps a partial snapshot
+            os.replace(path + ".tmp", path)
+            # The workers that still map an older one keep it until they map the new one
+            for older in self._snapshots()[:-1]:
+                os.remove(older)
+            return path
+
+    @staticmethod
+    def _cutoff(newest: datetime) -> int:
+        """Get the friendship time, in microseconds, before which no relation is polled again."""
+        return (newest - FriendGraph.COMMIT_DELAY - EPOCH) // MICROSECOND
+
+    def _load_all(self) -> Tuple[_Adjacency, Optional[datetime], Dict[Tuple[int, int], int]]:
+        """Load all relations into a new graph.
+
+        :return: The graph, the newest friendship time, and the relations within COMMIT_DELAY of it
+        """
+        graph = _Adjacency()
+        newest = None
+        recent: Dict[Tuple[int, int], int] = {}
+        limit = FriendGraph.LOAD_BATCH
+        # The friend table is UNIQUE (username, friendname), so no relation is loaded twice and none is looked up
+        for username, friendname, created in self.load(None):
+            user, friend = graph.intern(username), graph.intern(friendname)
+            micros = (created - EPOCH) // MICROSECOND
+            graph.append(user, friend, micros)
+            if newest is None or created > newest:
+                newest = created
+            if micros >= FriendGraph._cutoff(newest):
+                recent[(user, friend)] = micros
+                if len(recent) > limit:
+                    recent = FriendGraph._prune(recent, newest)
+                    limit = max(FriendGraph.LOAD_BATCH, 2 * len(recent))
+        return graph, newest, FriendGraph._prune(recent, newest) if newest is not None else {}
+
+    def _attach(self, path: str) -> None:
+        """Replace the graph by a new one on top of a snapshot, to which the next poll adds the relations created since."""
+        snapshot = _Snapshot(path)
+        recent = snapshot.recent()
+        with self._lock:
+            self._graph, self._snapshot, self._newest, self._recent = _Adjacency(snapshot), path, snapshot.newest, recent
+        FRIEND_GRAPH_EDGES.labels().set(snapshot.edges)
+
+    @staticmethod
+    def _prune(recent: Dict[Tuple[int, int], int], newest: datetime) -> Dict[Tuple[int, int], int]:
+        cutoff = FriendGraph._cutoff(newest)
+        return { edge: micros for edge, micros in recent.items() if micros >= cutoff }
+
+    def _poll(self) -> None:
+        """Add the relations created since shortly before the newest known one."""
+        since = self._newest - FriendGraph.COMMIT_DELAY if self._newest is not None else None
+        self._add_edges(list(self.load(since)))
+        with self._lock:
+            # Pruned up to the start of the next poll, never beyond it
+            if self._newest is not None:
+                self._recent = FriendGraph._prune(self._recent, self._newest)
+
+    def _add_edges(self, edges: Iterable[Edge]) -> None:
+        with self._lock:
+            graph = self._graph
+            if graph is None:
+                return  # The full load, or the first poll after it, picks the relations up
+            for username, friendname, created in edges:
+                user, friend = graph.intern(username), graph.intern(friendname)
+                # Polls overlap, and a relation added by this process is polled again
+                if (user, friend) in self._recent:
+                    continue
+                micros = (created - EPOCH) // MICROSECOND
+                graph.append(user, friend, micros)
+                self._recent[(user, friend)] = micros
+                if self._newest is None or created > self._newest:
+                    self._newest = created
+        FRIEND_GRAPH_EDGES.labels().set(graph.total_edges)
+
+    def add(self, username: str, friendname: str, created: datetime) -> None:
+        """Add a newly created friend relation.
+
+        :param username: The username of the sender of the friend relation
+        :param friendname: The username of the receiver of the friend relation
+        :param created: The time the friend relation was created
+        """
+        self._ensure_worker()
+        self._add_edges(((username, friendname, created),))
+
+    def _loaded(self) -> Optional[_Adjacency]:
+        """Get the graph of the calling process, or None if not loaded yet."""
+        self._ensure_worker()
+        return self._graph
+
+    def _edges_of(self, username: str, forward: bool) -> Optional[List[Tuple[str, datetime]]]:
+        graph = self._loaded()
+        if graph is None:
+            return None
+        user = graph.id_of(username)
+        if user is None:
+            return []
+        with self._lock:
+            ids, micros = graph.edges_of(user, forward)
+        return [(graph.name_of(other), EPOCH + at * MICROSECOND) for other, at in zip(ids, micros)]
+
+    def friends(self, username: str) -> Optional[List[Edge]]:
+        """Get the friend list of a user.
+
+        :param username: The username
+        :return: The user's friend relations as friend table rows, or None if the graph is not loaded yet
+        """
+        edges = self._edges_of(username, True)
+        return [(username, friendname, created) for friendname, created in edges] if edges is not None else None
+
+    def added_by(self, username: str) -> Optional[List[Tuple[str, datetime]]]:
+        """Get the users that added a user as a friend.
+
+        :param username: The username
+        :return: (The username of the sender, the time of the friend relation) per relation,
+        or None if the graph is not loaded yet
+        """
+        return self._edges_of(username, False)
+
+    def mutual_friends(self, username: str, othername: str) -> Optional[List[str]]:
+        """Get the users that two users both added as a friend.
+
+        :param username: The username of the one user
+        :param othername: The username of the other user
+        :return: The usernames of the mutual friends, in order, or None if the graph is not loaded yet
+        """
+        graph = self._loaded()
+        if graph is None:
+            return None
+        user, other = graph.id_of(username), graph.id_of(othername)
+        if user is None or other is None:
+            return []
+        with self._lock:
+            friends, other_friends = graph.edges_of(user, True)[0], graph.edges_of(other, True)[0]
+        if len(friends) > len(other_friends):
+            friends, other_friends = other_friends, friends
+        return sorted(graph.name_of(friend) for friend in set(friends).intersection(other_friends))
+
+    def suggestions(self, username: str, limit: int) -> Optional[List[Tuple[str, int, datetime]]]:
+        """Suggest friends for a user: the users its friends added, but it did not add yet.
+
+        The users are ranked by their amount of mutual friends with the user,
+        i.e. the amount of its friends that added them, and then by the most
+        recent time one of those friends added them. The mutual friends are
+        counted by ``collections.Counter`` over the friends' id buffers, in C.
+        Only the candidates that can make the top *limit* by count are then
+        looked at in python, to find their most recent friendship, through
+        their reverse edges if those are fewer than the friends' edges.
+
+        :param username: The username
+        :param limit: The maximum amount of suggestions
+        :return: (The username, the amount of mutual friends, the most recent friendship
+        with a mutual friend) per suggestion, best first, or None if the graph is not loaded yet
+        """
+        graph = self._loaded()
+        if graph is None:
+            return None
+        user = graph.id_of(username)
+        if user is None:
+            return []
+        with self._lock:
+            friends = graph.edges_of(user, True)[0]
+            adjacency = [graph.edges_of(friend, True) for friend in friends]
+
+        counts = Counter()
+        for ids, _ in adjacency:
+            counts.update(ids)
+        for known in (user, *friends):
+            counts.pop(known, None)
+        if not counts:
+            return []
+
+        threshold = heapq.nlargest(limit, counts.values())[-1]
+        eligible = [candidate for candidate, count in counts.items() if count >= threshold]
+        latest: Dict[int, int] = {}
+        with self._lock:
+            # Look at the friendships of the eligible candidates from their side, if they have fewer
+            reverse = [(candidate, *graph.edges_of(candidate, False)) for candidate in eligible] \
+                if sum(graph.degree(candidate, False) for candidate in eligible) < sum(len(ids) for ids, _ in adjacency) else None
+        if reverse is not None:
+            friend_set = set(friends)
+            for candidate, senders, micros in reverse:
+                latest[candidate] = max(at for sender, at in zip(senders, micros) if sender in friend_set)
+        else:
+            eligible = set(eligible)
+            for ids, micros in adjacency:
+                for candidate, at in zip(ids, micros):
+                    if candidate in eligible and at > latest.get(candidate, -1):
+                        latest[candidate] = at
+
+        ranked = heapq.nlargest(limit, latest, key=lambda candidate: (counts[candidate], latest[candidate]))
+        return [(graph.name_of(candidate), counts[candidate], EPOCH + latest[candidate] * MICROSECOND) for candidate in ranked]
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from shared.models import RowModel, Column
+
+
+class Friend(RowModel):
+    """The Friend relation information of a *friend* table row"""
+    columns = (
+        Column("friend_name", str, 1),
+        Column("created", datetime, 2),
+    )
+
+
+class Suggestion(RowModel):
+    """A suggested friend, see :meth:`graph.FriendGraph.suggestions`"""
+    columns = (
+        Column("username", str, 0),
+        Column("mutual_friends", int, 1),
+        Column("latest", datetime, 2),
+    )
+
+
+class AddedBy(RowModel):
+    """The Friend relation information of a *friend* table row, from the side of its receiver"""
+    columns = (
+        Column("username", str, 0),
+        Column("created", datetime, 2),
+    )
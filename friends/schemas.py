@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
 
 from shared.schemas import MicroservicesResponseSchema, MicroservicesResultSchema
 
@@ -13,6 +13,29 @@ class FriendSchema(Schema):
     })
 
 
+class AddedBySchema(Schema):
+    """The information of a friend relation, from the side of its receiver"""
+    username = fields.String(required=True, metadata={
+        'description': 'The username of the sender (initiator) of the friend relation',
+    })
+    created = fields.DateTime(format="iso", required=True, metadata={
+        'description': 'The ISO8601 date time at which the friendship relationship was started'
+    })
+
+
+class SuggestionSchema(Schema):
+    """The information of a suggested friend"""
+    username = fields.String(required=True, metadata={
+        'description': 'The username of the suggested friend',
+    })
+    mutual_friends = fields.Integer(required=True, metadata={
+        'description': 'The amount of friends of the user that added the suggested friend',
+    })
+    latest = fields.DateTime(format="iso", required=True, metadata={
+        'description': 'The ISO8601 date time at which a friend of the user most recently added the suggested friend'
+    })
+
+
 class FriendResponseSchema(MicroservicesResponseSchema, FriendSchema):
     """The output format of the Friend resource endpoint"""
     pass
@@ -23,3 +46,34 @@ class FriendsResponseSchema(MicroservicesResultSchema):
     result = fields.List(fields.Nested(FriendSchema), required=True, default=[], metadata={
         'description': 'The friend list of a user; the list of all friend relations information of a user',
     })
+
+
+class AddedByResponseSchema(MicroservicesResultSchema):
+    """The output format of the AddedBy resource endpoint"""
+    result = fields.List(fields.Nested(AddedBySchema), required=True, default=[], metadata={
+        'description': 'The friend relations of which a user is the receiver',
+    })
+
+
+class SuggestionsResponseSchema(MicroservicesResultSchema):
+    """The output format of the Suggestions resource endpoint"""
+    result = fields.List(fields.Nested(SuggestionSchema), required=True, default=[], metadata={
+        'description': 'The suggested friends, best first',
+    })
+
+
+class SuggestionsQuerySchema(Schema):
+    """The query parameters of the friend suggestions"""
+    limit = fields.Integer(required=False, load_default=10, location='query', validate=validate.Range(min=1, max=100), metadata={
+        'description': 'The maximum amount of suggested friends to return',
+    })
+
+
+class MutualFriendsResponseSchema(MicroservicesResultSchema):
+    """The output format of the MutualFriends resource endpoint"""
+    result = fields.List(fields.String, required=True, default=[], metadata={
+        'description': 'The usernames that both users added as a friend, in order',
+    })
+    count = fields.Integer(required=True, metadata={
+        'description': 'The amount of mutual friends',
+    })
@@ -12,4 +12,6 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "friends" <<-EOSQL
         created_datetime TIMESTAMP NOT NULL DEFAULT now(),
         UNIQUE (username, friendname)
     );
+    CREATE INDEX friend_friendname ON friend (friendname);
+    CREATE INDEX friend_created_datetime ON friend (created_datetime);
 EOSQL
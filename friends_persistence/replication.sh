@@ -0,0 +1,4 @@
+#!/bin/bash
+
+# Allow the streaming replicas of the 'replicas' docker compose profile to connect
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
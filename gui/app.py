@@ -1,22 +1,178 @@
-from flask import Flask, render_template, redirect, request, url_for
+import time
+
+from flask import Flask, g, jsonify, make_response, render_template, redirect, request, session, url_for
+from markupsafe import Markup
 import requests
 
+from shared.microserviceInteractions import service_get, service_request
+from shared.fanout import gather
+from shared.metrics import register_metrics
+from shared.caching import cached, register_cache
+from shared.sessionTokens import verify_session_token
+from shared.config import config
+
+from fragments import FragmentCache
+
 app = Flask(__name__)
+app.config.from_mapping(config)
+# Fail closed: without its secrets, the GUI could neither keep sessions nor verify logins
+if not config["GUI_SECRET_KEY"] or not config["SESSION_SECRET"]:
+    raise RuntimeError("the GUI_SECRET_KEY and SESSION_SECRET environment variables must be set")
+app.secret_key = config["GUI_SECRET_KEY"]
+register_metrics(app)   # The http_request_duration_seconds metric is the render latency of every page
+register_cache(app)
+
+# The time a page waits for its downstream requests, after which it is rendered with whatever arrived in time
+PAGE_DEADLINE = config["GUI_PAGE_DEADLINE"]
+
+# The time a form submission waits for the microservice that performs it
+WRITE_TIMEOUT = config["GUI_WRITE_TIMEOUT"]
 
+# The amount of songs per catalogue page
+CATALOGUE_PAGE_SIZE = 50
 
-# The Username & Password of the currently logged-in User
-username = None
-password = None
+# The rendered fragments of the pages, reused while their microservice data is unchanged
+FRAGMENTS = FragmentCache(max_entries=config["GUI_FRAGMENT_CACHE_SIZE"])
 
-session_data = dict()
+
+# Every client keeps its own session in a signed cookie, so any GUI worker serves any client
+SESSION_TOKEN_KEY = "session_token"
 
 
 def save_to_session(key, value):
-    session_data[key] = value
+    session[key] = value
 
 
 def load_from_session(key):
-    return session_data.pop(key) if key in session_data else None  # Pop to ensure that it is only used once
+    return session.pop(key, None)  # Pop to ensure that it is only used once
+
+
+def logged_in_username():
+    """Get the username of the client's logged-in User.
+
+    The User is identified by the session token that the accounts microservice
+    issued on login, which is verified locally, without any request.
+
+    :return: The username, or None if the client is not logged in or its session expired
+    """
+    token = session.get(SESSION_TOKEN_KEY)
+    return verify_session_token(token, config["SESSION_SECRET"]) if token else None
+
+
+# The time until which the client's reads go to the primary databases, after it wrote, see shared.replicas
+READ_PRIMARY_KEY = "read_primary_until"
+
+
+@app.before_request
+def load_read_consistency():
+    g.read_primary_until = session.get(READ_PRIMARY_KEY, 0)
+
+
+@app.after_request
+def save_read_consistency(response):
+    until = g.get("read_primary_until", 0)
+    if until > time.time():
+        if until != session.get(READ_PRIMARY_KEY):
+            session[READ_PRIMARY_KEY] = until
+    elif READ_PRIMARY_KEY in session:
+        session.pop(READ_PRIMARY_KEY)
+    return response
+
+
+def fetch_result(service_name, path):
+    """Get the 'result' list of a microservice resource, within the page deadline.
+
+    Raise the `requests` exceptions if the microservice cannot be reached in time.
+
+    :param service_name: The name of the microservice
+    :param path: The path of the resource, including the query string
+    :return: The result list, empty if the microservice did not answer successfully
+    """
+    response = service_get(service_name, path, timeout=PAGE_DEADLINE)
+    if response.status_code != 200:
+        return []
+    return response.json().get("result", list())
+
+
+def fetch_fragment(template, service_name, path, build):
+    """Render a fragment of the 'result' list of a microservice resource, within the page deadline.
+
+    The resource is revalidated with the ETag of the cached fragment, if
+    any, so the fragment is only rendered again if the resource changed.
+    Raise the `requests` exceptions if the microservice cannot be reached in time.
+
+    :param template: The fragment template
+    :param service_name: The name of the microservice
+    :param path: The path of the resource, including the query string
+    :param build: Turn the result list into the template context
+    :return: The rendered fragment
+    """
+    key = f"{template}:{service_name}{path}"
+    entry = FRAGMENTS.lookup(key)
+    headers = { "If-None-Match": entry[0] } if entry is not None else {}
+    response = service_get(service_name, path, headers=headers, timeout=PAGE_DEADLINE)
+    if response.status_code == 304 and entry is not None:
+        return FRAGMENTS.reuse(template, entry)
+    if response.status_code != 200:
+        return FRAGMENTS.render(key, None, template, **build([]))
+    return FRAGMENTS.render(key, response.headers.get("ETag"), template, **build(response.json().get("result", list())))
+
+
+def empty_fragment(template, build):
+    """Render a fragment without data, for a microservice that could not be reached in time."""
+    return Markup(render_template(template, **build([])))
+
+
+def build_feed(result):
+    return { "feed": [
+        (activity["date"], activity["title"], activity["description"])
+        for activity in result
+        if "date" in activity and "title" in activity and "description" in activity
+    ] }
+
+
+def build_friend_list(result):
+    return { "friend_list": [
+        friend_name
+        for friend_info in result
+        if (friend_name := friend_info.get("friend_name", None)) is not None
+    ] }
+
+
+def build_playlists(result):
+    return { "playlists": [
+        (playlist["id"], playlist["title"])
+        for playlist in result
+        if "id" in playlist and "title" in playlist
+    ] }
+
+
+@cached(tags=("songs",))
+def catalogue_page(query, after_artist, after_title, after_match):
+    """Render a single page of catalogue rows, searched and paginated by the songs microservice.
+
+    The rendered rows are cached, so popular pages are neither fetched nor
+    rendered again until the cache entry expires, or the songs microservice
+    invalidates its songs through a shared cache backend.
+    Raise the `requests` exceptions if the page cannot be fetched in time.
+
+    :param query: The prefix of the artists or titles to search for
+    :param after_artist: The artist of the last song of the previous page, None for the first page
+    :param after_title: The title of the last song of the previous page, None for the first page
+    :param after_match: Whether the last song of the previous search page matched by artist or title, None for the first page
+    :return: (The rendered rows, the url of the next page of rows or None for the last page)
+    """
+    params = { "q": query, "after_artist": after_artist, "after_title": after_title, "after_match": after_match,
+               "limit": CATALOGUE_PAGE_SIZE }
+    response = service_get("songs", "/songs/page/", params=params, timeout=PAGE_DEADLINE)
+    response.raise_for_status()
+    page = response.json()
+
+    next_url = None
+    if page["next"] is not None:
+        next_url = url_for("catalogue_rows", q=query, after_artist=page["next"]["artist"], after_title=page["next"]["title"],
+                           after_match=page["next"].get("match"))
+    return Markup(render_template('catalogue_rows.html', songs=page["songs"])), next_url
 
 
 @app.route("/")
@@ -27,46 +183,62 @@ def feed():
     # Get the feed of the last N activities of your friends.
     # ================================
 
-    global username
+    username = logged_in_username()
 
     N = 10
 
+    feed = None
     if username is not None:
-        feed = []  # TODO: call
         try:
-            response = requests.get(f"http://activity_feed:5000/feeds/{username}?amount={N}")
-            if response.status_code == 200:
-                feed = [
-                    (activity["date"], activity["title"], activity["description"])
-                    for activity in response.json().get("result", [])
-                    if "date" in activity and "title" in activity and "description" in activity
-                ]
+            feed = fetch_fragment("feed_items.html", "activity_feed", f"/feeds/{username}?amount={N}", build_feed)
         # Explicitly set output values, to ensure graceful failure is handled appropriately
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-            feed = []
+        except requests.exceptions.RequestException:
+            feed = None     # Failed or late requests render as an empty feed
 
-    else:
-        feed = []
+    feed = feed or empty_fragment("feed_items.html", build_feed)
 
-    return render_template('feed.html', username=username, password=password, feed=feed)
+    return render_template('feed.html', username=username, feed=feed)
 
 
 @app.route("/catalogue")
 def catalogue():
+    query = request.args.get("q", "")
+
     try:
-        songs = requests.get("http://songs:5000/songs").json()
+        rows, next_url = catalogue_page(query=query, after_artist=None, after_title=None, after_match=None)
     # Explicitly set output values, to ensure graceful failure is handled appropriately
-    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-        songs = []
+    except requests.exceptions.RequestException:
+        rows, next_url = None, None
+
+    return render_template('catalogue.html', username=logged_in_username(), query=query, rows=rows, next_url=next_url)
 
-    return render_template('catalogue.html', username=username, password=password, songs=songs)
+
+@app.route("/catalogue/rows")
+def catalogue_rows():
+    """The next page of catalogue rows, as an html fragment, for the 'Load more' button.
+
+    The url of the page after it is passed in the X-Next-Page header.
+    """
+    try:
+        rows, next_url = catalogue_page(query=request.args.get("q", ""),
+                                        after_artist=request.args.get("after_artist"),
+                                        after_title=request.args.get("after_title"),
+                                        after_match=request.args.get("after_match"))
+    # Explicitly set output values, to ensure graceful failure is handled appropriately
+    except requests.exceptions.RequestException:
+        return "", 502
+
+    response = make_response(rows)
+    if next_url is not None:
+        response.headers["X-Next-Page"] = next_url
+    return response
 
 
 @app.route("/login")
 def login_page():
 
     success = load_from_session('success')
-    return render_template('login.html', username=username, password=password, success=success)
+    return render_template('login.html', username=logged_in_username(), success=success)
 
 
 @app.route("/login", methods=['POST'])
@@ -81,22 +253,22 @@ def actual_login():
     # Also pay attention to the status code returned by the microservice.
     # ================================
     success = False
+    token = None
 
     try:
         data = { "password": req_password }
-        response = requests.post(f"http://accounts:5000/accounts/{req_username}/auth", data=data)
+        response = service_request("POST", "accounts", f"/accounts/{req_username}/auth", data=data, timeout=WRITE_TIMEOUT)
         if response.status_code == 200:
             success = response.json().get("authentication_data", False)
+            token = response.json().get("session_token", None)
     # Explicitly set output values, to ensure graceful failure is handled appropriately
     except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
         success = False
+        token = None
 
     save_to_session('success', success)
-    if success:
-        global username, password
-
-        username = req_username
-        password = req_password
+    if success and token is not None:
+        save_to_session(SESSION_TOKEN_KEY, token)
 
     return redirect('/login')
 
@@ -104,7 +276,7 @@ def actual_login():
 @app.route("/register")
 def register_page():
     success = load_from_session('success')
-    return render_template('register.html', username=username, password=password, success=success)
+    return render_template('register.html', username=logged_in_username(), success=success)
 
 
 @app.route("/register", methods=['POST'])
@@ -122,23 +294,23 @@ def actual_register():
     # ================================
 
     success = False
+    token = None
 
     try:
         data = { "password": req_password }
-        response = requests.post(f"http://accounts:5000/accounts/{req_username}", data=data)
+        response = service_request("POST", "accounts", f"/accounts/{req_username}", data=data, timeout=WRITE_TIMEOUT)
         if response.status_code == 201:
             success = True
+            token = response.json().get("session_token", None)
     # Explicitly set output values, to ensure graceful failure is handled appropriately
     except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
         success = False
+        token = None
 
     save_to_session('success', success)
 
-    if success:
-        global username, password
-
-        username = req_username
-        password = req_password
+    if success and token is not None:
+        save_to_session(SESSION_TOKEN_KEY, token)
 
     return redirect('/register')
 
@@ -147,7 +319,7 @@ def actual_register():
 def friends():
     success = load_from_session('success')
 
-    global username
+    username = logged_in_username()
 
     # ================================
     # FEATURE 4
@@ -155,23 +327,34 @@ def friends():
     # Get a list of friends for the currently logged-in user
     # ================================
 
+    friend_list = None
     if username is not None:
-        friend_list = []
         try:
-            response = requests.get(f"http://friends:5000/friends/{username}")
+            friend_list = fetch_fragment("friend_rows.html", "friends", f"/friends/{username}", build_friend_list)
+        # Explicitly set output values, to ensure graceful failure is handled appropriately
+        except requests.exceptions.RequestException:
+            friend_list = None  # Failed or late requests render as an empty friend list
+
+    friend_list = friend_list or empty_fragment("friend_rows.html", build_friend_list)
+
+    return render_template('friends.html', username=username, success=success, friend_list=friend_list)
+
+
+@app.route("/users/suggestions")
+def username_suggestions():
+    prefix = request.args.get("prefix", "")
+    usernames = []
+
+    if prefix:
+        try:
+            response = service_get("accounts", "/accounts/", params={ "prefix": prefix, "limit": 10 }, timeout=PAGE_DEADLINE)
             if response.status_code == 200:
-                friend_list = [
-                    friend_name
-                    for friend_info in response.json().get("result", list())
-                    if (friend_name := friend_info.get("friend_name", None)) is not None
-                ]
+                usernames = [account["username"] for account in response.json().get("result", list()) if "username" in account]
         # Explicitly set output values, to ensure graceful failure is handled appropriately
         except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-            friend_list = []
-    else:
-        friend_list = []
+            usernames = []
 
-    return render_template('friends.html', username=username, password=password, success=success, friend_list=friend_list)
+    return jsonify(usernames)
 
 
 @app.route("/add_friend", methods=['POST'])
@@ -184,13 +367,13 @@ def add_friend():
     # microservice returns True if the friend request is successful (the friend exists & is not already friends), False if otherwise
     # ==============================
 
-    global username
+    username = logged_in_username()
     req_username = request.form['username']
 
     success = False
 
     try:
-        response = requests.post(f"http://friends:5000/friends/{username}/{req_username}")
+        response = service_request("POST", "friends", f"/friends/{username}/{req_username}", timeout=WRITE_TIMEOUT)
         if response.status_code == 201:
             success = True
     # Explicitly set output values, to ensure graceful failure is handled appropriately
@@ -204,10 +387,10 @@ def add_friend():
 
 @app.route('/playlists')
 def playlists():
-    global username
+    username = logged_in_username()
 
-    my_playlists = []
-    shared_with_me = []
+    my_playlists = empty_fragment("playlist_rows.html", build_playlists)
+    shared_with_me = empty_fragment("playlist_rows.html", build_playlists)
 
     if username is not None:
         # ================================
@@ -216,35 +399,16 @@ def playlists():
         # Get all playlists you created and all playlist that are shared with you. (list of id, title pairs)
         # ================================
 
-        my_playlists = []
-        shared_with_me = []  # TODO: call
+        # Both lists are fetched concurrently, failed or late requests render as an empty list
+        results = gather({
+            "mine": lambda: fetch_fragment("playlist_rows.html", "playlists", f"/playlists/{username}", build_playlists),
+            "shared": lambda: fetch_fragment("playlist_rows.html", "playlists_sharing",
+                                             f"/playlists/{username}/shared?usernameIdentity=recipient", build_playlists),
+        }, deadline=PAGE_DEADLINE)
+        my_playlists = results["mine"] or my_playlists
+        shared_with_me = results["shared"] or shared_with_me
 
-        try:
-            response = requests.get(f"http://playlists:5000/playlists/{username}")
-            if response.status_code == 200:
-                my_playlists = [
-                    (playlist["id"], playlist["title"])
-                    for playlist in response.json().get("result", list())
-                    if "id" in playlist and "title" in playlist
-                ]
-        # Explicitly set output values, to ensure graceful failure is handled appropriately
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-            my_playlists = []
-
-        try:
-            response = requests.get(f"http://playlists_sharing:5000/playlists/{username}/shared?usernameIdentity=recipient")
-            if response.status_code == 200:
-                shared_playlists = response.json().get("result", list())
-                shared_with_me = [
-                    (shared_playlist["id"], shared_playlist["title"])
-                    for shared_playlist in shared_playlists
-                    if "id" in shared_playlist and "title" in shared_playlist
-                ]
-        # Explicitly set output values, to ensure graceful failure is handled appropriately
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-            shared_with_me = []
-
-    return render_template('playlists.html', username=username, password=password, my_playlists=my_playlists, shared_with_me=shared_with_me)
+    return render_template('playlists.html', username=username, my_playlists=my_playlists, shared_with_me=shared_with_me)
 
 
 @app.route('/create_playlist', methods=['POST'])
@@ -254,12 +418,12 @@ def create_playlist():
     #
     # Create a playlist by sending the owner and the title to the microservice.
     # ================================
-    global username
+    username = logged_in_username()
     title = request.form['title']
 
     try:
         data = { "title": title }
-        requests.post(f"http://playlists:5000/playlists/{username}", data=data)
+        service_request("POST", "playlists", f"/playlists/{username}", data=data, timeout=WRITE_TIMEOUT)
     # Explicitly set output values, to ensure graceful failure is handled appropriately
     except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
         pass    # No output value required
@@ -274,21 +438,19 @@ def a_playlist(playlist_id):
     #
     # List all songs within a playlist
     # ================================
-    songs = []
-
     try:
-        response = requests.get(f"http://playlists:5000/playlists/{playlist_id}")
-        if response.status_code == 200:
-            songs = [
-                (song["title"], song["artist"])
-                for song in response.json().get("result", list())
-                if "title" in song and "artist" in song
-            ]
+        result = fetch_result("playlists", f"/playlists/{playlist_id}")
     # Explicitly set output values, to ensure graceful failure is handled appropriately
-    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-        songs = []
+    except requests.exceptions.RequestException:
+        result = []     # Failed or late requests render as an empty playlist
 
-    return render_template('a_playlist.html', username=username, password=password, songs=songs, playlist_id=playlist_id)
+    songs = [
+        (song["title"], song["artist"])
+        for song in result
+        if "title" in song and "artist" in song
+    ]
+
+    return render_template('a_playlist.html', username=logged_in_username(), songs=songs, playlist_id=playlist_id)
 
 
 @app.route('/add_song_to/<int:playlist_id>', methods=["POST"])
@@ -305,7 +467,7 @@ def add_song_to_playlist(playlist_id):
             "artist": artist,
             "title": title
         }
-        requests.put(f"http://playlists:5000/playlists/{playlist_id}", data=data)
+        service_request("PUT", "playlists", f"/playlists/{playlist_id}", data=data, timeout=WRITE_TIMEOUT)
     # Explicitly set output values, to ensure graceful failure is handled appropriately
     except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
         pass    # No output value required
@@ -323,7 +485,7 @@ def invite_user_to_playlist(playlist_id):
     recipient = request.form['user']
 
     try:
-        requests.post(f"http://playlists_sharing:5000/playlists/{recipient}/shared/{playlist_id}")
+        service_request("POST", "playlists_sharing", f"/playlists/{recipient}/shared/{playlist_id}", timeout=WRITE_TIMEOUT)
     # Explicitly set output values, to ensure graceful failure is handled appropriately
     except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
         pass    # No output value required
@@ -333,8 +495,5 @@ def invite_user_to_playlist(playlist_id):
 
 @app.route("/logout")
 def logout():
-    global username, password
-
-    username = None
-    password = None
+    session.pop(SESSION_TOKEN_KEY, None)
     return redirect('/')
@@ -0,0 +1,83 @@
+import threading
+
+from collections import OrderedDict
+from time import perf_counter
+from typing import Optional, Tuple
+
+from flask import render_template
+from markupsafe import Markup
+
+from shared.metrics import Counter, Histogram
+
+
+FRAGMENT_LOOKUPS = Counter("gui_fragment_cache_total", "The amount of rendered fragment lookups, per fragment template and result", ("fragment", "result"))
+FRAGMENT_RENDER_DURATION = Histogram("gui_fragment_render_seconds", "The time spent rendering fragments that were not cached", ("fragment",))
+
+
+class FragmentCache:
+    """Rendered template fragments, keyed on the ETag of the microservice data they render.
+
+    A page revalidates the data of each of its fragments with the ETag of
+    the cached fragment. If the microservice answers 304 Not Modified, the
+    cached fragment is reused as is, so only the fragments whose data
+    changed are rendered again. ::
+
+        entry = fragments.lookup(key)
+        ...  # GET the data, with 'If-None-Match: <entry ETag>'
+        if not_modified:
+            fragment = fragments.reuse("friend_rows.html", entry)
+        else:
+            fragment = fragments.render(key, etag, "friend_rows.html", friend_list=friends)
+    """
+    def __init__(self, max_entries: int):
+        """
+        :param max_entries: The maximum amount of cached fragments, the least recently used are evicted
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, Markup]]" = OrderedDict()
+
+    def lookup(self, key: str) -> Optional[Tuple[str, Markup]]:
+        """Get a cached fragment, to revalidate it.
+
+        :param key: The fragment key, e.g. the fragment template and the url of its data
+        :return: (The ETag of the fragment's data, the fragment), None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def reuse(self, template: str, entry: Tuple[str, Markup]) -> Markup:
+        """Reuse a looked up fragment, whose data turned out unchanged.
+
+        :param template: The fragment template
+        :param entry: The looked up entry
+        :return: The fragment
+        """
+        FRAGMENT_LOOKUPS.labels(template, "hit").inc()
+        return entry[1]
+
+    def render(self, key: str, etag: Optional[str], template: str, **context) -> Markup:
+        """Render a fragment, and cache it if its data has an ETag.
+
+        :param key: The fragment key
+        :param etag: The ETag of the fragment's data, None to never cache the fragment
+        :param template: The fragment template
+        :param context: The template context
+        :return: The fragment
+        """
+        FRAGMENT_LOOKUPS.labels(template, "miss").inc()
+        start = perf_counter()
+        fragment = Markup(render_template(template, **context))
+        FRAGMENT_RENDER_DURATION.labels(template).observe(perf_counter() - start)
+
+        if etag is not None:
+            with self._lock:
+                self._entries[key] = (etag, fragment)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return fragment
@@ -3,8 +3,11 @@ from psycopg2.errors import UniqueViolation, OperationalError, InterfaceError
 
 from shared.utils import initialize_micro_service, marshal_with_flask_enforced
 from shared.microserviceInteractions import require_user_exists, require_song_exists
-from shared.exceptions import DoesNotExist, MicroserviceConnectionError, get_409_already_exists, get_404_does_not_exist, get_500_database_error, get_502_bad_gateway_error
+from shared.exceptions import DoesNotExist, MicroserviceConnectionError, ServiceOverloaded, get_409_already_exists, get_404_does_not_exist, get_500_database_error, get_502_bad_gateway_error, get_503_service_overloaded
 from shared.APIResponses import GenericResponseMessages as E_MSG, make_response_error, make_response_message
+from shared.models import make_response_serialized
+from shared.caching import cached, invalidate
+from models import Playlist as PlaylistModel, PlaylistSong as PlaylistSongModel
 from schemas import MicroservicesResponseSchema, PlaylistResponseSchema, PlaylistsResponseSchema, PlaylistSongBodySchema, PlaylistMetaResponseSchema, PlaylistMetaBodySchema
 
 
@@ -16,7 +19,8 @@ APISPEC_CONFIG = {
     'APISPEC_TITLE': 'Microservices Playlists',
     'APISPEC_VERSION': '1.0'
 }
-app, api, docs, conn = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG)
+DEPENDENCIES = ["accounts", "songs"]
+app, api, docs, db = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG, DEPENDENCIES)
 
 
 class Playlists(MethodResource):
@@ -37,25 +41,18 @@ class Playlists(MethodResource):
         'username': {'description': 'The username to fetch the list of playlists of'},
     })
     @marshal_with_flask_enforced(PlaylistsResponseSchema, code=200)
+    @cached(tags=("user:{username}",))
     def get(self, username: str):
         """The query endpoint of the collection of Playlist resource for a user.
 
         :return: The list of the user's playlists
         """
 
-        with conn.cursor() as curs:
+        with db.cursor() as curs:
             curs.execute("SELECT * FROM playlist WHERE owner_username = %s;", (username,))
-            res = [
-                {
-                    "id": playlist[0],
-                    "owner": playlist[1],
-                    "title": playlist[2],
-                    "created": playlist[3].isoformat()
-                }
-                for playlist in curs.fetchall()
-            ]
-
-        return make_response_message(E_MSG.SUCCESS, 200, result=res)
+            res = PlaylistModel.dumps_rows(curs.fetchall())
+
+        return make_response_serialized(E_MSG.SUCCESS, 200, result=res)
 
     @doc(description='Create a new, empty Playlist resource.', params={
         'username': {'description': 'The username of the owner of the new playlist'},
@@ -71,13 +68,14 @@ class Playlists(MethodResource):
 
         title: str = kwargs["title"]
 
-        require_user_exists(username)
+        require_user_exists(username, max_stale=300)
 
         # Duplicate username-title exception response is handled
         # by UniqueViolation error handler
-        with conn.cursor() as curs:
+        with db.cursor() as curs:
             curs.execute('INSERT INTO playlist ("id", "owner_username", "title") VALUES (DEFAULT, %s, %s);', (username, title))
-            conn.commit()
+            db.commit()
+            invalidate(f"user:{username}")
 
             curs.execute('SELECT * FROM playlist WHERE owner_username = %s AND title = %s;', (username, title))
             res = curs.fetchone()
@@ -87,7 +85,7 @@ class Playlists(MethodResource):
             if res is None:
                 return make_response_error(E_MSG.ERROR, f"Failed to create new playlist named '{title}' for user '{username}'", 500)
 
-        return make_response_message(E_MSG.SUCCESS, 201, id=res[0], owner=res[1], title=res[2], created=res[3].isoformat())
+        return make_response_serialized(E_MSG.SUCCESS, 201, model=PlaylistModel.from_row(res))
 
 
 class Playlist(MethodResource):
@@ -112,13 +110,14 @@ class Playlist(MethodResource):
         'playlist_id': {'description': 'The unique identifier of the playlist'},
     })
     @marshal_with_flask_enforced(PlaylistResponseSchema, code=200)
+    @cached(tags=("playlist:{playlist_id}",))
     def get(self, playlist_id: int):
         """The query endpoint of a specific playlist.
 
         :return: The specified playlist
         """
 
-        with conn.cursor() as curs:
+        with db.cursor() as curs:
             curs.execute("SELECT * FROM playlist WHERE id = %s;", (playlist_id,))
             res = curs.fetchone()
 
@@ -127,20 +126,12 @@ class Playlist(MethodResource):
             if res == None:
                 raise DoesNotExist(f"no playlist with id '{playlist_id}' exists")
 
-            playlist_id, playlist_owner, playlist_title, playlist_created = res
+            playlist = PlaylistModel.from_row(res)
 
-            curs.execute("SELECT * FROM playlist_song WHERE playlist_id = %s;", (playlist_id,))
-            res = [
-                {
-                    "artist": playlist_song[1],
-                    "title": playlist_song[2],
-                    "created": playlist_song[3].isoformat()
-                }
-                for playlist_song in curs.fetchall()
-            ]
+            curs.execute("SELECT * FROM playlist_song WHERE playlist_id = %s;", (playlist.id,))
+            res = PlaylistSongModel.dumps_rows(curs.fetchall())
 
-        return make_response_message(E_MSG.SUCCESS, 200, id=playlist_id, owner=playlist_owner,
-                                     title=playlist_title, created=playlist_created.isoformat(), result=res)
+        return make_response_serialized(E_MSG.SUCCESS, 200, model=playlist, result=res)
 
     @doc(description='Update a Playlist resource\'s songs with a new song. Any songs already part of the playlist are silently ignored.', params={
         'artist': {'description': 'The artist of the song to add to the playlist', 'location': 'form'},
@@ -157,11 +148,11 @@ class Playlist(MethodResource):
         song_artist = kwargs["artist"]
         song_title = kwargs["title"]
 
-        require_song_exists(artist=song_artist, title=song_title)
+        require_song_exists(artist=song_artist, title=song_title, max_stale=3600)
 
         # Duplicate username-title exception response is handled
         # by UniqueViolation error handler
-        with conn.cursor() as curs:
+        with db.cursor() as curs:
             curs.execute("SELECT id from playlist WHERE id = %s", (playlist_id,))
             res = curs.fetchone()
 
@@ -174,7 +165,9 @@ class Playlist(MethodResource):
 
             # Silenty ignore unique violations, to satisfy the idempotency of PUT
             curs.execute('INSERT INTO playlist_song ("playlist_id", "song_artist", "song_title") VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;', (playlist_id, song_artist, song_title))
-            conn.commit()
+            db.commit()
+
+        invalidate(f"playlist:{res[0]}")
 
         return make_response_message(E_MSG.SUCCESS, 201)
 
@@ -185,7 +178,7 @@ def handle_does_not_exist(e):
 
 @app.errorhandler(UniqueViolation)
 def handle_db_unique_violation(e):
-    conn.rollback()
+    db.rollback()
     return get_409_already_exists(e)
 
 @app.errorhandler(InterfaceError)
@@ -210,6 +203,10 @@ def handle_db_connection_error(e):
     """
     return get_502_bad_gateway_error(e, append_error=True)
 
+@app.errorhandler(ServiceOverloaded)
+def handle_service_overloaded(e):
+    return get_503_service_overloaded(e, append_error=True, retry_after=app.config["ADMISSION_RETRY_AFTER"])
+
 
 # Add resources
 api.add_resource(Playlists, Playlists.route())
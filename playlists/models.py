@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from shared.models import RowModel, Column
+
+
+class Playlist(RowModel):
+    """The playlist specific information of a *playlist* table row"""
+    columns = (
+        Column("id", int, 0),
+        Column("owner", str, 1),
+        Column("title", str, 2),
+        Column("created", datetime, 3),
+    )
+
+
+class PlaylistSong(RowModel):
+    """The song information of a *playlist_song* table row"""
+    columns = (
+        Column("artist", str, 1),
+        Column("title", str, 2),
+        Column("created", datetime, 3),
+    )
@@ -3,8 +3,10 @@ from psycopg2.errors import UniqueViolation, OperationalError, InterfaceError
 
 from shared.utils import initialize_micro_service, marshal_with_flask_enforced
 from shared.microserviceInteractions import require_user_exists, require_playlist_exists
-from shared.exceptions import DoesNotExist, MicroserviceConnectionError, get_409_already_exists, get_404_does_not_exist, get_500_database_error, get_502_bad_gateway_error
-from shared.APIResponses import GenericResponseMessages as E_MSG, make_response_error, make_response_message
+from shared.exceptions import DoesNotExist, MicroserviceConnectionError, ServiceOverloaded, get_409_already_exists, get_404_does_not_exist, get_500_database_error, get_502_bad_gateway_error, get_503_service_overloaded
+from shared.APIResponses import GenericResponseMessages as E_MSG, make_response_error
+from shared.models import make_response_serialized
+from models import PlaylistShare
 from schemas import SharedPlaylistsResponseSchema, SharedPlaylistResponseSchema, SharedPlaylistQuerySchema
 
 
@@ -16,7 +18,8 @@ APISPEC_CONFIG = {
     'APISPEC_TITLE': 'Microservices Playlists Sharing',
     'APISPEC_VERSION': '1.0'
 }
-app, api, docs, conn = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG)
+DEPENDENCIES = ["accounts", "playlists"]
+app, api, docs, db = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG, DEPENDENCIES)
 
 
 class SharedPlaylists(MethodResource):
@@ -47,7 +50,7 @@ class SharedPlaylists(MethodResource):
 
         shareParty: str = kwargs["usernameIdentity"]
 
-        with conn.cursor() as curs:
+        with db.cursor() as curs:
             share_party_col_name: str = ""
             if shareParty == "recipient":
                 share_party_col_name = "recipient_username"
@@ -58,19 +61,14 @@ class SharedPlaylists(MethodResource):
 
             curs.execute(f"SELECT * FROM playlist_share WHERE {share_party_col_name} = %s;", (username,))
             result = []
-            for recipient, playlist_id, owner, created in curs.fetchall():
+            for row in curs.fetchall():
                 # The basic, required data for the playlist
                 # share microservice
-                playlist_share_info = {
-                        "recipient": recipient,
-                        "id": playlist_id,
-                        "owner": owner,
-                        "created": created.isoformat(),
-                }
-                extend_share_information(playlist_share_info)
-                result.append(playlist_share_info)
+                playlist_share = PlaylistShare.from_row(row)
+                extend_share_information(playlist_share)
+                result.append(playlist_share)
 
-        return make_response_message(E_MSG.SUCCESS, 200, result=result)
+        return make_response_serialized(E_MSG.SUCCESS, 200, result=PlaylistShare.dumps_models(result))
 
 
 class SharedPlaylist(MethodResource):
@@ -98,7 +96,7 @@ class SharedPlaylist(MethodResource):
         :return: The sharing information for the playlist and the recipient user
         """
 
-        with conn.cursor() as curs:
+        with db.cursor() as curs:
             curs.execute("SELECT * FROM playlist_share WHERE recipient_username = %s AND playlist_id = %s;", (username, playlist_id))
             res = curs.fetchone()
 
@@ -107,15 +105,10 @@ class SharedPlaylist(MethodResource):
             if res == None:
                 raise DoesNotExist(f"no playlist with id '{playlist_id}' is shared with recipient '{username}'")
 
-            playlist_share_info = {
-                "recipient": res[0],
-                "id": res[1],
-                "owner": res[2],
-                "created": res[3].isoformat(),
-            }
-            extend_share_information(playlist_share_info)
+            playlist_share = PlaylistShare.from_row(res)
+            extend_share_information(playlist_share)
 
-        return make_response_message(E_MSG.SUCCESS, 200, **playlist_share_info)
+        return make_response_serialized(E_MSG.SUCCESS, 200, model=playlist_share)
 
     @doc(description='Share a Playlist resource with a specified recipient user.', params={
         'username': {'description': 'The username of the recipient user to share the specific playlist with'},
@@ -128,18 +121,15 @@ class SharedPlaylist(MethodResource):
         :return: The created sharing information for the playlist and the recipient user
         """
 
-        require_user_exists(username)
-        response = require_playlist_exists(playlist_id)
-
-        # Response should never be None here
-        playlist = response.json()
+        require_user_exists(username, max_stale=300)
+        playlist = require_playlist_exists(playlist_id, max_stale=300).payload
         playlist_owner = playlist.get("owner", None)
         if playlist_owner == username:
             return make_response_error(E_MSG.ERROR, "You cannot share a playlist with yourself", 400)
 
-        with conn.cursor() as curs:
+        with db.cursor() as curs:
             curs.execute('INSERT INTO playlist_share ("recipient_username", "playlist_id", "owner_username") VALUES (%s, %s, %s);', (username, playlist_id, playlist_owner))
-            conn.commit()
+            db.commit()
 
             curs.execute('SELECT * FROM playlist_share WHERE recipient_username = %s AND playlist_id = %s;', (username, playlist_id))
             res = curs.fetchone()
@@ -148,14 +138,13 @@ class SharedPlaylist(MethodResource):
             if res is None:
                 return make_response_error(E_MSG.ERROR, f"Failed to share playlist with id '{playlist_id}' with recipient '{username}'", 500)
 
-        return make_response_message(E_MSG.SUCCESS, 200, recipient=res[0], id=res[1], owner=res[2], created=res[3].isoformat())
+        return make_response_serialized(E_MSG.SUCCESS, 200, model=PlaylistShare.from_row(res))
 
 
-def extend_share_information(share_information: dict) -> None:
+def extend_share_information(share_information: PlaylistShare) -> None:
     """Attempt to fetch detailed playlist properties to enrich the playlist share response.
 
-    The *share_information* MUST contain a 'id' key that maps to the
-    playlist id to query the playlists API for.
+    The *share_information* id is the playlist id to query the playlists API for.
 
     The playlists microservice is queried for the detailed playlist
     information needed to enrich the response. In case no valid,
@@ -167,21 +156,14 @@ def extend_share_information(share_information: dict) -> None:
 
     :param share_information: The basic share information to update
     """
-    assert "id" in share_information, "The basic share information should contain the playlist id"
+    assert share_information.id is not None, "The basic share information should contain the playlist id"
 
     try:
-        playlist_id = share_information["id"]
-        response = require_playlist_exists(playlist_id)
-        if response is None:
-            return
-        if response.status_code != 200:
-            return
-        response_json = response.json()
-        share_information.update({
-            "title": response_json.get("title", ""),
-            "playlist_created": response_json.get("created", "")
-        })
-    except (DoesNotExist, MicroserviceConnectionError):
+        playlist_id = share_information.id
+        playlist = require_playlist_exists(playlist_id).payload
+        share_information.title = playlist.get("title", "")
+        share_information.playlist_created = playlist.get("created", None)
+    except (DoesNotExist, MicroserviceConnectionError, ServiceOverloaded):
         pass
 
 
@@ -191,7 +173,7 @@ def handle_does_not_exist(e):
 
 @app.errorhandler(UniqueViolation)
 def handle_db_unique_violation(e):
-    conn.rollback()
+    db.rollback()
     return get_409_already_exists(e)
 
 @app.errorhandler(InterfaceError)
@@ -216,6 +198,10 @@ def handle_db_connection_error(e):
     """
     return get_502_bad_gateway_error(e, append_error=True)
 
+@app.errorhandler(ServiceOverloaded)
+def handle_service_overloaded(e):
+    return get_503_service_overloaded(e, append_error=True, retry_after=app.config["ADMISSION_RETRY_AFTER"])
+
 
 # Add resources
 api.add_resource(SharedPlaylists, SharedPlaylists.route())
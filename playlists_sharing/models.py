@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from shared.models import RowModel, Column
+
+
+class PlaylistShare(RowModel):
+    """The sharing information of a *playlist_share* table row.
+
+    The title and playlist_created columns are not stored by the playlists
+    sharing microservice. They are optionally filled in with the detailed
+    playlist information fetched from the playlists microservice, and
+    omitted from the response if they were not fetched.
+    """
+    columns = (
+        Column("recipient", str, 0),
+        Column("id", int, 1),
+        Column("owner", str, 2),
+        Column("created", datetime, 3),
+        Column("title", str),
+        Column("playlist_created", str),
+    )
@@ -29,7 +29,7 @@ class SharedPlaylistExtendedSchema(SharedPlaylistSchema):
         'description': 'The user-designated title of the playlist',
     })
     playlist_created = fields.DateTime(format="iso", required=False, metadata={
-        'description': 'The ISO8601 date time at which the playlist was created'
+        'description': 'The ISO8601 date time at which the playlist was created, omitted if the playlists microservice did not report it'
     })
 
 
@@ -1,2 +1,6 @@
+# The secrets that sign the session tokens and GUI session cookies, fresh ones unless set
+export SESSION_SECRET="${SESSION_SECRET:-$(python3 -c 'import secrets; print(secrets.token_hex(32))')}"
+export GUI_SECRET_KEY="${GUI_SECRET_KEY:-$(python3 -c 'import secrets; print(secrets.token_hex(32))')}"
+
 podman-compose down
-podman-compose up --build
\ No newline at end of file
+podman-compose up --build
@@ -1 +1 @@
-from . import utils, APIResponses, schemas
\ No newline at end of file
+from . import utils, APIResponses, schemas, models, serialization, middleware, metrics, tracing, profiling, admission, caching, coalescing, fanout, hedging, registry, revalidation, preparedStatements, database, replicas, health, slowQueries, admin, sessionTokens, workerSnapshots
\ No newline at end of file
@@ -0,0 +1,62 @@
+import hmac
+
+from typing import Union
+
+from flask import Flask, Response, request
+
+from .APIResponses import make_response_message, make_response_error, GenericResponseMessages as E_MSG
+from .database import Database
+from .preparedStatements import statement_cache_report
+from .slowQueries import QueryStats
+from .workerSnapshots import WORKER_SNAPSHOTS
+
+
+ADMIN_HEADER = "X-Admin-Token"
+
+# The default and maximum amount of statements reported by /admin/queries
+DEFAULT_QUERIES_LIMIT = 20
+MAX_QUERIES_LIMIT = 1000
+
+
+def is_admin_request(app: Flask) -> bool:
+    """Check whether the current request carries the operator-only admin token.
+
+    :param app: The app that handles the request
+    :return: Whether the request is authorized, always False if no ADMIN_TOKEN is configured
+    """
+    token = app.config["ADMIN_TOKEN"]
+    header = request.headers.get(ADMIN_HEADER)
+    return bool(token) and header is not None and hmac.compare_digest(header, token)
+
+
+def register_admin_endpoints(app: Flask, db: Union[Database, None]) -> None:
+    """Register the operator-only admin endpoints with the app.
+
+    * ``/admin/queries`` reports the statements of the microservice's own
+      database with the highest total execution time, see
+      :meth:`shared.slowQueries.QueryStats.report`, together with the
+      prepared statement cache hit rate. Both cover all worker processes.
+
+    Every admin endpoint answers 403 unless the request carries an
+    X-Admin-Token header with the configured ADMIN_TOKEN.
+
+    :param app: The app to register the endpoints with
+    :param db: The database handle of the microservice, if any
+    """
+    if db is not None:
+        WORKER_SNAPSHOTS.register("queries", db.query_log.stats.snapshot)
+
+    @app.route("/admin/queries")
+    def admin_queries() -> Response:
+        if not is_admin_request(app):
+            return make_response_error(E_MSG.ERROR, "Forbidden", 403)
+
+        try:
+            limit = int(request.args.get("limit", DEFAULT_QUERIES_LIMIT))
+        except ValueError:
+            return make_response_error(E_MSG.ERROR, "The 'limit' query parameter must be an integer", 400)
+        limit = max(0, min(limit, MAX_QUERIES_LIMIT))
+
+        # The statistics are rolling windows, so those of exited workers are dropped
+        queries = [] if db is None else QueryStats.report((snapshot for snapshot, _ in WORKER_SNAPSHOTS.collect("queries")), limit)
+        return make_response_message(E_MSG.SUCCESS, 200, queries=queries, statement_cache=statement_cache_report())
@@ -0,0 +1,196 @@
+import math
+import threading
+
+from time import monotonic, perf_counter
+from typing import Dict
+
+from flask import Flask, g
+
+from .APIResponses import make_response_error, GenericResponseMessages as E_MSG
+from .metrics import Counter, Gauge, route_label
+
+
+REQUESTS_SHED = Counter("http_requests_shed_total", "The amount of HTTP requests rejected by admission control", ("route",))
+ADMISSION_LIMIT = Gauge("http_admission_limit", "The current concurrency limit of a route", ("route",))
+
+
+class FixedLimit:
+    """A concurrency limit that never changes."""
+    def __init__(self, limit: int):
+        self.value = limit
+
+    def update(self, latency: float) -> None:
+        pass
+
+
+class GradientLimit:
+    """A concurrency limit that adapts to the observed request latency.
+
+    The limit shrinks as the latency rises above the lowest latency seen
+    recently, which is taken as the latency of an unloaded service, and
+    grows again while the latency stays close to it. This is the gradient
+    algorithm of Netflix' concurrency-limits library:
+
+        new limit = limit * min(1, tolerance * lowest latency / latency) + sqrt(limit)
+
+    The square root term leaves room to probe for a higher limit. The
+    lowest latency is forgotten every *probe_interval* samples, so the
+    limit follows permanent changes in latency.
+    """
+    def __init__(self, initial: int, min_limit: int, max_limit: int, tolerance: float = 2.0,
+                 smoothing: float = 0.2, probe_interval: int = 1000):
+        """
+        :param initial: The initial limit
+        :param min_limit: The lowest limit
+        :param max_limit: The highest limit
+        :param tolerance: The latency increase, relative to the lowest latency, that is tolerated without shrinking
+        :param smoothing: The weight of a new limit estimate in the moving average of the limit
+        :param probe_interval: The amount of samples after which the lowest latency is forgotten
+        """
+        self.value = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.probe_interval = probe_interval
+        self._limit = float(initial)
+        self._lowest = math.inf
+        self._samples = 0
+
+    def update(self, latency: float) -> None:
+        self._samples += 1
+        if self._samples >= self.probe_interval:
+            self._samples = 0
+            self._lowest = latency
+        self._lowest = min(self._lowest, latency)
+
+        gradient = min(1.0, self.tolerance * self._lowest / latency) if latency > 0 else 1.0
+        estimate = self._limit * gradient + math.sqrt(self._limit)
+        self._limit = (1 - self.smoothing) * self._limit + self.smoothing * estimate
+        self._limit = max(self.min_limit, min(self.max_limit, self._limit))
+        self.value = int(self._limit)
+
+
+class RouteAdmission:
+    """The concurrency limit and bounded wait queue of a single route.
+
+    A request is admitted immediately while fewer requests than the limit
+    are in flight. Otherwise, it waits in the queue for a request to
+    finish, unless the queue is full. Requests that are not admitted
+    within the queue timeout are rejected as well.
+    """
+    def __init__(self, route: str, limit, max_queue: int, queue_timeout: float):
+        """
+        :param route: The route whose requests are admitted
+        :param limit: The concurrency limit, either a :class:`FixedLimit` or :class:`GradientLimit`
+        :param max_queue: The maximum amount of waiting requests
+        :param queue_timeout: The maximum time a request waits, in seconds
+        """
+        self.route = route
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+        ADMISSION_LIMIT.labels(route).set(limit.value)
+
+    def acquire(self) -> bool:
+        """Admit a request, waiting in the queue if needed.
+
+        :return: Whether the request was admitted
+        """
+        with self._condition:
+            if self.in_flight < self.limit.value:
+                self.in_flight += 1
+                return True
+            if self.waiting >= self.max_queue:
+                return False
+
+            self.waiting += 1
+            deadline = monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.limit.value:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, latency: float) -> None:
+        """Mark an admitted request as finished, and admit waiting requests.
+
+        :param latency: The latency of the finished request, in seconds
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.limit.update(latency)
+            ADMISSION_LIMIT.labels(self.route).set(self.limit.value)
+            self._condition.notify(max(1, self.limit.value - self.in_flight))
+
+
+def register_admission_control(app: Flask) -> None:
+    """Register per route admission control with the app.
+
+    Every route gets its own concurrency limit and wait queue, per worker
+    process, see :class:`RouteAdmission`. Rejected requests are answered
+    early with a 503 and a Retry-After header, so a traffic spike sheds
+    its excess load instead of queueing it without bound.
+
+    The admission is configured by the app's config values:
+
+    * ``ADMISSION_LIMIT``, the concurrency limit of a route
+    * ``ADMISSION_ROUTE_LIMITS``, the concurrency limits of specific routes, by url rule
+    * ``ADMISSION_QUEUE``, the maximum amount of waiting requests of a route
+    * ``ADMISSION_QUEUE_TIMEOUT``, the maximum time a request waits, in seconds
+    * ``ADMISSION_ADAPTIVE``, adapt the limits to the observed latency, see :class:`GradientLimit`
+    * ``ADMISSION_MAX_LIMIT``, the highest adaptive limit
+    * ``ADMISSION_RETRY_AFTER``, the Retry-After header value of a rejection, in seconds
+    * ``ADMISSION_EXEMPT``, the routes that are always admitted
+
+    :param app: The app to control the admission of
+    """
+    if app.config["ADMISSION_LIMIT"] <= 0:
+        return
+
+    routes: Dict[str, RouteAdmission] = {}
+    routes_lock = threading.Lock()
+
+    def route_admission(route: str) -> RouteAdmission:
+        admission = routes.get(route)
+        if admission is None:
+            with routes_lock:
+                admission = routes.get(route)
+                if admission is None:
+                    initial = app.config["ADMISSION_ROUTE_LIMITS"].get(route, app.config["ADMISSION_LIMIT"])
+                    limit = GradientLimit(initial, 1, max(initial, app.config["ADMISSION_MAX_LIMIT"])) \
+                        if app.config["ADMISSION_ADAPTIVE"] else FixedLimit(initial)
+                    admission = routes[route] = RouteAdmission(route, limit, app.config["ADMISSION_QUEUE"],
+                                                               app.config["ADMISSION_QUEUE_TIMEOUT"])
+        return admission
+
+    @app.before_request
+    def admit_request():
+        route = route_label()
+        if route in app.config["ADMISSION_EXEMPT"]:
+            return None
+
+        admission = route_admission(route)
+        if not admission.acquire():
+            REQUESTS_SHED.labels(route).inc()
+            response = make_response_error(E_MSG.ERROR, "The service is overloaded, retry later", 503)
+            response.headers["Retry-After"] = str(app.config["ADMISSION_RETRY_AFTER"])
+            return response
+
+        g.admission = admission
+        g.admission_start = perf_counter()
+        return None
+
+    @app.teardown_request
+    def release_request(exception: BaseException = None) -> None:
+        admission = g.pop("admission", None)
+        if admission is not None:
+            admission.release(perf_counter() - g.pop("admission_start"))
@@ -0,0 +1,339 @@
+import mmap
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from flask import Flask, Response, request
+
+from .metrics import Counter
+from .models import SerializedResponse
+from .replicas import reads_from_primary
+from .serialization import dumps_bytes, loads
+
+try:
+    import redis
+except ImportError:     # The shared cache store is optional
+    redis = None
+
+
+CACHE_REQUESTS = Counter("response_cache_total", "The amount of response cache lookups, per cached endpoint and result", ("endpoint", "result"))
+
+
+class CacheBackend:
+    """The store of cached entries and tag versions.
+
+    Entries are stored as opaque bytes. Every cache tag has a version
+    number, which is bumped to invalidate all entries tagged with it: an
+    entry remembers the versions of its tags when it was computed, and is
+    stale once any of them changed.
+    """
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    def versions(self, tags: List[str]) -> List[int]:
+        raise NotImplementedError
+
+    def bump(self, tags: List[str]) -> None:
+        raise NotImplementedError
+
+
+class TagVersions:
+    """Tag version numbers in memory that is shared by all forked worker processes.
+
+    The tags are hashed onto a fixed amount of version slots, so unrelated
+    tags may share a slot. Bumping a slot then merely invalidates some
+    extra entries. The memory is mapped anonymously and shared, so the
+    slots must be created before the WSGI server forks its workers, e.g.
+    by a preloaded app, for invalidations to reach all workers.
+    """
+    SLOTS = 4096
+
+    def __init__(self):
+        self._memory = mmap.mmap(-1, TagVersions.SLOTS * 8)
+        self._slots = memoryview(self._memory).cast("Q")
+
+    @staticmethod
+    def _slot(tag: str) -> int:
+        return zlib.crc32(tag.encode()) % TagVersions.SLOTS
+
+    def get(self, tags: List[str]) -> List[int]:
+        return [self._slots[self._slot(tag)] for tag in tags]
+
+    def bump(self, tags: List[str]) -> None:
+        # Concurrent bumps may collapse into one, but any bump changes the version
+        for tag in tags:
+            slot = self._slot(tag)
+            self._slots[slot] = (self._slots[slot] + 1) % (1 << 64)
+
+
+class MemoryBackend(CacheBackend):
+    """An in-process, least recently used store, bounded by entry count and total size.
+
+    Every worker process has its own entries, but tag invalidations reach
+    all workers forked from the process that created the backend, see
+    :class:`TagVersions`.
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        """
+        :param max_entries: The maximum amount of cached entries
+        :param max_bytes: The maximum total size of the cached entries, in bytes
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._size = 0
+        self._versions = TagVersions()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        value, _ = self._entries.pop(key)
+        self._size -= len(value)
+
+    def versions(self, tags: List[str]) -> List[int]:
+        return self._versions.get(tags)
+
+    def bump(self, tags: List[str]) -> None:
+        self._versions.bump(tags)
+
+
+class RedisBackend(CacheBackend):
+    """A store shared by all workers and replicas of a microservice, in redis.
+
+    The entries of every microservice are kept apart by their key prefix,
+    but the tag versions are shared by all microservices using the server,
+    so a microservice may cache results derived from another microservice's
+    data under that microservice's tags, e.g. the GUI under 'songs'.
+
+    The memory cap and eviction policy are those of the redis server, e.g.
+    ``--maxmemory 64mb --maxmemory-policy allkeys-lru``. An unreachable
+    redis server makes every lookup miss, so the microservice keeps
+    serving uncached responses.
+    """
+    def __init__(self, url: str, prefix: str):
+        """
+        :param url: The redis url, e.g. 'redis://cache:6379/0'
+        :param prefix: The prefix of all entry keys, to separate the microservices sharing the server
+        """
+        self.client = redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get(f"{self.prefix}:entry:{key}")
+        # Explicitly set output values, to ensure graceful failure is handled appropriately
+        except redis.RedisError:
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        try:
+            self.client.set(f"{self.prefix}:entry:{key}", value, px=int(ttl * 1000))
+        except redis.RedisError:
+            pass
+
+    def versions(self, tags: List[str]) -> List[int]:
+        if not tags:
+            return []
+        try:
+            return [int(version or 0) for version in self.client.mget([f"tag:{tag}" for tag in tags])]
+        # An unknown version never matches, so nothing is served from an unreachable store
+        except redis.RedisError:
+            return [-1] * len(tags)
+
+    def bump(self, tags: List[str]) -> None:
+        try:
+            with self.client.pipeline(transaction=False) as pipeline:
+                for tag in tags:
+                    pipeline.incr(f"tag:{tag}")
+                pipeline.execute()
+        except redis.RedisError:
+            pass
+
+
+class ResponseCache:
+    """A cache of endpoint results, with tag based invalidation.
+
+    Flask responses are cached as a snapshot of their body, status and
+    headers, and rebuilt as a fresh response on every hit. Any other
+    result must be json serializable, and is cached as json, so e.g.
+    tuples come back as lists. Entries are never unpickled, since a shared
+    store may hold entries written by anyone who can reach it. Only successful
+    results are cached, error responses never are. Requests that must read
+    from the primary, e.g. of a client that just wrote, bypass the cache,
+    see :func:`shared.replicas.reads_from_primary`: a cached result may
+    have been computed from a lagging replica.
+    """
+    def __init__(self, backend: CacheBackend, default_ttl: float):
+        """
+        :param backend: The store of the cached entries
+        :param default_ttl: The time to live, in seconds, of entries cached without an explicit ttl
+        """
+        self.backend = backend
+        self.default_ttl = default_ttl
+
+    @staticmethod
+    def _dump(versions: List[int], result) -> Optional[bytes]:
+        """Serialize a result into an entry: a json header line, followed by the raw response body, if any."""
+        if isinstance(result, Response):
+            if not 200 <= result.status_code < 300 or result.direct_passthrough or result.is_streamed:
+                return None
+            header = { "versions": versions, "status": result.status_code, "headers": list(result.headers.items()),
+                       "serialized": isinstance(result, SerializedResponse) }
+            return dumps_bytes(header) + b"\n" + result.get_data()
+        return dumps_bytes({ "versions": versions, "result": result }) + b"\n"
+
+    @staticmethod
+    def _load(entry: bytes) -> Tuple[List[int], Callable]:
+        """Deserialize an entry into its versions, and a function that rebuilds its result."""
+        header, body = entry.split(b"\n", 1)
+        header = loads(header)
+        if "result" in header:
+            return header["versions"], lambda: header["result"]
+        response_class = SerializedResponse if header["serialized"] else Response
+        return header["versions"], lambda: response_class(body, status=header["status"], headers=header["headers"])
+
+    def cached(self, key: str = None, tags: Iterable[str] = (), ttl: float = None) -> Callable:
+        """Cache the results of an endpoint.
+
+        The *key* and *tags* are format strings over the endpoint's keyword
+        arguments, i.e. its url parameters. The query string of the request
+        is always part of the key. ::
+
+            @marshal_with_flask_enforced(FriendsResponseSchema, code=200)
+            @cached(tags=("user:{username}",))
+            def get(self, username: str):
+                ...
+
+        The decorator stacks with :func:`shared.utils.marshal_with_flask_enforced`,
+        and is best placed directly on the endpoint, below it.
+
+        :param key: The cache key format, by default the endpoint name and all its keyword arguments
+        :param tags: The cache tag formats, see :meth:`invalidate`
+        :param ttl: The time to live of the cached results, in seconds
+        :return: The decorator
+        """
+        def decorator(func: Callable) -> Callable:
+            endpoint = func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                # Neither served from nor stored into the cache, since it may predate the client's write
+                if reads_from_primary():
+                    CACHE_REQUESTS.labels(endpoint, "bypass").inc()
+                    return func(*args, **kwargs)
+
+                entry_key = key.format(**kwargs) if key is not None else \
+                    f"{endpoint}:" + ",".join(f"{name}={value}" for name, value in sorted(kwargs.items()))
+                entry_key += f"?{request.query_string.decode()}" if request.query_string else ""
+                entry_tags = [tag.format(**kwargs) for tag in tags]
+
+                # The versions from before computing the result, so an invalidation
+                # that happens meanwhile makes the new entry stale immediately
+                versions = self.backend.versions(entry_tags)
+                entry = self.backend.get(entry_key)
+                if entry is not None:
+                    try:
+                        entry_versions, restore = self._load(entry)
+                    # An unreadable entry, e.g. of an older format, is a miss and gets overwritten
+                    except (ValueError, KeyError, TypeError):
+                        entry_versions, restore = None, None
+                    if entry_versions == versions:
+                        CACHE_REQUESTS.labels(endpoint, "hit").inc()
+                        return restore()
+                CACHE_REQUESTS.labels(endpoint, "miss").inc()
+
+                result = func(*args, **kwargs)
+                entry = self._dump(versions, result)
+                if entry is not None:
+                    self.backend.set(entry_key, entry, ttl if ttl is not None else self.default_ttl)
+                return result
+            return wrapper
+        return decorator
+
+    def invalidate(self, *tags: str) -> None:
+        """Invalidate all cached results tagged with any of the tags, in every worker.
+
+        Write endpoints invalidate the tags of the results they change,
+        after committing the change. ::
+
+            invalidate(f"user:{username}")
+
+        :param tags: The cache tags, e.g. 'user:<name>' or 'playlist:<id>'
+        """
+        self.backend.bump(list(tags))
+
+
+def make_backend(spec: str, prefix: str, max_entries: int, max_bytes: int) -> CacheBackend:
+    """Make the cache backend described by a backend specification.
+
+    * 'memory' caches in-process, see :class:`MemoryBackend`
+    * 'redis://...' caches in a shared redis server, see :class:`RedisBackend`
+
+    :param spec: The backend specification
+    :param prefix: The key prefix of a shared backend
+    :param max_entries: The maximum amount of entries of an in-process backend
+    :param max_bytes: The maximum total entry size of an in-process backend
+    :return: The cache backend
+    """
+    if spec.startswith(("redis://", "rediss://")):
+        if redis is None:
+            print("The redis package is not installed, falling back onto the in-process response cache")
+        else:
+            return RedisBackend(spec, prefix)
+    return MemoryBackend(max_entries, max_bytes)
+
+
+# The response cache of the microservice, which caches nothing until configured by register_cache
+CACHE = ResponseCache(MemoryBackend(max_entries=0, max_bytes=0), default_ttl=0)
+
+
+def cached(key: str = None, tags: Iterable[str] = (), ttl: float = None) -> Callable:
+    """Cache the results of an endpoint in the microservice's response cache, see :meth:`ResponseCache.cached`."""
+    return CACHE.cached(key, tags, ttl)
+
+
+def invalidate(*tags: str) -> None:
+    """Invalidate all cached results tagged with any of the tags, see :meth:`ResponseCache.invalidate`."""
+    CACHE.invalidate(*tags)
+
+
+def register_cache(app: Flask) -> None:
+    """Configure the response cache of the microservice.
+
+    The backend is configured by the app's CACHE_BACKEND config value,
+    see :func:`make_backend`.
+
+    :param app: The app of the microservice
+    """
+    CACHE.backend = make_backend(app.config["CACHE_BACKEND"], app.name,
+                                 app.config["CACHE_MAX_ENTRIES"], app.config["CACHE_MAX_BYTES"])
+    CACHE.default_ttl = app.config["CACHE_DEFAULT_TTL"]
@@ -0,0 +1,66 @@
+import copy
+import threading
+
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    """A single in-flight call, shared by all its concurrent callers."""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent, identical calls into a single call.
+
+    The first caller of a key executes the call, and every caller of the
+    same key that arrives while it is in flight waits for, and shares, its
+    result or exception. Once the call finished, the next caller of the key
+    executes it anew; results are never cached. ::
+
+        result, shared = flights.do(("friends", "/friends/bob"), fetch_friends, timeout=1.0)
+
+    A waiting caller gives up on the in-flight call after *timeout* seconds,
+    and executes the call itself instead. Every waiting caller raises its
+    own copy of a shared exception, so concurrent raises never mutate the
+    same exception instance.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Execute a call, unless an identical call is already in flight.
+
+        :param key: The identity of the call
+        :param func: The call to execute
+        :param timeout: The maximum time to wait for an identical call in flight, in seconds, unbounded if None
+        :return: (result of the call, whether it was shared with another caller)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                return func(), False
+            if call.error is not None:
+                raise copy.copy(call.error).with_traceback(call.error.__traceback__)
+            return call.result, True
+
+        try:
+            call.result = func()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
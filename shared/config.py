@@ -1,8 +1,76 @@
+import os
+
+from multiprocessing import cpu_count
+
 config = dict()
 
 # Public config
 config['POSTGRES_USER']='postgres'
 config['PROPAGATE_EXCEPTIONS'] = True   # Allow use of Flask app error handling features
+config['COMPRESSION_MIN_SIZE'] = 1024   # Response bodies smaller than this many bytes are never compressed
+config['COMPRESSION_GZIP_LEVEL'] = 6
+config['COMPRESSION_BROTLI'] = True     # Prefer brotli over gzip, if the brotli package is installed
+config['COMPRESSION_BROTLI_QUALITY'] = 4
+config['TRACING_SINK'] = os.environ.get('TRACING_SINK', 'none')  # 'none', 'file:<path>' or a collector url
+config['PROFILING_SAMPLE_RATE'] = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.0))  # The fraction of requests to profile
+config['PROFILING_INTERVAL'] = 0.005    # The sampling profiler interval, in seconds
+config['PROFILING_DIR'] = os.environ.get('PROFILING_DIR', '/tmp/profiles')
+config['SLOW_QUERY_THRESHOLD_MS'] = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))  # Statements slower than this are logged
+config['SLOW_QUERY_EXPLAIN_RATE'] = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.1))   # The fraction of slow SELECT statements to EXPLAIN
+config['QUERY_STATS_WINDOW'] = 3600     # The length of a rolling query statistics window, in seconds
+config['WORKER_STATE_DIR'] = os.environ.get('WORKER_STATE_DIR', '')  # The directory in which the workers of a server share their metrics and query statistics, set by shared.server
+config['WORKER_STATE_INTERVAL'] = 1.0   # The time between two snapshots of the metrics and query statistics of a worker, in seconds
+config['STATEMENT_CACHE_SIZE'] = int(os.environ.get('STATEMENT_CACHE_SIZE', 64))  # The maximum amount of prepared statements per connection, 0 disables them
+config['PREPARE_THRESHOLD'] = 5        # The amount of executions on a connection after which a statement is prepared
+config['DB_MAX_CONNECTIONS'] = int(os.environ.get('DB_MAX_CONNECTIONS', 100))  # The max_connections of the database server, minus its 3 reserved superuser connections
+# The connections per worker process checked out at once, by default an equal share of DB_MAX_CONNECTIONS
+# per worker, minus the probe and slow query explainer connections that every worker keeps besides its pool
+config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 0)) or \
+    max(1, (config['DB_MAX_CONNECTIONS'] - 3) // int(os.environ.get('SERVER_WORKERS', 2 * cpu_count() + 1)) - 2)
+config['DB_POOL_TIMEOUT'] = 1.0         # The maximum time a request waits for a database connection, in seconds
+config['DB_REPLICA_HOSTS'] = [host for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host]  # The streaming replicas to route reads to
+config['REPLICA_MAX_LAG'] = 5.0         # Replicas that lag further behind the primary, in seconds, are not read from
+config['REPLICA_CHECK_INTERVAL'] = 2.0  # The time between two replica health checks, in seconds
+config['READ_YOUR_WRITES_WINDOW'] = 10  # The time, in seconds, that a client reads from the primary after writing
+config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')  # 'memory' or a redis url shared by all workers
+config['CACHE_DEFAULT_TTL'] = 30        # The time to live of cached responses, in seconds
+config['CACHE_MAX_ENTRIES'] = 10000     # The maximum amount of responses cached in-process
+config['CACHE_MAX_BYTES'] = 64 * 1024 * 1024  # The maximum total size of the responses cached in-process
+config['ADMISSION_LIMIT'] = int(os.environ.get('ADMISSION_LIMIT', 8))  # The concurrent requests per route and worker, 0 disables admission control
+config['ADMISSION_ROUTE_LIMITS'] = {}   # The concurrency limits of specific routes, by url rule
+config['ADMISSION_QUEUE'] = int(os.environ.get('ADMISSION_QUEUE', 4))  # The requests per route and worker that may wait for admission
+config['ADMISSION_QUEUE_TIMEOUT'] = 1.0 # The maximum time a request waits for admission, in seconds
+config['ADMISSION_ADAPTIVE'] = os.environ.get('ADMISSION_ADAPTIVE', '0') == '1'  # Adapt the limits to the observed latency
+config['ADMISSION_MAX_LIMIT'] = 16      # The highest adaptive concurrency limit
+config['ADMISSION_RETRY_AFTER'] = 1     # The Retry-After header of shed requests, in seconds
+config['ADMISSION_EXEMPT'] = ('/healthz', '/readyz', '/metrics')  # The routes that are never shed
+config['GUI_PAGE_DEADLINE'] = 2.0  # The time a GUI page waits for its downstream requests, in seconds
+config['GUI_WRITE_TIMEOUT'] = 10.0  # The time a GUI form submission waits for the microservice performing it, in seconds
+config['GUI_FRAGMENT_CACHE_SIZE'] = 10000  # The maximum amount of rendered page fragments cached by the GUI
+config['SERVICE_ENDPOINTS'] = os.environ.get('SERVICE_ENDPOINTS', '')  # e.g. 'friends=friends:5000,friends_2:5000;playlists=playlists:5000'
+config['SERVICE_REGISTRY_FILE'] = os.environ.get('SERVICE_REGISTRY_FILE', '')  # A json file that maps microservice names onto lists of replica urls
+config['ENDPOINT_EJECT_AFTER'] = 3      # The consecutive failures after which a microservice replica is ejected
+config['ENDPOINT_EJECT_DURATION'] = 10.0  # The time a failing microservice replica is ejected for, in seconds
+config['SESSION_TTL'] = 24 * 60 * 60  # The time until a session token expires, in seconds
+config['PASSWORD_SCRYPT_N'] = 2 ** 14   # The scrypt CPU/memory cost of new password hashes, stored hashes of another cost are upgraded on login
+config['PASSWORD_SCRYPT_R'] = 8         # The scrypt block size of new password hashes
+config['PASSWORD_SCRYPT_P'] = 1         # The scrypt parallelization of new password hashes
+config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # The password hashing threads per worker process
+config['PASSWORD_HASH_QUEUE'] = 8       # The maximum amount of password hashes waiting for a hashing thread, beyond which logins are answered 503
+config['FRIEND_GRAPH_REFRESH'] = 5.0    # The time between two polls for friend relations added through other friends workers, in seconds
+config['FRIEND_GRAPH_RELOAD'] = 3600.0  # The time after which the shared friend graph snapshot is rebuilt from all relations, including those the polls missed, in seconds
+config['FRIEND_SUGGESTIONS_TTL'] = 60   # The time a user's cached friend suggestions may miss the friend relations added by its friends, in seconds
+config['DEPENDENCY_MAX_STALE'] = 60.0      # The maximum age of a last known dependency check answer, used while the dependency is unreachable, in seconds
+config['DEPENDENCY_STALE_ENTRIES'] = 10000  # The maximum amount of remembered dependency check answers
+config['DEPENDENCY_REFRESH_INTERVAL'] = 1.0  # The time between two background refreshes of an unreachable dependency check, in seconds
+config['DEPENDENCY_TIMEOUT'] = 2.0       # The maximum time a dependency check waits for the checked microservice, in seconds
+config['HEDGE_PERCENTILE'] = 0.95     # Hedge a request once it takes longer than this latency percentile of its target
+config['HEDGE_MAX_RATIO'] = float(os.environ.get('HEDGE_MAX_RATIO', 0.05))  # The maximum fraction of extra, hedge requests
+config['HEDGE_MIN_SAMPLES'] = 100       # The amount of latencies of a target needed before hedging its requests
 
 # Secret config
-config['POSTGRES_PASSWORD']='postgres'
\ No newline at end of file
+config['POSTGRES_PASSWORD']='postgres'
+config['PROFILING_TOKEN'] = os.environ.get('PROFILING_TOKEN', '')  # Operator-only X-Profile header value, profiling on demand is disabled if empty
+config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN', '')  # Operator-only X-Admin-Token header value, the admin endpoints are disabled if empty
+config['SESSION_SECRET'] = os.environ.get('SESSION_SECRET', '')  # Signs the session tokens issued by accounts, no session tokens are issued nor accepted if empty
+config['GUI_SECRET_KEY'] = os.environ.get('GUI_SECRET_KEY', '')  # Signs the GUI's session cookies, the GUI refuses to start if empty
@@ -0,0 +1,435 @@
+import os
+import random
+import re
+import threading
+import time
+
+import psycopg2
+
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional
+from psycopg2.extensions import connection, cursor
+
+from .metrics import QUERY_DURATION
+from .tracing import start_span
+from .slowQueries import SlowQueryLog
+from .preparedStatements import PreparedStatementCache
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s|%\(\w+\)s")
+_WHITESPACE = re.compile(r"\s+")
+
+# The replication lag of a replica, in seconds. A replica that replayed all
+# received WAL is up to date, even if the primary did not write for a while.
+_REPLICATION_LAG = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END;
+"""
+
+# The replica that the statements of the calling context are routed to, instead of the primary
+_routed_database: ContextVar[Optional["Database"]] = ContextVar("routed_database", default=None)
+
+# The connection state inherited from a parent process. It is kept referenced and never used, since
+# finalizing an inherited connection sends a Terminate message over the socket shared with the parent.
+_inherited = []
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query: str) -> str:
+    """Reduce a sql statement to its fingerprint.
+
+    Literals and parameter placeholders are replaced by '?', and whitespace
+    is collapsed, so that all executions of the same statement share one
+    fingerprint, regardless of their parameters. ::
+
+        >>> fingerprint("SELECT * FROM friend WHERE username = %s;")
+        'SELECT * FROM friend WHERE username = ?;'
+
+    :param query: The sql statement
+    :return: The fingerprint of the statement
+    """
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    return _WHITESPACE.sub(" ", _LITERALS.sub("?", query)).strip()
+
+
+class InstrumentedConnection(connection):
+    """A psycopg2 connection that knows the Database handle it belongs to,
+    and keeps the server side prepared statements of its hot statements.
+    """
+    database: "Database" = None
+    prepared_statements: PreparedStatementCache = None
+
+
+class InstrumentedCursor(cursor):
+    """A psycopg2 cursor that times and traces every statement it executes, by statement fingerprint.
+
+    Every execution is also recorded in the slow query log of the cursor's Database handle.
+    """
+    def _instrumented(self, execute, query, vars, explainable: bool):
+        statement = fingerprint(query)
+        with start_span(f"db: {statement}", kind="client", **{ "db.statement": statement }):
+            start = time.perf_counter()
+            succeeded = False
+            try:
+                result = execute(query, vars)
+                succeeded = True
+                return result
+            finally:
+                duration = time.perf_counter() - start
+                QUERY_DURATION.labels(statement).observe(duration)
+                database = getattr(self.connection, "database", None)
+                if database is not None:
+                    database.query_log.record(self.connection, statement, query, vars, duration, explainable and succeeded)
+
+    def _execute(self, query, vars):
+        """Execute a query by the name of its prepared statement, if prepared, and count its execution otherwise.
+
+        Named (server side) cursors wrap their query in a DECLARE statement,
+        which cannot declare a cursor for an EXECUTE, so they are never prepared.
+        """
+        statements = getattr(self.connection, "prepared_statements", None)
+        if statements is None or self.name is not None:
+            return super().execute(query, vars)
+
+        prepared = statements.lookup(query, vars)
+        if prepared is not None:
+            return super().execute(*prepared)
+        result = super().execute(query, vars)
+        statements.executed(query, vars)
+        return result
+
+    def execute(self, query, vars=None):
+        return self._instrumented(self._execute, query, vars, explainable=True)
+
+    def executemany(self, query, vars_list):
+        return self._instrumented(super().executemany, query, vars_list, explainable=False)
+
+
+class Database:
+    """A lazily connecting handle to a microservice's postgresql database.
+
+    Every thread of every process checks out its own psycopg2 connection
+    from the process's pool on its first use, and keeps it until it
+    returns it, see :meth:`release`, e.g. at the end of a request. At most
+    *pool_size* connections per process are checked out at once, so all
+    workers of a server stay below the database's max_connections; a
+    thread waits at most *pool_timeout* seconds for a connection. Returned
+    connections are reused, and new ones are only established when no
+    returned one is idle. No connection is ever shared across a fork, so a
+    preloaded app may create its Database handle at import time, before
+    the WSGI server forks its workers. Creating the handle opens no
+    connection, so the preloading master process has none to share with
+    its workers.
+
+    Creating the handle never blocks. A forked process, or the first use
+    of the handle, starts a background thread that probes the database with
+    exponential backoff until it answers, at which point the handle becomes
+    ready. Until then, using the handle fails fast with a
+    psycopg2.OperationalError instead of blocking the caller.
+
+    The handle mimics the part of the psycopg2 connection interface used
+    by the microservices. ::
+
+        db = Database(db_name="songs", user="postgres", password="postgres", host="songs_persistence")
+        with db.cursor() as curs:
+            curs.execute("INSERT INTO songs (title, artist) VALUES (%s, %s);", (title, artist))
+            db.commit()
+
+    The handle may have streaming replicas of the database, each with a
+    handle of its own. While a replica is routed to, see :meth:`route_to`,
+    the primary handle transparently uses the replica's connection.
+    """
+    # The exponential backoff bounds, in seconds, of the background connection attempts
+    BACKOFF_INITIAL = 0.1
+    BACKOFF_MAX = 10.0
+
+    # The connection timeout, in seconds, of a single connection attempt
+    CONNECT_TIMEOUT = 3
+
+    def __init__(self, db_name: str, user: str, password: str, host: str, query_log: SlowQueryLog = None,
+                 statement_cache_size: int = 0, prepare_threshold: int = 5, replica_hosts: Iterable[str] = (),
+                 pool_size: int = 0, pool_timeout: float = 1.0):
+        """
+        :param db_name: The name of the database to connect to
+        :param user: The user name used to authenticate
+        :param password: The password used to authenticate
+        :param host: The database host address
+        :param query_log: The log that records the statistics of all executed statements
+        :param statement_cache_size: The maximum amount of prepared statements per
+        connection, statements are never prepared if 0
+        :param prepare_threshold: The amount of executions on a connection after
+        which a statement is prepared
+        :param replica_hosts: The host addresses of the streaming replicas of the database
+        :param pool_size: The maximum amount of connections checked out at once per process, unbounded if 0
+        :param pool_timeout: The maximum time a thread waits for a connection of a full pool, in seconds
+        """
+        self.connect_kwargs = dict(dbname=db_name, user=user, password=password, host=host,
+                                   connect_timeout=Database.CONNECT_TIMEOUT,
+                                   connection_factory=InstrumentedConnection,
+                                   cursor_factory=InstrumentedCursor)
+        self.query_log = query_log if query_log is not None else SlowQueryLog(threshold=0.1, explain_rate=0.0, window=3600)
+        self.statement_cache_size = statement_cache_size
+        self.prepare_threshold = prepare_threshold
+        self.host = host
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.primary: Optional[Database] = None
+        self.replicas: List[Database] = []
+        for replica_host in replica_hosts:
+            replica = Database(db_name, user, password, replica_host, query_log, statement_cache_size, prepare_threshold,
+                               pool_size=pool_size, pool_timeout=pool_timeout)
+            replica.primary = self
+            self.replicas.append(replica)
+        self._local = threading.local()
+        self._pool = threading.BoundedSemaphore(pool_size) if pool_size > 0 else None
+        self._idle: List[connection] = []
+        self._idle_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._ready = threading.Event()
+        self._probe_lock = threading.Lock()
+        self._probe_conn = None
+        self._connector = None
+
+        # Forked children must never reuse the connections of their parent
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        """Forget all connections and state of a parent process, and start probing the database."""
+        _inherited.append((self._local, self._idle, self._probe_conn))
+        self._local = threading.local()
+        self._pool = threading.BoundedSemaphore(self.pool_size) if self.pool_size > 0 else None
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._ready = threading.Event()
+        self._probe_lock = threading.Lock()
+        self._probe_conn = None
+        self._connector = None
+        self.start()
+
+    def start(self) -> None:
+        """Start probing the database in the background, unless already probing."""
+        with self._probe_lock:
+            if self._connector is not None and self._connector.is_alive():
+                return
+            self._connector = threading.Thread(target=self._connect_with_backoff, name="db-connector", daemon=True)
+            self._connector.start()
+
+    def _connect_with_backoff(self) -> None:
+        """Retry establishing the probe connection with exponential backoff, until successful."""
+        delay = Database.BACKOFF_INITIAL
+        while True:
+            try:
+                conn = self.connect()
+                break
+            except psycopg2.OperationalError:
+                print(f"Retrying DB connection in {delay:.1f}s")
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, Database.BACKOFF_MAX)
+
+        with self._probe_lock:
+            self._probe_conn = conn
+        self._ready.set()
+        print("DB connection succesful")
+
+    @property
+    def ready(self) -> bool:
+        """Whether the database answered the background probe, which is started if not probing yet."""
+        if self._connector is None:
+            self.start()
+        return self._ready.is_set()
+
+    def _mark_unavailable(self) -> None:
+        """Mark the database as unreachable, and start probing it again."""
+        self._ready.clear()
+        with self._probe_lock:
+            if self._probe_conn is not None:
+                self._probe_conn.close()
+                self._probe_conn = None
+        self.start()
+
+    def _probe(self, query: str):
+        """Execute a query on the probe connection.
+
+        :param query: The sql query to execute
+        :return: The first column of the first result row, or None if the database is unreachable
+        """
+        if not self.ready:
+            return None
+
+        try:
+            with self._probe_lock:
+                with self._probe_conn.cursor() as curs:
+                    curs.execute(query)
+                    value = curs.fetchone()[0]
+                self._probe_conn.rollback()
+            return value
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, AttributeError):
+            self._mark_unavailable()
+            return None
+
+    def ping(self) -> bool:
+        """Check whether the database currently answers a trivial query.
+
+        :return: Whether the database is reachable
+        """
+        return self._probe("SELECT 1;") is not None
+
+    def replication_lag(self) -> Optional[float]:
+        """Get the replication lag of a replica, or 0 for a primary.
+
+        :return: The replication lag in seconds, or None if the database is unreachable
+        """
+        lag = self._probe(_REPLICATION_LAG)
+        return float(lag) if lag is not None else None
+
+    def connect(self) -> connection:
+        """Establish a new database connection.
+
+        Raise a psycopg2.OperationalError if the database cannot be reached.
+
+        :return: The new connection
+        """
+        conn = psycopg2.connect(**self.connect_kwargs)
+        conn.database = self
+        if self.statement_cache_size > 0:
+            conn.prepared_statements = PreparedStatementCache(conn, self.statement_cache_size, self.prepare_threshold)
+        return conn
+
+    def route_to(self, replica: "Database") -> Token:
+        """Route the statements of the calling context to a replica, instead of the primary.
+
+        :param replica: One of the replicas of this database
+        :return: The token that restores the previous routing, see :meth:`reset_route`
+        """
+        return _routed_database.set(replica)
+
+    @staticmethod
+    def reset_route(token: Token) -> None:
+        """Restore the routing that preceded a :meth:`route_to` call."""
+        _routed_database.reset(token)
+
+    def routed(self) -> "Database":
+        """Get the database that the statements of the calling context are routed to."""
+        replica = _routed_database.get()
+        return replica if replica is not None and replica.primary is self else self
+
+    def _checkout(self) -> Optional[connection]:
+        """Take a slot of the pool for the calling thread, waiting at most *pool_timeout* seconds.
+
+        Raise a psycopg2.OperationalError if the pool stays full.
+
+        :return: An idle connection of the pool, if any
+        """
+        if self._pool is not None and not self._pool.acquire(timeout=self.pool_timeout):
+            raise psycopg2.OperationalError("no database connection became available in time")
+        self._local.checked_out = True
+        with self._idle_lock:
+            return self._idle.pop() if self._idle else None
+
+    def connection(self) -> connection:
+        """Get the database connection of the calling thread, checking one out of the pool if needed.
+
+        The connection is that of the replica routed to, if any.
+        Raise a psycopg2.OperationalError if the database is not ready,
+        or if no connection becomes available in time.
+
+        :return: The connection of the calling thread
+        """
+        routed = self.routed()
+        if routed is not self:
+            return routed.connection()
+
+        if self._pid != os.getpid():
+            self._reset()
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            if not self.ready:
+                raise psycopg2.OperationalError("the database is not available yet")
+            if not getattr(self._local, "checked_out", False):
+                conn = self._local.conn = self._checkout()
+                if conn is not None and not conn.closed:
+                    return conn
+            try:
+                conn = self._local.conn = self.connect()
+            except psycopg2.OperationalError:
+                self.release()
+                self._mark_unavailable()
+                raise
+        return conn
+
+    def release(self) -> None:
+        """Return the calling thread's connections, of the database and its replicas, to their pools.
+
+        An open transaction is rolled back first. Request threads release their
+        connections at the end of every request, see :func:`shared.utils.initialize_micro_service`.
+        """
+        for replica in self.replicas:
+            replica.release()
+        if not getattr(self._local, "checked_out", False):
+            return
+
+        conn = self._local.conn
+        self._local.conn = None
+        self._local.checked_out = False
+        try:
+            if conn is not None and not conn.closed:
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+                with self._idle_lock:
+                    self._idle.append(conn)
+        # Explicitly set output values, to ensure graceful failure is handled appropriately
+        except psycopg2.Error:
+            conn.close()
+        finally:
+            if self._pool is not None:
+                self._pool.release()
+
+    @contextmanager
+    def checked_out(self) -> Iterator["Database"]:
+        """Hold the calling thread's connection for a unit of background work, and return it to the pool afterwards.
+
+        Request threads release their connections at the end of every
+        request, but a background thread never ends a request, so without
+        this it would keep its pool slot for the life of the process. ::
+
+            with db.checked_out():
+                with db.cursor() as curs:
+                    curs.execute("SELECT username, friendname, created_datetime FROM friend;")
+
+        :return: The database handle
+        """
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def cursor(self, *args, **kwargs) -> cursor:
+        """Open a cursor on the calling thread's connection."""
+        return self.connection().cursor(*args, **kwargs)
+
+    def commit(self) -> None:
+        """Commit the calling thread's current transaction."""
+        self.connection().commit()
+
+    def rollback(self) -> None:
+        """Roll back the calling thread's current transaction."""
+        self.connection().rollback()
+
+    def end_transaction(self) -> None:
+        """Roll back the open transaction of the calling thread's connection, if any, without connecting."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+            conn.rollback()
+
+    def close(self) -> None:
+        """Close the calling thread's connection, if any, and return its slot to the pool."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self.release()
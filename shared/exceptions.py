@@ -1,7 +1,7 @@
 from typing import Union
 from flask import Response
 
-from .utils import make_response_error
+from .APIResponses import make_response_error
 from .APIResponses import GenericResponseMessages as E_MSG
 
 
@@ -35,6 +35,12 @@ class MicroserviceConnectionError(Exception):
     description = "Failed to connect to microservice"
 
 
+class ServiceOverloaded(Exception):
+    """A request cannot be handled now, because the microservice is at capacity."""
+    code = 503
+    description = "The service is overloaded, retry later"
+
+
 def get_409_already_exists(e: Union[AlreadyExists, str], append_error: bool=False, **kwargs) -> Response:
     """Make a `flask.Response` based on the AlreadyExists exception class
     
@@ -94,3 +100,18 @@ def get_502_bad_gateway_error(e: Union[MicroserviceConnectionError, str], append
     if append_error:
         error_msg += ", " + str(e)
     return make_response_error(E_MSG.ERROR, error_msg, MicroserviceConnectionError.code, **kwargs)
+
+def get_503_service_overloaded(e: Union[ServiceOverloaded, str], append_error: bool=False, retry_after: int=1, **kwargs) -> Response:
+    """Make a `flask.Response` based on the ServiceOverloaded exception class
+
+    :param e: The error to stringify and append to the error message, if append_error is True
+    :param append_error: Whether to append the exception string to the error message
+    :param retry_after: The Retry-After header value, in seconds
+    :return: A `flask.Response` with error messages and the provided kwargs
+    """
+    error_msg: str = ServiceOverloaded.description
+    if append_error:
+        error_msg += ", " + str(e)
+    response = make_response_error(E_MSG.ERROR, error_msg, ServiceOverloaded.code, **kwargs)
+    response.headers["Retry-After"] = str(retry_after)
+    return response
@@ -0,0 +1,78 @@
+import os
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import Counter
+
+
+FANOUT_MISSED = Counter("fanout_calls_missed_total", "The amount of concurrent calls whose result was not used, per call and reason", ("call", "reason"))
+
+
+class FanOut:
+    """Execute independent calls concurrently, and collect whatever completed within a deadline.
+
+    Every process gets its own bounded thread pool, created on first use,
+    so the pool survives the forking of preloaded workers. ::
+
+        results = fanout.gather({ "mine": fetch_playlists, "shared": fetch_shared }, deadline=1.0,
+                                defaults={ "mine": [], "shared": [] })
+
+    A call that raised, or did not complete before the deadline, gets its
+    default result instead. Late calls keep running in the background, and
+    their result is discarded, so the calls should bound their own duration
+    as well, e.g. by a request timeout.
+    """
+    def __init__(self, max_workers: int = 32):
+        """
+        :param max_workers: The maximum amount of concurrent calls of a process
+        """
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _submit(self, call: Callable) -> Future:
+        # Executor threads never survive a fork, so every process gets its own executor
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fanout")
+                    self._pid = os.getpid()
+        # Run in a copy of the calling context, so the calls are traced as part of the calling span
+        return self._executor.submit(copy_context().run, call)
+
+    def gather(self, calls: Dict[str, Callable[[], Any]], deadline: float, defaults: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Execute calls concurrently, and wait at most *deadline* seconds for their results.
+
+        :param calls: The calls, by name
+        :param deadline: The maximum time to wait for all calls, in seconds
+        :param defaults: The results of calls that failed or missed the deadline, by name, None if absent
+        :return: The results, by name
+        """
+        defaults = defaults or {}
+        futures = { name: self._submit(call) for name, call in calls.items() }
+        wait(futures.values(), timeout=deadline)
+
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                FANOUT_MISSED.labels(name, "deadline").inc()
+                results[name] = defaults.get(name)
+            elif future.exception() is not None:
+                FANOUT_MISSED.labels(name, "error").inc()
+                results[name] = defaults.get(name)
+            else:
+                results[name] = future.result()
+        return results
+
+
+# The concurrent calls of the process
+FANOUT = FanOut()
+
+
+def gather(calls: Dict[str, Callable[[], Any]], deadline: float, defaults: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Execute calls concurrently, within a deadline, see :meth:`FanOut.gather`."""
+    return FANOUT.gather(calls, deadline, defaults)
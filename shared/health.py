@@ -0,0 +1,76 @@
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Union
+
+from flask import Flask, Response
+
+from .APIResponses import make_response_message, GenericResponseMessages as E_MSG
+from .database import Database
+from .microserviceInteractions import service_url
+
+
+# The timeout, in seconds, of a single dependency health check
+DEPENDENCY_TIMEOUT = 0.5
+
+UP = "up"
+DOWN = "down"
+
+
+def check_dependency(service_name: str) -> str:
+    """Check whether the liveness endpoint of a depended on microservice answers.
+
+    :param service_name: The name of the depended on microservice
+    :return: 'up' or 'down'
+    """
+    try:
+        response = requests.get(f"{service_url(service_name)}/healthz", timeout=DEPENDENCY_TIMEOUT)
+        return UP if response.status_code == 200 else DOWN
+    # Explicitly set output values, to ensure graceful failure is handled appropriately
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        return DOWN
+
+
+def check_dependencies(dependencies: Iterable[str]) -> Dict[str, str]:
+    """Concurrently check all depended on microservices.
+
+    :param dependencies: The names of the depended on microservices
+    :return: The mapping of each microservice name to 'up' or 'down'
+    """
+    dependencies = list(dependencies)
+    if not dependencies:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(dependencies)) as executor:
+        return dict(zip(dependencies, executor.map(check_dependency, dependencies)))
+
+
+def register_health_endpoints(app: Flask, db: Union[Database, None], dependencies: Iterable[str] = ()) -> None:
+    """Register the liveness and readiness endpoints with the app.
+
+    * ``/healthz`` always answers 200 while the app serves requests.
+    * ``/readyz`` answers 200 iff. the microservice's own database, if any,
+      is reachable, and 503 otherwise. The status of every depended on
+      microservice is reported as well, but does not affect readiness;
+      the microservices fail gracefully if their dependencies are down.
+      Neither do the database's replicas, if any; reads fall back to the
+      primary if no replica is healthy.
+
+    :param app: The app to register the endpoints with
+    :param db: The database handle of the microservice, if any
+    :param dependencies: The names of the microservices the app depends on
+    """
+    dependencies = tuple(dependencies)
+
+    @app.route("/healthz")
+    def healthz() -> Response:
+        return make_response_message(E_MSG.SUCCESS, 200, status=UP)
+
+    @app.route("/readyz")
+    def readyz() -> Response:
+        database = "none" if db is None else (UP if db.ping() else DOWN)
+        replicas = {} if db is None else { replica.host: UP if replica.ping() else DOWN for replica in db.replicas }
+        ready = database != DOWN
+        return make_response_message(E_MSG.SUCCESS if ready else E_MSG.ERROR, 200 if ready else 503,
+                                     status=UP if ready else DOWN, database=database, replicas=replicas,
+                                     dependencies=check_dependencies(dependencies))
@@ -0,0 +1,179 @@
+import os
+import threading
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from time import perf_counter
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .metrics import Counter
+
+
+HEDGED_REQUESTS = Counter("outbound_requests_hedged_total", "The amount of hedge requests sent to other microservices, per target and winner", ("target", "winner"))
+
+
+class LatencyWindow:
+    """The latencies of the most recent requests to a single target.
+
+    The percentile is recomputed every *refresh* samples, instead of on
+    every request.
+    """
+    def __init__(self, size: int = 1000, refresh: int = 50):
+        """
+        :param size: The amount of most recent latencies kept
+        :param refresh: The amount of samples after which the percentile is recomputed
+        """
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._since_refresh = 0
+        self._percentiles: Dict[float, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._samples.append(latency)
+            self._since_refresh += 1
+            if self._since_refresh >= self.refresh:
+                self._since_refresh = 0
+                self._percentiles = {}
+
+    def percentile(self, fraction: float) -> float:
+        """Get a percentile of the recent latencies, e.g. 0.95 for the p95.
+
+        :param fraction: The percentile, as a fraction between 0 and 1
+        :return: The latency, in seconds
+        """
+        with self._lock:
+            if fraction not in self._percentiles:
+                ordered = sorted(self._samples)
+                self._percentiles[fraction] = ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+            return self._percentiles[fraction]
+
+
+class HedgeBudget:
+    """A token bucket that caps the hedge requests at a fraction of all requests.
+
+    Every request earns *ratio* tokens, and every hedge request spends one.
+    """
+    def __init__(self, ratio: float, burst: float = 10.0):
+        """
+        :param ratio: The maximum fraction of extra requests
+        :param burst: The maximum amount of saved up tokens
+        """
+        self.ratio = ratio
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+
+    def earn(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def spend(self) -> bool:
+        """Take a token for a hedge request.
+
+        :return: Whether the budget allows the hedge request
+        """
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+class Hedger:
+    """Hedge idempotent requests: if a request did not complete within the
+    recently observed latency percentile of its target, send an identical
+    hedge request, and use whichever response arrives first.
+
+    The losing request is abandoned; its response is closed, and thus its
+    connection released, as soon as it arrives. Hedging only starts once
+    enough latencies of a target are known, and the amount of hedge
+    requests is capped by a :class:`HedgeBudget`.
+    """
+    def __init__(self, percentile: float, max_ratio: float, min_samples: int, max_workers: int = 32):
+        """
+        :param percentile: The latency percentile after which a hedge request is sent, e.g. 0.95
+        :param max_ratio: The maximum fraction of extra requests
+        :param min_samples: The amount of latencies of a target needed before hedging its requests
+        :param max_workers: The maximum amount of concurrent hedged requests of a process
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self.budget = HedgeBudget(max_ratio)
+        self._latencies: Dict[str, LatencyWindow] = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _latency(self, target: str) -> LatencyWindow:
+        window = self._latencies.get(target)
+        if window is None:
+            with self._lock:
+                window = self._latencies.setdefault(target, LatencyWindow())
+        return window
+
+    def _submit(self, call: Callable) -> Future:
+        # Executor threads never survive a fork, so every process gets its own executor
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+                    self._pid = os.getpid()
+        # Run in a copy of the calling context, so the request is traced as part of the calling span
+        return self._executor.submit(copy_context().run, call)
+
+    def _timed(self, target: str, call: Callable) -> Callable:
+        def timed_call():
+            start = perf_counter()
+            result = call()
+            self._latency(target).record(perf_counter() - start)
+            return result
+        return timed_call
+
+    def call(self, target: str, call: Callable, close: Callable = None, accept: Callable[[Any], bool] = None):
+        """Execute a request, hedging it if it is slow.
+
+        Only a successful request whose result is accepted wins, e.g. a
+        response below 500. If neither request wins, the result, or
+        exception, of the first request is passed up.
+
+        :param target: The name of the request target, e.g. the microservice name
+        :param call: The request, which must be idempotent
+        :param close: Release the result of an abandoned request, e.g. close a response
+        :param accept: Whether a result may win, every result may if None
+        :return: The result of the first successful, accepted request
+        """
+        self.budget.earn()
+        window = self._latency(target)
+        if len(window) < self.min_samples:
+            return self._timed(target, call)()
+
+        delay = window.percentile(self.percentile)
+        first = self._submit(self._timed(target, call))
+        done, _ = wait([first], timeout=delay)
+        if done or not self.budget.spend():
+            return first.result()
+
+        hedge = self._submit(self._timed(target, call))
+        pending = { first, hedge }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None
+                           and (accept is None or accept(future.result()))), None)
+            if winner is not None:
+                HEDGED_REQUESTS.labels(target, "hedge" if winner is hedge else "first").inc()
+                for loser in (first, hedge):
+                    if loser is not winner and close is not None:
+                        loser.add_done_callback(lambda future: future.exception() is None and close(future.result()))
+                return winner.result()
+
+        HEDGED_REQUESTS.labels(target, "none").inc()
+        if close is not None and hedge.exception() is None:
+            close(hedge.result())
+        return first.result()
@@ -0,0 +1,311 @@
+import threading
+
+from bisect import bisect_left
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+
+from flask import Flask, Response, g, request
+
+from .workerSnapshots import WORKER_SNAPSHOTS
+
+
+# The default latency histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    """Format a label set in the Prometheus text format.
+
+    :param names: The label names
+    :param values: The label values
+    :param extra: An additional, already formatted label, e.g. 'le="0.5"'
+    :return: The formatted label set, including braces, or the empty string
+    """
+    pairs = [
+        name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    """The value of a counter for a single label set."""
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    """The value of a gauge for a single label set."""
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+
+class _HistogramChild:
+    """The bucket counts of a histogram for a single label set."""
+    __slots__ = ("_lock", "_bounds", "buckets", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)     # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self.buckets[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metric:
+    """A named metric, with a child value per distinct label set.
+
+    The metrics are kept per process. When served by multiple worker
+    processes, the workers share snapshots of their metrics, see
+    :mod:`shared.workerSnapshots`, and every scrape of /metrics reports the
+    sum over all workers. The counts of exited workers are kept, so counters
+    never decrease when a worker is replaced.
+    """
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: "Registry" = None):
+        """
+        :param name: The metric name
+        :param documentation: The help text of the metric
+        :param labelnames: The names of the metric's labels
+        :param registry: The registry to register the metric with, the global REGISTRY by default
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Get the child value of the metric for the specified label values.
+
+        :param values: The label values, in the order of the label names
+        :return: The child value
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def snapshot(self) -> List[list]:
+        """Get the json serializable values of the calling process.
+
+        :return: [label values, value] per label set
+        """
+        return [[list(values), self._value(child)] for values, child in list(self._children.items())]
+
+    def _value(self, child) -> Any:
+        return child.value
+
+    @staticmethod
+    def merge(value: Any, other: Any) -> Any:
+        """Merge the values of a label set of two processes."""
+        return value + other
+
+    def aggregate(self) -> Dict[Tuple[str, ...], Any]:
+        """Get the values of all worker processes, merged per label set."""
+        return REGISTRY.aggregate().get(self.name, {})
+
+    def samples(self, values: Dict[Tuple[str, ...], Any]) -> List[str]:
+        """Get the Prometheus text format sample lines of the metric.
+
+        :param values: The value per label set
+        """
+        raise NotImplementedError
+
+    def render(self, values: Dict[Tuple[str, ...], Any]) -> str:
+        """Render the metric in the Prometheus text format.
+
+        :param values: The value per label set
+        """
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(values),
+        ])
+
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def samples(self, values: Dict[Tuple[str, ...], Any]) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values.items()
+        ]
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+    type = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+
+class Histogram(Metric):
+    """A distribution of observed values over cumulative buckets."""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: "Registry" = None):
+        """
+        :param buckets: The sorted bucket upper bounds, excluding +Inf
+        """
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.bounds)
+
+    def _value(self, child: _HistogramChild) -> list:
+        with child._lock:
+            return [list(child.buckets), child.sum, child.count]
+
+    @staticmethod
+    def merge(value: list, other: list) -> list:
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], value[2] + other[2]]
+
+    def samples(self, values: Dict[Tuple[str, ...], list]) -> List[str]:
+        lines = []
+        for labels, (buckets, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.bounds + (float("inf"),), buckets):
+                cumulative += bucket
+                le = 'le="' + ("+Inf" if bound == float("inf") else repr(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    """A collection of metrics that are exposed together."""
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self._metrics.append(metric)
+
+    def snapshot(self) -> Dict[str, List[list]]:
+        """Get the json serializable values of all metrics of the calling process."""
+        return { metric.name: metric.snapshot() for metric in self._metrics }
+
+    def _merge(self, snapshot: Dict[str, List[list]], into: Dict[str, Dict[Tuple[str, ...], Any]], gauges: bool) -> None:
+        for metric in self._metrics:
+            if metric.type == "gauge" and not gauges:
+                continue
+            merged = into.setdefault(metric.name, {})
+            for labels, value in snapshot.get(metric.name, ()):
+                labels = tuple(labels)
+                merged[labels] = metric.merge(merged[labels], value) if labels in merged else value
+
+    def _retire(self, retired: Dict[str, List[list]], snapshot: Dict[str, List[list]]) -> Dict[str, List[list]]:
+        """Accumulate the counts of an exited worker. Its gauges no longer apply, so they are dropped."""
+        merged = {}
+        for counts in (retired or {}, snapshot):
+            self._merge(counts, merged, gauges=False)
+        return { name: [[list(labels), value] for labels, value in values.items()] for name, values in merged.items() }
+
+    def aggregate(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        """Get the values of all metrics, merged over all worker processes.
+
+        :return: The value per label set, per metric name
+        """
+        merged = {}
+        for snapshot, alive in WORKER_SNAPSHOTS.collect("metrics", retire=self._retire):
+            self._merge(snapshot, merged, gauges=alive)
+        return merged
+
+    def render(self) -> str:
+        """Render all metrics, of all worker processes, in the Prometheus text exposition format."""
+        merged = self.aggregate()
+        return "\n".join(metric.render(merged.get(metric.name, {})) for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+WORKER_SNAPSHOTS.register("metrics", REGISTRY.snapshot)
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "The latency of handled HTTP requests", ("method", "route"))
+REQUESTS_TOTAL = Counter("http_requests_total", "The amount of handled HTTP requests", ("method", "route", "status"))
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "The amount of HTTP requests currently being handled", ("route",))
+QUERY_DURATION = Histogram("db_query_duration_seconds", "The latency of database statements", ("statement",))
+OUTBOUND_DURATION = Histogram("outbound_request_duration_seconds", "The latency of requests to other microservices", ("target", "method", "status"))
+OUTBOUND_COALESCED = Counter("outbound_requests_coalesced_total", "The amount of GET requests to other microservices that shared an identical in-flight request", ("target",))
+
+
+def route_label() -> str:
+    """Get the route label of the current request.
+
+    The url rule is used instead of the path, so every route maps onto
+    a single label value, regardless of its url parameters.
+
+    :return: The route of the current request
+    """
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def register_metrics(app: Flask) -> None:
+    """Register the request instrumentation and the /metrics endpoint with the app.
+
+    :param app: The app to instrument
+    """
+    WORKER_SNAPSHOTS.configure(app.config["WORKER_STATE_DIR"], app.config["WORKER_STATE_INTERVAL"])
+
+    @app.before_request
+    def start_request_timer() -> None:
+        g.metrics_route = route_label()
+        g.metrics_start = perf_counter()
+        REQUESTS_IN_FLIGHT.labels(g.metrics_route).inc()
+
+    @app.after_request
+    def record_response_status(response: Response) -> Response:
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exception: BaseException = None) -> None:
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+
+        route = g.pop("metrics_route")
+        REQUESTS_IN_FLIGHT.labels(route).dec()
+        REQUEST_DURATION.labels(request.method, route).observe(perf_counter() - start)
+        REQUESTS_TOTAL.labels(request.method, route, str(g.pop("metrics_status", 500))).inc()
+
+    @app.route("/metrics")
+    def metrics() -> Response:
+        return Response(REGISTRY.render(), mimetype="text/plain", headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
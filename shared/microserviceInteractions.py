@@ -1,75 +1,294 @@
 import requests
 
-from typing import Union
+from http.cookiejar import DefaultCookiePolicy
+from time import perf_counter
+from typing import Any, Callable, NamedTuple, Optional
 
-from shared.exceptions import MicroserviceConnectionError, DoesNotExist
+from shared.exceptions import MicroserviceConnectionError, DoesNotExist, ServiceOverloaded
+from shared.serialization import loads
+from shared.metrics import OUTBOUND_DURATION, OUTBOUND_COALESCED
+from shared.tracing import start_span, inject_headers, TRACEPARENT_HEADER
+from shared.coalescing import SingleFlight
+from shared.hedging import Hedger
+from shared.registry import ServiceRegistry, load_endpoints
+from shared.revalidation import StaleWhileRevalidate
+from shared.replicas import forward_read_consistency, record_read_consistency
+from shared.config import config
 
 
-def require_user_exists(username: str) -> Union[requests.Response, None]:
+# The port on which every microservice container serves its API
+SERVICE_PORT = 5000
+
+# The replicas of every microservice, see the SERVICE_ENDPOINTS and SERVICE_REGISTRY_FILE config values
+REGISTRY = ServiceRegistry(load_endpoints(config["SERVICE_ENDPOINTS"], config["SERVICE_REGISTRY_FILE"]),
+                           default_port=SERVICE_PORT,
+                           eject_after=config["ENDPOINT_EJECT_AFTER"],
+                           eject_duration=config["ENDPOINT_EJECT_DURATION"])
+
+
+def service_url(service_name: str) -> str:
+    """Get the base url of a replica of a microservice.
+
+    :param service_name: The name of the microservice
+    :return: The base url of the replica with the least outstanding requests, without trailing slash
+    """
+    return REGISTRY.choose(service_name).url
+
+
+# The shared, connection pooling session of all inter-microservice requests
+session = requests.Session()
+# The session serves all clients at once, so it must never keep the cookies of one of them
+session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+
+def _shed_retry_after(response: requests.Response) -> Optional[float]:
+    """Get the Retry-After time, in seconds, of a response that sheds the request, or None if it did not."""
+    if response.status_code != 503 or "Retry-After" not in response.headers:
+        return None
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    # Explicitly set output values, to ensure graceful failure is handled appropriately
+    except ValueError:
+        return 1.0  # An HTTP date, which admission control never sends
+
+
+def service_request(method: str, service_name: str, path: str, **kwargs) -> requests.Response:
+    """Send a request to another microservice.
+
+    All inter-microservice requests should pass through this function,
+    so they share pooled connections, are timed per target microservice,
+    and propagate the W3C trace context and the read consistency of the
+    calling request, see :func:`shared.replicas.forward_read_consistency`.
+    The requests are balanced across the replicas of the target microservice,
+    see :class:`shared.registry.ServiceRegistry`.
+    The exceptions raised by `requests` are passed up as is. ::
+
+        >>> response = service_request("GET", "friends", "/friends/bob")
+
+    :param method: The HTTP method of the request
+    :param service_name: The name of the target microservice
+    :param path: The path of the target resource, including the query string
+    :return: The microservice response
+    """
+    with start_span(f"{method} {service_name}", kind="client", **{ "peer.service": service_name, "http.target": path }) as span:
+        kwargs["headers"] = forward_read_consistency(inject_headers(kwargs.get("headers")))
+        start = perf_counter()
+        status = "error"
+        try:
+            with REGISTRY.use(service_name) as endpoint:
+                span.attributes["peer.address"] = endpoint.url
+                try:
+                    response = session.request(method, f"{endpoint.url}{path}", **kwargs)
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                    REGISTRY.report(service_name, endpoint, healthy=False)
+                    raise
+                REGISTRY.report(service_name, endpoint, healthy=response.status_code < 500, retry_after=_shed_retry_after(response))
+            record_read_consistency(response.headers)
+            status = str(response.status_code)
+            return response
+        finally:
+            span.attributes["http.status_code"] = status
+            OUTBOUND_DURATION.labels(service_name, method, status).observe(perf_counter() - start)
+
+
+# The in-flight GET requests to other microservices, shared by all threads of the process
+_get_flights = SingleFlight()
+
+
+def _get_request_key(service_name: str, path: str, kwargs: dict) -> tuple:
+    """Get the identity of a GET request, ignoring its trace context, but not its read consistency."""
+    headers = forward_read_consistency({ name: value for name, value in (kwargs.get("headers") or {}).items() if name.lower() != TRACEPARENT_HEADER })
+    options = { name: sorted(value.items()) if isinstance(value, dict) else value for name, value in kwargs.items() if name != "headers" }
+    return service_name, path, repr(sorted(headers.items())), repr(sorted(options.items()))
+
+
+# The hedging of latency critical GET requests to other microservices
+_hedger = Hedger(percentile=config["HEDGE_PERCENTILE"], max_ratio=config["HEDGE_MAX_RATIO"], min_samples=config["HEDGE_MIN_SAMPLES"])
+
+
+def _send_get(service_name: str, path: str, kwargs: dict) -> requests.Response:
+    response = service_request("GET", service_name, path, **kwargs)
+    response.content    # Read the body before sharing the response between threads
+    return response
+
+
+def service_get(service_name: str, path: str, hedge: bool = False, **kwargs) -> requests.Response:
+    """Send a GET request to another microservice, see :func:`service_request`.
+
+    Concurrent, identical GET requests are coalesced: while a request is
+    in flight, every identical request waits for it and shares its
+    response, or exception, instead of being sent as well. An identical
+    request waits at most its own timeout, and is then sent after all.
+    Callers must treat the shared response as read-only.
+
+    Latency critical requests may be hedged: if no response arrived within
+    the recent p95 latency of the microservice, an identical request is
+    sent as well, and the first response below 500 is used, see :class:`shared.hedging.Hedger`.
+
+    :param hedge: Whether to hedge the request
+    """
+    key = _get_request_key(service_name, path, kwargs)
+    if hedge:
+        send = lambda: _hedger.call(service_name, lambda: _send_get(service_name, path, kwargs), close=requests.Response.close,
+                                    accept=lambda response: response.status_code < 500)
+    else:
+        send = lambda: _send_get(service_name, path, kwargs)
+    timeout = kwargs.get("timeout")
+    response, shared = _get_flights.do(key, send, timeout=sum(timeout) if isinstance(timeout, tuple) else timeout)
+    if shared:
+        OUTBOUND_COALESCED.labels(service_name).inc()
+    return response
+
+
+class DependencyAnswer(NamedTuple):
+    """The outcome of a dependency check: the only parts of its response that are remembered, see :func:`dependency_get`."""
+    status_code: int
+    payload: Any
+
+
+class DependencyFailed(Exception):
+    """A dependency check was answered with a 5xx status, e.g. a 503 of an overloaded microservice."""
+    def __init__(self, status_code: int):
+        super().__init__(f"answered {status_code}")
+        self.status_code = status_code
+
+
+# The last answers of the dependency checks, served while the checked microservice is unreachable or failing
+_dependency_answers = StaleWhileRevalidate(max_entries=config["DEPENDENCY_STALE_ENTRIES"],
+                                           refresh_interval=config["DEPENDENCY_REFRESH_INTERVAL"],
+                                           unavailable=(requests.exceptions.Timeout, requests.exceptions.ConnectionError, DependencyFailed))
+
+
+def dependency_get(service_name: str, path: str, max_stale: float = None, payload: Callable[[requests.Response], Any] = None,
+                   **kwargs) -> DependencyAnswer:
+    """Send a GET request that checks a dependency to another microservice, see :func:`service_get`.
+
+    If the microservice is unreachable, or answers with a 5xx status, the
+    last answer to the same request is returned instead, provided it is at
+    most *max_stale* seconds old, and the request is retried in the
+    background until the microservice answers again. Meanwhile, identical
+    requests are answered from the stale answer immediately. Without such
+    an answer, the requests exception, or a DependencyFailed exception for
+    a 5xx status, is raised.
+
+    Only the status and the payload of an answer are kept, never the
+    whole response. The request times out after the DEPENDENCY_TIMEOUT
+    config value, unless given a *timeout* of its own.
+
+    :param max_stale: The maximum age of a stale answer, in seconds, by default the DEPENDENCY_MAX_STALE config value
+    :param payload: Extract the small part of a 200 response the caller needs, nothing is kept if None
+    :return: The status and the payload of the response
+    """
+    max_stale = config["DEPENDENCY_MAX_STALE"] if max_stale is None else max_stale
+    kwargs.setdefault("timeout", config["DEPENDENCY_TIMEOUT"])
+    key = _get_request_key(service_name, path, kwargs)
+
+    def check() -> DependencyAnswer:
+        response = service_get(service_name, path, **kwargs)
+        if response.status_code >= 500:
+            raise DependencyFailed(response.status_code)
+        return DependencyAnswer(response.status_code, payload(response) if payload is not None and response.status_code == 200 else None)
+
+    return _dependency_answers.call(service_name, key, check, max_stale)
+
+
+def _dependency_error(service_name: str, e: Exception) -> Exception:
+    """Get the exception that reports a failed dependency check to the client, a 503 if the dependency is overloaded and a 502 otherwise."""
+    if isinstance(e, DependencyFailed) and e.status_code == 503:
+        return ServiceOverloaded(f"the {service_name} microservice is overloaded")
+    return MicroserviceConnectionError(f"could not reach the {service_name} microservice")
+
+
+def response_json(response: requests.Response) -> Any:
+    """Decode the json body of a microservice response.
+
+    This is a drop-in replacement for :meth:`requests.Response.json`
+    that decodes through the same fast json path as the microservices
+    use to encode their responses.
+
+    :param response: The microservice response
+    :return: The decoded json body
+    """
+    return loads(response.content)
+
+
+def require_user_exists(username: str, max_stale: float = None) -> DependencyAnswer:
     """Require that the specified user exists according to
     the accounts microservice.
 
     Raise a DoesNotExist exception if the accounts microservice does
     not return the expected, positive response.
     Raise a MicroserviceConnectionError exception if connection to the
-    accounts microservice cannot be established.
+    accounts microservice cannot be established, or a ServiceOverloaded
+    exception if it is overloaded, and no last known answer is available.
 
     :param username: The username of the user to check existence of
-    :return: The microservice response if no exception
+    :param max_stale: The maximum age of the last known answer used while the microservice is unreachable, see :func:`dependency_get`
+    :return: The dependency check answer if no exception
     """
     try:
-        response = requests.get(f"http://accounts:5000/accounts/{username}")
-        if response.status_code != 200:
-            raise DoesNotExist(f"the user '{username}' does not exist")
-
-        return response
+        answer = dependency_get("accounts", f"/accounts/{username}", max_stale=max_stale)
     # Explicitly set output values, to ensure graceful failure is handled appropriately
-    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-        raise MicroserviceConnectionError("could not reach the accounts microservice")
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, DependencyFailed) as e:
+        raise _dependency_error("accounts", e)
 
-def require_song_exists(artist: str, title: str) -> Union[requests.Response, None]:
+    if answer.status_code != 200:
+        raise DoesNotExist(f"the user '{username}' does not exist")
+    return answer
+
+def require_song_exists(artist: str, title: str, max_stale: float = None) -> DependencyAnswer:
     """Require that the specified song exists according to
     the songs microservice.
 
     Raise a DoesNotExist exception if the songs microservice does
     not return the expected, positive response.
     Raise a MicroserviceConnectionError exception if connection to the
-    songs microservice cannot be established.
+    songs microservice cannot be established, or a ServiceOverloaded
+    exception if it is overloaded, and no last known answer is available.
 
     :param artist: The artist of the song to check existence of
     :param title: The title of the song to check existence of
-    :return: The microservice response if no exception
+    :param max_stale: The maximum age of the last known answer used while the microservice is unreachable, see :func:`dependency_get`
+    :return: The dependency check answer, whose payload is whether the song exists, if no exception
     """
     try:
-        response = requests.get(f"http://songs:5000/songs/exist?artist={artist}&title={title}")
-        if response.status_code != 200 or not response.json():
-            raise DoesNotExist(f"the song with artist '{artist}' and title '{title}' does not exist")
-
-        return response
+        answer = dependency_get("songs", "/songs/exist/", max_stale=max_stale, payload=response_json,
+                                params={ "artist": artist, "title": title })
     # Explicitly set output values, to ensure graceful failure is handled appropriately
-    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-        raise MicroserviceConnectionError("could not reach the songs microservice")
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, DependencyFailed) as e:
+        raise _dependency_error("songs", e)
+
+    if answer.status_code != 200 or not answer.payload:
+        raise DoesNotExist(f"the song with artist '{artist}' and title '{title}' does not exist")
+    return answer
+
 
+# The playlist information kept from a playlist existence check, without its songs
+PLAYLIST_FIELDS = ("id", "owner", "title", "created")
 
-def require_playlist_exists(playlist_id: int) -> Union[requests.Response, None]:
+
+def require_playlist_exists(playlist_id: int, max_stale: float = None) -> DependencyAnswer:
     """Require that the specified playlist exists according to
     the playlists microservice.
 
     Raise a DoesNotExist exception if the playlists microservice does
     not return the expected, positive response.
     Raise a MicroserviceConnectionError exception if connection to the
-    playlists microservice cannot be established.
+    playlists microservice cannot be established, or a ServiceOverloaded
+    exception if it is overloaded, and no last known answer is available.
 
     :param playlist_id: The unique identifier of the playlist to check existence of
-    :return: The microservice response if no exception
+    :param max_stale: The maximum age of the last known answer used while the microservice is unreachable, see :func:`dependency_get`
+    :return: The dependency check answer, whose payload holds the PLAYLIST_FIELDS of the playlist, if no exception
     """
     try:
-        response = requests.get(f"http://playlists:5000/playlists/{playlist_id}")
-        if response.status_code != 200:
-            raise DoesNotExist(f"the playlist with id '{playlist_id}' does not exist")
-
-        return response
+        answer = dependency_get("playlists", f"/playlists/{playlist_id}", max_stale=max_stale,
+                                payload=lambda response: { name: value for name, value in response_json(response).items() if name in PLAYLIST_FIELDS })
     # Explicitly set output values, to ensure graceful failure is handled appropriately
-    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-        raise MicroserviceConnectionError("could not reach the playlists microservice")
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, DependencyFailed) as e:
+        raise _dependency_error("playlists", e)
+
+    if answer.status_code != 200:
+        raise DoesNotExist(f"the playlist with id '{playlist_id}' does not exist")
+    return answer
 
@@ -0,0 +1,101 @@
+import gzip
+
+from flask import Flask, Response, request
+
+try:
+    import brotli
+except ImportError:     # Brotli compression is optional
+    brotli = None
+
+
+# The mimetypes of response bodies that benefit from compression
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/javascript",
+}
+
+
+def make_conditional(response: Response) -> Response:
+    """Add a weak ETag validator to a successful GET response, and answer
+    a matching If-None-Match request header with a 304 Not Modified.
+
+    The ETag is computed over the uncompressed response body. A weak
+    validator is used, because the body may still be content encoded
+    afterwards.
+
+    :param response: The response to make conditional
+    :return: The, possibly 304, response
+    """
+    if request.method not in ("GET", "HEAD") or response.status_code != 200:
+        return response
+    if response.direct_passthrough or response.is_streamed:
+        return response
+
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
+
+
+def negotiate_encoding(app: Flask) -> str:
+    """Choose the content encoding to compress the response with.
+
+    :param app: The app whose config specifies the available encodings
+    :return: 'br', 'gzip' or the empty string if no encoding is acceptable
+    """
+    accepted = request.accept_encodings
+    if brotli is not None and app.config["COMPRESSION_BROTLI"] and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return ""
+
+
+def compress(app: Flask, response: Response) -> Response:
+    """Compress the response body, if the client accepts a supported encoding
+    and the body is large enough to be worth compressing.
+
+    :param app: The app whose config specifies the compression settings
+    :param response: The response to compress
+    :return: The, possibly compressed, response
+    """
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    if response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers:
+        return response
+    if not 200 <= response.status_code < 300 or response.status_code == 204:
+        return response
+
+    # The representation varies per client, even if it remains uncompressed
+    response.vary.add("Accept-Encoding")
+
+    data = response.get_data()
+    if len(data) < app.config["COMPRESSION_MIN_SIZE"]:
+        return response
+
+    encoding = negotiate_encoding(app)
+    if encoding == "br":
+        response.set_data(brotli.compress(data, quality=app.config["COMPRESSION_BROTLI_QUALITY"]))
+    elif encoding == "gzip":
+        response.set_data(gzip.compress(data, compresslevel=app.config["COMPRESSION_GZIP_LEVEL"]))
+    else:
+        return response
+
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def register_response_middleware(app: Flask) -> None:
+    """Register the conditional GET and compression response middleware with the app.
+
+    The conditional GET middleware runs first, so that a 304 Not Modified
+    response never gets compressed, and the ETag always describes the
+    uncompressed representation.
+
+    :param app: The app to register the middleware with
+    """
+    @app.after_request
+    def conditional_and_compressed_response(response: Response) -> Response:
+        response = make_conditional(response)
+        return compress(app, response)
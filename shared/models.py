@@ -0,0 +1,229 @@
+from datetime import datetime
+from json.encoder import encode_basestring_ascii
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from flask import Response
+
+
+class Column:
+    """The description of a single, serializable attribute of a :class:`RowModel`.
+
+    A column maps a json key onto the position of a value in a database
+    cursor row. A column without a row *index* is never filled in from a
+    row; it is an optional attribute that is only serialized if it was
+    explicitly assigned a value.
+    """
+    __slots__ = ("name", "type", "index")
+
+    # The json encoding expression of a value, per supported column type.
+    # A NULL value of any type, e.g. of a nullable column, is encoded as null
+    _ENCODERS = {
+        str: "('null' if {value} is None else _enc_str({value}))",
+        int: "('null' if {value} is None else str(int({value})))",
+        bool: "('null' if {value} is None else 'true' if {value} else 'false')",
+        datetime: "('null' if {value} is None else '\"' + {value}.isoformat() + '\"')",
+    }
+
+    def __init__(self, name: str, type: type, index: Optional[int] = None):
+        """
+        :param name: The attribute name, which doubles as the json key
+        :param type: The python type of the attribute value
+        :param index: The index of the value in a cursor row, if any
+        """
+        if type not in Column._ENCODERS:
+            raise TypeError(f"unsupported column type '{type.__name__}' for column '{name}'")
+
+        self.name = name
+        self.type = type
+        self.index = index
+
+    @property
+    def optional(self) -> bool:
+        """Whether the column is not filled in from a cursor row."""
+        return self.index is None
+
+    def encoder(self, value: str) -> str:
+        """Get the python source expression that json encodes *value*.
+
+        :param value: The python source expression of the value to encode
+        :return: The python source expression of the encoded value
+        """
+        return Column._ENCODERS[self.type].format(value=value)
+
+
+class RowModelMeta(type):
+    """The metaclass of all row models.
+
+    The metaclass derives the ``__slots__`` and annotations of a row model
+    from its ``columns``, and compiles the model's serializers once, at
+    class definition time. The compiled serializers are straight-line
+    python code, specific to the model, that format cursor rows into json
+    text without creating any intermediary dicts.
+    """
+    def __new__(mcs, name: str, bases: tuple, namespace: dict):
+        columns: Tuple[Column, ...] = namespace.get("columns", ())
+        inherited = { slot for base in bases for klass in base.__mro__ for slot in getattr(klass, "__slots__", ()) }
+        namespace["__slots__"] = tuple(column.name for column in columns if column.name not in inherited)
+        namespace["__annotations__"] = { column.name: column.type for column in columns }
+
+        cls = super().__new__(mcs, name, bases, namespace)
+        if columns:
+            mcs._compile(cls, columns)
+        return cls
+
+    @staticmethod
+    def _compile(cls, columns: Tuple[Column, ...]) -> None:
+        """Generate and attach the model specific constructors and serializers.
+
+        :param cls: The row model class to compile
+        :param columns: The columns of the row model
+        """
+        required = [column for column in columns if not column.optional]
+        optional = [column for column in columns if column.optional]
+
+        def key(column: Column) -> str:
+            return repr(encode_basestring_ascii(column.name) + ":")
+
+        # A row is always complete, so its serializer is a single expression
+        row_expression = " + ',' + ".join(
+            f"{key(column)} + {column.encoder(f'row[{column.index}]')}"
+            for column in required
+        )
+
+        instance_lines = [f"    parts = [{', '.join(key(column) + ' + ' + column.encoder('self.' + column.name) for column in required)}]"]
+        for column in optional:
+            instance_lines.append(f"    if self.{column.name} is not None:")
+            instance_lines.append(f"        parts.append({key(column)} + {column.encoder('self.' + column.name)})")
+        instance_lines.append("    return ','.join(parts)")
+
+        init_args = ", ".join([column.name for column in required] + [f"{column.name}=None" for column in optional])
+        init_body = "\n".join(f"    self.{column.name} = {column.name}" for column in columns)
+
+        source = "\n".join([
+            f"def __init__(self, {init_args}):",
+            init_body,
+            "",
+            "def from_row(cls, row):",
+            f"    return cls({', '.join(f'row[{column.index}]' for column in required)})",
+            "",
+            "def dumps_row_fields(row):",
+            f"    return {row_expression or repr('')}",
+            "",
+            "def dumps_rows(rows):",
+            f"    body = '}},{{'.join([{row_expression or repr('')} for row in rows])",
+            "    return '[{' + body + '}]' if body else '[]'",
+            "",
+            "def dumps_fields(self):",
+            *instance_lines,
+        ])
+
+        scope = { "_enc_str": encode_basestring_ascii }
+        exec(compile(source, f"<{cls.__name__} serializers>", "exec"), scope)
+
+        cls.__init__ = scope["__init__"]
+        cls.from_row = classmethod(scope["from_row"])
+        cls.dumps_row_fields = staticmethod(scope["dumps_row_fields"])
+        cls.dumps_rows = staticmethod(scope["dumps_rows"])
+        cls.dumps_fields = scope["dumps_fields"]
+
+
+class RowModel(metaclass=RowModelMeta):
+    """A typed, slotted representation of a single database row.
+
+    Subclasses only declare their ``columns``. The slots, the constructor,
+    and the following serializers are generated from them ahead of time:
+
+    * ``from_row(row)``, construct a model instance from a cursor row
+    * ``dumps_row_fields(row)``, serialize a cursor row into the comma separated json object members, without braces
+    * ``dumps_rows(rows)``, serialize a list of cursor rows into a json array of objects
+    * ``dumps_fields()``, serialize a model instance into the comma separated json object members, without braces
+
+    A list of model instances is serialized into a json array of objects with :meth:`dumps_models`.
+
+    Usage: ::
+
+        class Friend(RowModel):
+            columns = (
+                Column("friend_name", str, 1),
+                Column("created", datetime, 2),
+            )
+
+        >>> Friend.dumps_rows([("bob", "dylan", datetime(2023, 5, 1))])
+        '[{"friend_name":"dylan","created":"2023-05-01T00:00:00"}]'
+    """
+    columns: Tuple[Column, ...] = ()
+
+    @staticmethod
+    def dumps_models(models: Iterable["RowModel"]) -> str:
+        """Serialize a list of model instances into a json array of objects.
+
+        :param models: The model instances to serialize
+        :return: The json array
+        """
+        return "[" + ",".join(["{" + model.dumps_fields() + "}" for model in models]) + "]"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the model instance into a dict, omitting unassigned optional columns.
+
+        :return: The dict of all assigned columns
+        """
+        return {
+            column.name: getattr(self, column.name)
+            for column in self.columns
+            if not (column.optional and getattr(self, column.name) is None)
+        }
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{name}={value!r}' for name, value in self.to_dict().items())})"
+
+
+class SerializedResponse(Response):
+    """A json response whose body was serialized from row models.
+
+    The body of a serialized response conforms to its marshalling schema
+    by construction, so response marshalling skips re-validating it,
+    unless the app runs in debug or testing mode.
+    """
+    default_mimetype = "application/json"
+
+
+def make_response_serialized(message: str, status_code: int, model: Optional[RowModel] = None,
+                             result: Optional[str] = None, **kwargs: Union[str, int, bool]) -> SerializedResponse:
+    """Make a json response from pre-serialized row model data.
+
+    This is the row model counterpart of :func:`shared.APIResponses.make_response_message`. ::
+
+        >>> response = make_response_serialized("Success", 200, result=Friend.dumps_rows(curs.fetchall()))
+        >>> response.data
+        b'{"message":"Success","result":[{"friend_name":"dylan","created":"2023-05-01T00:00:00"}]}'
+
+    :param message: The json body `message` key's value
+    :param status_code: The response status code
+    :param model: The row model whose fields to add to the json body
+    :param result: The serialized json array to add as the json body `result` key's value
+    :param kwargs: The additional json body keys and their values, None is encoded as null
+    :return: The serialized response of the form
+        {
+            "message": *message*,
+            *model fields*,
+            *kwargs*,
+            "result": *result*
+        }
+    """
+    parts = ['"message":' + encode_basestring_ascii(message)]
+    if model is not None and (fields := model.dumps_fields()):
+        parts.append(fields)
+    for name, value in kwargs.items():
+        if value is None:
+            encoded = "null"
+        elif isinstance(value, bool):
+            encoded = "true" if value else "false"
+        elif isinstance(value, int):
+            encoded = str(value)
+        else:
+            encoded = encode_basestring_ascii(value)
+        parts.append(encode_basestring_ascii(name) + ":" + encoded)
+    if result is not None:
+        parts.append('"result":' + result)
+
+    return SerializedResponse("{" + ",".join(parts) + "}", status=status_code)
@@ -0,0 +1,173 @@
+import itertools
+import re
+
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+import psycopg2
+
+from psycopg2.extensions import connection, cursor
+
+from .metrics import Counter
+
+
+STATEMENT_CACHE = Counter("db_prepared_statement_cache_total",
+                          "The amount of executed statements, per prepared statement cache result", ("result",))
+
+_PLACEHOLDER = re.compile(r"%%|%s")
+
+# The statement types that PREPARE accepts
+_PREPARABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "VALUES")
+
+
+def to_prepared(query: str, vars) -> Optional[Tuple[str, int]]:
+    """Convert a psycopg2 query into the body of a server side prepared statement.
+
+    The positional ``%s`` placeholders become ``$1``, ``$2``, ... parameters.
+    Queries with named placeholders, with multiple statements or of
+    statements that cannot be prepared are rejected.
+
+    :param query: The sql query, with psycopg2 placeholders
+    :param vars: The parameters of the query, if any
+    :return: (prepared statement body, amount of parameters), or None if the query cannot be prepared
+    """
+    body = query.strip().rstrip(";").rstrip()
+    if ";" in body or not body.split(None, 1)[0].upper() in _PREPARABLE:
+        return None
+    if vars is None:
+        return body, 0
+    if not isinstance(vars, (tuple, list)):
+        return None
+
+    numbers = itertools.count(1)
+    body = _PLACEHOLDER.sub(lambda match: "%" if match.group(0) == "%%" else f"${next(numbers)}", body)
+    parameters = next(numbers) - 1
+    return (body, parameters) if parameters == len(vars) else None
+
+
+class PreparedStatementCache:
+    """The server side prepared statements of a single connection.
+
+    A statement is prepared once it executed successfully *threshold*
+    times on the connection, comparable to the prepareThreshold of the
+    PostgreSQL JDBC driver, after which it is executed by name and skips
+    parsing and planning. At most *capacity* statements are kept prepared;
+    the least recently executed one is deallocated to make room.
+
+    Prepared statements are bound to their connection, and connections are
+    never shared between threads, so the cache needs no locking.
+    """
+    # The maximum amount of not yet prepared statements whose executions are counted
+    MAX_TRACKED = 1000
+
+    def __init__(self, conn: connection, capacity: int, threshold: int):
+        """
+        :param conn: The connection that owns the prepared statements
+        :param capacity: The maximum amount of prepared statements
+        :param threshold: The amount of executions after which a statement is prepared
+        """
+        self.conn = conn
+        self.capacity = capacity
+        self.threshold = threshold
+        self._prepared: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        # The execution count of every tracked statement, or None if it cannot be prepared
+        self._executions: Dict[str, Union[int, None]] = {}
+        self._names = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._prepared)
+
+    def lookup(self, query: str, vars) -> Optional[Tuple[str, tuple]]:
+        """Get the EXECUTE statement that runs a query as a prepared statement.
+
+        :param query: The sql query, with psycopg2 placeholders
+        :param vars: The parameters of the query, if any
+        :return: (EXECUTE statement, parameters), or None if the query is not prepared
+        """
+        entry = self._prepared.get(query)
+        if entry is None or (vars is not None and not isinstance(vars, (tuple, list))):
+            STATEMENT_CACHE.labels("miss").inc()
+            return None
+
+        name, parameters = entry
+        if parameters == 0:
+            if vars:
+                STATEMENT_CACHE.labels("miss").inc()
+                return None
+            self._prepared.move_to_end(query)
+            STATEMENT_CACHE.labels("hit").inc()
+            return f"EXECUTE {name};", None
+        if vars is None or len(vars) != parameters:
+            STATEMENT_CACHE.labels("miss").inc()
+            return None
+
+        self._prepared.move_to_end(query)
+        STATEMENT_CACHE.labels("hit").inc()
+        return f"EXECUTE {name} ({', '.join(['%s'] * parameters)});", tuple(vars)
+
+    def executed(self, query: str, vars) -> None:
+        """Count a successful, unprepared execution of a query, and prepare it once hot.
+
+        :param query: The sql query, with psycopg2 placeholders
+        :param vars: The parameters of the query, if any
+        """
+        if query in self._prepared:
+            return
+        count = self._executions.get(query, 0)
+        if count is None:
+            return
+        if count + 1 < self.threshold:
+            if query not in self._executions and len(self._executions) >= PreparedStatementCache.MAX_TRACKED:
+                self._executions.clear()
+            self._executions[query] = count + 1
+            return
+
+        prepared = to_prepared(query, vars)
+        if prepared is None or not self._prepare(query, *prepared):
+            self._executions[query] = None
+        else:
+            self._executions.pop(query, None)
+
+    def _prepare(self, query: str, body: str, parameters: int) -> bool:
+        """Prepare a statement, deallocating the least recently executed one if the cache is full.
+
+        The statement is prepared inside a savepoint, so a statement that
+        cannot be prepared never aborts the ongoing transaction.
+
+        :return: Whether the statement was prepared
+        """
+        name = f"shared_stmt_{next(self._names)}"
+        savepoint = not self.conn.autocommit
+        try:
+            # A plain cursor, so the bookkeeping statements are not instrumented
+            with self.conn.cursor(cursor_factory=cursor) as curs:
+                if savepoint:
+                    curs.execute("SAVEPOINT prepare_statement;")
+                try:
+                    while len(self._prepared) >= self.capacity:
+                        _, (evicted, _) = self._prepared.popitem(last=False)
+                        curs.execute(f"DEALLOCATE {evicted};")
+                    curs.execute(f"PREPARE {name} AS {body};")
+                except psycopg2.Error:
+                    if savepoint:
+                        curs.execute("ROLLBACK TO SAVEPOINT prepare_statement;")
+                    return False
+                if savepoint:
+                    curs.execute("RELEASE SAVEPOINT prepare_statement;")
+        except psycopg2.Error:
+            return False
+
+        self._prepared[query] = (name, parameters)
+        return True
+
+
+def statement_cache_report() -> dict:
+    """Report the prepared statement cache hit rate, of all worker processes.
+
+    :return: The amount of hits and misses, and the hit rate
+    """
+    counts = STATEMENT_CACHE.aggregate()
+    hits = counts.get(("hit",), 0.0)
+    misses = counts.get(("miss",), 0.0)
+    total = hits + misses
+    return { "hits": int(hits), "misses": int(misses), "hit_rate": round(hits / total, 4) if total else 0.0 }
@@ -0,0 +1,205 @@
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+
+from collections import Counter
+from typing import Dict, Optional
+
+from flask import Flask, Response, g, request
+
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_MODE_HEADER = "X-Profile-Mode"
+PROFILE_OUTPUT_HEADER = "X-Profile-Output"
+
+SAMPLING = "sample"
+CPROFILE = "cprofile"
+
+
+def _frame_label(frame) -> str:
+    """Get the collapsed stack label of a single stack frame, e.g. 'app.py:get'."""
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """A profiler that periodically samples the call stack of a single thread.
+
+    The sampling happens in a separate thread, so the profiled code runs
+    unmodified. The samples are counted per distinct call stack, which
+    directly yields the collapsed stack format.
+    """
+    def __init__(self, interval: float):
+        """
+        :param interval: The time between two samples, in seconds
+        """
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._target = threading.get_ident()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._sampler.join()
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+class RouteProfiles:
+    """The per route aggregation of all profiles of a process.
+
+    Every route gets one collapsed stacks file with the merged sampling
+    profiles, and one pstats file with the merged cProfile profiles. The
+    files are suffixed with the process id, so the workers of a
+    microservice never overwrite each other's files. Collapsed stack files
+    of multiple workers can simply be concatenated before rendering a
+    flamegraph from them.
+    """
+    def __init__(self, directory: str):
+        """
+        :param directory: The directory to write the profile files to
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._stacks: Dict[str, Counter] = {}
+        self._stats: Dict[str, pstats.Stats] = {}
+
+    def _path(self, route: str, extension: str) -> str:
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        return os.path.join(self.directory, f"{slug}.{os.getpid()}.{extension}")
+
+    def add_samples(self, route: str, stacks: Counter) -> str:
+        """Merge the sampled stacks of a request into the route's collapsed stacks file.
+
+        :param route: The route of the profiled request
+        :param stacks: The sample count per collapsed stack
+        :return: The path of the route's collapsed stacks file
+        """
+        path = self._path(route, "collapsed")
+        with self._lock:
+            merged = self._stacks.setdefault(route, Counter())
+            merged.update(stacks)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w") as file:
+                file.writelines(f"{stack} {count}\n" for stack, count in merged.items())
+        return path
+
+    def add_profile(self, route: str, profile: cProfile.Profile) -> str:
+        """Merge the cProfile profile of a request into the route's pstats file.
+
+        :param route: The route of the profiled request
+        :param profile: The finished profile
+        :return: The path of the route's pstats file
+        """
+        path = self._path(route, "prof")
+        with self._lock:
+            if route in self._stats:
+                self._stats[route].add(profile)
+            else:
+                self._stats[route] = pstats.Stats(profile)
+            os.makedirs(self.directory, exist_ok=True)
+            self._stats[route].dump_stats(path)
+        return path
+
+
+def has_profiling_token(app: Flask) -> bool:
+    """Check whether the current request carries the operator-only profiling header with the PROFILING_TOKEN.
+
+    :param app: The app that handles the request
+    :return: Whether the request is authorized, always False if no PROFILING_TOKEN is configured
+    """
+    token = app.config["PROFILING_TOKEN"]
+    header = request.headers.get(PROFILE_HEADER)
+    return bool(token) and header is not None and hmac.compare_digest(header, token)
+
+
+def profiling_mode(app: Flask) -> Optional[str]:
+    """Decide whether, and how, to profile the current request.
+
+    A request is profiled if it carries the operator-only profiling header
+    with the configured PROFILING_TOKEN, or else if it is sampled at the
+    configured PROFILING_SAMPLE_RATE.
+
+    :param app: The app that handles the request
+    :return: The profiling mode, or None if the request is not profiled
+    """
+    if has_profiling_token(app):
+        mode = request.headers.get(PROFILE_MODE_HEADER, SAMPLING)
+        return mode if mode in (SAMPLING, CPROFILE) else SAMPLING
+
+    rate = app.config["PROFILING_SAMPLE_RATE"]
+    if rate > 0 and random.random() < rate:
+        return SAMPLING
+    return None
+
+
+def register_profiling(app: Flask) -> None:
+    """Register the on-demand request profiling hook with the app.
+
+    The hook is disabled unless the PROFILING_TOKEN or PROFILING_SAMPLE_RATE
+    config values are set. The profiles are aggregated per route and written
+    to the PROFILING_DIR directory, see :class:`RouteProfiles`. Requests
+    profiled on demand get the path of the updated profile file in their
+    X-Profile-Output response header.
+
+    :param app: The app to profile
+    """
+    if not app.config["PROFILING_TOKEN"] and app.config["PROFILING_SAMPLE_RATE"] <= 0:
+        return
+
+    profiles = RouteProfiles(app.config["PROFILING_DIR"])
+
+    @app.before_request
+    def start_profiler() -> None:
+        mode = profiling_mode(app)
+        if mode == CPROFILE:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+        elif mode == SAMPLING:
+            g.profiler = SamplingProfiler(app.config["PROFILING_INTERVAL"])
+            g.profiler.start()
+
+    @app.after_request
+    def stop_profiler(response: Response) -> Response:
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            path = profiles.add_profile(route, profiler)
+        else:
+            profiler.stop()
+            path = profiles.add_samples(route, profiler.stacks)
+
+        # Only the operator learns where the profiles are stored, not every sampled request with the header
+        if has_profiling_token(app):
+            response.headers[PROFILE_OUTPUT_HEADER] = path
+        return response
+
+    @app.teardown_request
+    def discard_profiler(exception: BaseException = None) -> None:
+        # Requests that failed with an unhandled exception never reach after_request
+        profiler = g.pop("profiler", None)
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        elif profiler is not None:
+            profiler.stop()
@@ -0,0 +1,171 @@
+import json
+import random
+import threading
+
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, Iterator, List, Optional
+
+from .metrics import Counter
+
+
+ENDPOINT_EJECTIONS = Counter("outbound_endpoint_ejections_total", "The amount of times an endpoint was ejected for failing", ("target", "endpoint"))
+
+
+class Endpoint:
+    """A single replica of a microservice, and its client-side load and health."""
+    __slots__ = ("url", "outstanding", "failures", "ejected_until", "shed", "shed_until")
+
+    def __init__(self, url: str):
+        """
+        :param url: The base url of the replica, without trailing slash
+        """
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        # The amount of consecutive requests the replica shed, and until when it asked to back off
+        self.shed = 0
+        self.shed_until = 0.0
+
+    def load(self, now: float) -> int:
+        """Get the load of the replica: its outstanding requests, plus its shed requests while it asks to back off."""
+        return self.outstanding + (self.shed if self.shed_until > now else 0)
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.url!r}, outstanding={self.outstanding}, failures={self.failures})"
+
+
+def parse_endpoints(spec: str) -> Dict[str, List[str]]:
+    """Parse an endpoint specification, e.g. 'friends=friends:5000,friends_2:5000;playlists=playlists:5000'.
+
+    Every microservice name maps onto the comma separated addresses of its
+    replicas. Addresses without scheme are served over http.
+
+    :param spec: The endpoint specification
+    :return: The base urls of the replicas of every microservice
+    """
+    endpoints = {}
+    for service in filter(None, (part.strip() for part in spec.split(";"))):
+        name, _, addresses = service.partition("=")
+        endpoints[name.strip()] = [
+            address if "://" in address else f"http://{address}"
+            for address in filter(None, (address.strip().rstrip("/") for address in addresses.split(",")))
+        ]
+    return endpoints
+
+
+class ServiceRegistry:
+    """The replicas of every microservice, balanced by least outstanding requests.
+
+    Every request goes to the replica with the fewest requests in flight
+    from this process, picked at random among equals. A replica that
+    fails *eject_after* consecutive requests, by not answering or with a
+    5xx status, is ejected for *eject_duration* seconds. If all replicas
+    of a microservice are ejected, the one that is readmitted first is
+    used anyway.
+
+    A 503 with a Retry-After header is load shedding by a busy replica,
+    not a failure, so it never ejects the replica; ejecting busy replicas
+    would only overload the others in turn. Instead, until the Retry-After
+    time, every consecutive shed request counts as one more outstanding
+    request of the replica, so new requests prefer the other replicas.
+
+    Microservices without configured replicas are served by a single
+    replica at ``http://<name>:<default port>``.
+    """
+    def __init__(self, endpoints: Dict[str, List[str]], default_port: int, eject_after: int, eject_duration: float):
+        """
+        :param endpoints: The base urls of the replicas of every microservice
+        :param default_port: The port of microservices without configured replicas
+        :param eject_after: The amount of consecutive failures after which a replica is ejected
+        :param eject_duration: The time a failing replica is ejected for, in seconds
+        """
+        self.default_port = default_port
+        self.eject_after = eject_after
+        self.eject_duration = eject_duration
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, List[Endpoint]] = {
+            name: [Endpoint(url) for url in urls] for name, urls in endpoints.items() if urls
+        }
+
+    def endpoints(self, service_name: str) -> List[Endpoint]:
+        """Get the replicas of a microservice."""
+        endpoints = self._endpoints.get(service_name)
+        if endpoints is None:
+            with self._lock:
+                endpoints = self._endpoints.setdefault(service_name, [Endpoint(f"http://{service_name}:{self.default_port}")])
+        return endpoints
+
+    def choose(self, service_name: str) -> Endpoint:
+        """Choose the replica of a microservice with the least outstanding requests.
+
+        :param service_name: The name of the microservice
+        :return: The chosen replica
+        """
+        endpoints = self.endpoints(service_name)
+        if len(endpoints) == 1:
+            return endpoints[0]
+
+        now = monotonic()
+        with self._lock:
+            healthy = [endpoint for endpoint in endpoints if endpoint.ejected_until <= now]
+            if not healthy:
+                return min(endpoints, key=lambda endpoint: endpoint.ejected_until)
+            least = min(endpoint.load(now) for endpoint in healthy)
+            return random.choice([endpoint for endpoint in healthy if endpoint.load(now) == least])
+
+    @contextmanager
+    def use(self, service_name: str) -> Iterator[Endpoint]:
+        """Choose a replica of a microservice, and count a request to it as outstanding for the with block.
+
+        :param service_name: The name of the microservice
+        :return: The chosen replica
+        """
+        endpoint = self.choose(service_name)
+        with self._lock:
+            endpoint.outstanding += 1
+        try:
+            yield endpoint
+        finally:
+            with self._lock:
+                endpoint.outstanding -= 1
+
+    def report(self, service_name: str, endpoint: Endpoint, healthy: bool, retry_after: Optional[float] = None) -> None:
+        """Report the outcome of a request to a replica, ejecting it after too many failures.
+
+        :param service_name: The name of the microservice
+        :param endpoint: The replica
+        :param healthy: Whether the replica answered without a 5xx status
+        :param retry_after: The Retry-After time of a shed request, in seconds, if the replica shed the request
+        """
+        with self._lock:
+            if retry_after is not None:
+                endpoint.shed += 1
+                endpoint.shed_until = max(endpoint.shed_until, monotonic() + retry_after)
+                return
+            endpoint.shed = 0
+            if healthy:
+                endpoint.failures = 0
+                return
+            endpoint.failures += 1
+            if endpoint.failures < self.eject_after:
+                return
+            endpoint.failures = 0
+            endpoint.ejected_until = monotonic() + self.eject_duration
+        ENDPOINT_EJECTIONS.labels(service_name, endpoint.url).inc()
+
+
+def load_endpoints(spec: str, path: str) -> Dict[str, List[str]]:
+    """Load the configured replicas of the microservices.
+
+    :param spec: The endpoint specification, see :func:`parse_endpoints`
+    :param path: The path of a json file that maps microservice names onto lists of base urls, if any
+    :return: The base urls of the replicas of every microservice
+    """
+    endpoints = {}
+    if path:
+        with open(path) as file:
+            endpoints.update(parse_endpoints(";".join(f"{name}={','.join(urls)}" for name, urls in json.load(file).items())))
+    endpoints.update(parse_endpoints(spec))
+    return endpoints
@@ -0,0 +1,199 @@
+import os
+import random
+import threading
+import time
+
+from typing import List, Optional, Union
+
+import psycopg2
+
+from flask import Flask, Response, g, has_app_context, has_request_context, request
+
+from .database import Database
+
+
+# The request methods that never write, and hence may read from a replica
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# A request carrying 'X-Read-Consistency: primary' always reads from the primary
+CONSISTENCY_HEADER = "X-Read-Consistency"
+PRIMARY = "primary"
+
+# The cookie that routes a client's reads to the primary until the contained unix time
+READ_PRIMARY_COOKIE = "read_primary_until"
+
+# The response header of a successful write, that holds the same unix time as its cookie, for clients without a cookie jar
+READ_PRIMARY_HEADER = "X-Read-Primary-Until"
+
+
+class ReplicaMonitor:
+    """Periodically check the health and replication lag of a database's replicas.
+
+    The checks run in a background thread per process, so choosing a
+    replica never blocks a request. A replica is healthy while it is
+    reachable and lags at most *max_lag* seconds behind the primary.
+    """
+    def __init__(self, replicas: List[Database], max_lag: float, interval: float):
+        """
+        :param replicas: The replicas to monitor
+        :param max_lag: The maximum replication lag, in seconds, of a healthy replica
+        :param interval: The time between two checks of all replicas, in seconds
+        """
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.interval = interval
+        self.healthy: List[Database] = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        """Start the background checker of the calling process, if not started yet."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.healthy = []
+            threading.Thread(target=self._check_replicas, name="replica-monitor", daemon=True).start()
+
+    def _check_replicas(self) -> None:
+        while True:
+            healthy = []
+            for replica in self.replicas:
+                lag = replica.replication_lag()
+                if lag is not None and lag <= self.max_lag:
+                    healthy.append(replica)
+            self.healthy = healthy
+            time.sleep(self.interval)
+
+    def choose(self) -> Optional[Database]:
+        """Choose a random healthy replica.
+
+        :return: The replica, or None if no replica is healthy
+        """
+        self._ensure_worker()
+        healthy = self.healthy
+        return random.choice(healthy) if healthy else None
+
+
+def reads_from_primary() -> bool:
+    """Decide whether the current request must be handled by the primary.
+
+    Writing requests always are. Reading requests are as well if the client
+    asked for it explicitly with the X-Read-Consistency header, or if the
+    client wrote recently, to let it read its own writes. A client that
+    wrote recently is known by its cookie, or by the ``g.read_primary_until``
+    time of a client that keeps the read consistency state itself, see
+    :func:`forward_read_consistency`.
+
+    :return: Whether the request must use the primary
+    """
+    if request.method not in READ_METHODS:
+        return True
+    if request.headers.get(CONSISTENCY_HEADER, "").lower() == PRIMARY:
+        return True
+    if g.get("read_primary_until", 0) > time.time():
+        return True
+    try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def forward_read_consistency(headers: dict) -> dict:
+    """Let a request to another microservice read from the primary if the current request does.
+
+    Inter-microservice requests carry no cookies, so the read consistency of
+    the current request, if any, is passed on per request instead, with the
+    X-Read-Consistency header.
+
+    :param headers: The headers of the outgoing request, updated in place
+    :return: The headers
+    """
+    if has_request_context() and reads_from_primary():
+        headers.setdefault(CONSISTENCY_HEADER, PRIMARY)
+    return headers
+
+
+def record_read_consistency(response_headers) -> None:
+    """Route the reads of the current request's client to the primary, if another microservice asks to.
+
+    Keeps the time of the READ_PRIMARY_HEADER of a response of another
+    microservice as ``g.read_primary_until``, so the later requests of the
+    current request read the write that the response reports. A client
+    that persists the time across its requests, e.g. the GUI in its
+    session, reads its own writes on every later request as well.
+
+    :param response_headers: The headers of the response of the other microservice
+    """
+    try:
+        until = float(response_headers.get(READ_PRIMARY_HEADER, 0))
+    except ValueError:
+        return
+    if until and has_app_context() and until > g.get("read_primary_until", 0):
+        g.read_primary_until = until
+
+
+def register_read_own_writes(app: Flask, window: float) -> None:
+    """Route the reads of a client that wrote to the primary, for the next *window* seconds.
+
+    A successful writing request sets a cookie, and the equivalent
+    READ_PRIMARY_HEADER, see :func:`reads_from_primary`. Registered by the
+    replica routing, and by an app that answers reads from state that lags
+    the primary like a replica does, e.g. an in-memory copy.
+
+    :param app: The app to route the requests of
+    :param window: The time, in seconds, that a client reads from the primary after writing
+    """
+    @app.after_request
+    def read_own_writes(response: Response) -> Response:
+        if request.method not in READ_METHODS and response.status_code < 400:
+            until = str(time.time() + window)
+            response.set_cookie(READ_PRIMARY_COOKIE, until, max_age=int(window) + 1, httponly=True)
+            response.headers[READ_PRIMARY_HEADER] = until
+        return response
+
+
+def register_replica_routing(app: Flask, db: Union[Database, None], max_lag: float, interval: float, window: float) -> None:
+    """Route the reading requests of the app to the healthy replicas of its database.
+
+    The routing is disabled if the database has no replicas. A successful
+    writing request routes the client's reads to the primary for the next
+    *window* seconds, see :func:`register_read_own_writes`.
+
+    :param app: The app to route the requests of
+    :param db: The database handle of the microservice, if any
+    :param max_lag: The maximum replication lag, in seconds, of a replica that is read from
+    :param interval: The time between two replica health checks, in seconds
+    :param window: The time, in seconds, that a client reads from the primary after writing
+    """
+    if db is None or not db.replicas:
+        return
+
+    monitor = ReplicaMonitor(db.replicas, max_lag, interval)
+
+    @app.before_request
+    def route_reads() -> None:
+        if reads_from_primary():
+            return
+        replica = monitor.choose()
+        if replica is not None:
+            g.db_replica = replica
+            g.db_route = db.route_to(replica)
+
+    register_read_own_writes(app, window)
+
+    @app.teardown_request
+    def end_read(exception: BaseException = None) -> None:
+        token = g.pop("db_route", None)
+        if token is None:
+            return
+        # Replicas cancel queries that conflict with replay, so never keep their transactions open
+        try:
+            g.pop("db_replica").end_transaction()
+        # Explicitly set output values, to ensure graceful failure is handled appropriately
+        except psycopg2.Error:
+            pass
+        finally:
+            db.reset_route(token)
@@ -0,0 +1,106 @@
+import threading
+
+from collections import OrderedDict
+from contextvars import copy_context
+from time import monotonic, sleep
+from typing import Any, Callable, Hashable, Set, Tuple, Type
+
+from .metrics import Counter
+
+
+STALE_ANSWERS = Counter("dependency_stale_answers_total", "The amount of dependency checks answered from a stale answer, because the dependency was unreachable", ("target",))
+
+
+class StaleWhileRevalidate:
+    """Remember the last answer of every call, and fall back onto it while the call fails.
+
+    A call that fails with one of the *unavailable* exceptions is answered
+    by the last answer of the same key instead, provided that answer is at
+    most *max_stale* seconds old. The key is then refreshed in a background
+    thread until the call succeeds again, and meanwhile every call of the
+    key is answered from the stale answer without being attempted, so
+    callers do not wait for an unreachable dependency. ::
+
+        response = fallback.call("accounts", ("accounts", "/accounts/bob"), fetch_account, max_stale=60)
+
+    Without a sufficiently fresh answer, the exception is passed up as is.
+    """
+    def __init__(self, max_entries: int, refresh_interval: float, unavailable: Tuple[Type[BaseException], ...]):
+        """
+        :param max_entries: The maximum amount of remembered answers
+        :param refresh_interval: The time between two background refresh attempts of a key, in seconds
+        :param unavailable: The exceptions that signal an unreachable or failing dependency
+        """
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+        self.unavailable = unavailable
+        self._lock = threading.Lock()
+        self._answers: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._refreshing: Set[Hashable] = set()
+
+    def _remember(self, key: Hashable, answer: Any) -> None:
+        with self._lock:
+            self._answers[key] = (answer, monotonic())
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.max_entries:
+                self._answers.popitem(last=False)
+
+    def _stale(self, key: Hashable, max_stale: float) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._answers.get(key)
+        if entry is None or monotonic() - entry[1] > max_stale:
+            return False, None
+        return True, entry[0]
+
+    def _refresh(self, key: Hashable, func: Callable[[], Any], max_stale: float) -> None:
+        """Retry a failing call in the background, until it succeeds or its last answer is too stale."""
+        try:
+            while self._stale(key, max_stale)[0]:
+                sleep(self.refresh_interval)
+                try:
+                    self._remember(key, func())
+                    return
+                except self.unavailable:
+                    continue
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _start_refresh(self, key: Hashable, func: Callable[[], Any], max_stale: float) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        # Run in a copy of the calling context, so the refresh is traced as part of the calling span
+        threading.Thread(target=copy_context().run, args=(self._refresh, key, func, max_stale),
+                         name="revalidate", daemon=True).start()
+
+    def call(self, target: str, key: Hashable, func: Callable[[], Any], max_stale: float) -> Any:
+        """Execute a call, falling back onto its last answer if it is unavailable.
+
+        :param target: The name of the called dependency, e.g. the microservice name
+        :param key: The identity of the call
+        :param func: The call
+        :param max_stale: The maximum age of an acceptable fallback answer, in seconds, 0 disables the fallback
+        :return: The answer of the call, or its stale last answer
+        """
+        with self._lock:
+            refreshing = key in self._refreshing
+        if refreshing:
+            found, answer = self._stale(key, max_stale)
+            if found:
+                STALE_ANSWERS.labels(target).inc()
+                return answer
+
+        try:
+            answer = func()
+        except self.unavailable:
+            found, answer = self._stale(key, max_stale)
+            if not found:
+                raise
+            STALE_ANSWERS.labels(target).inc()
+            self._start_refresh(key, func, max_stale)
+            return answer
+
+        self._remember(key, answer)
+        return answer
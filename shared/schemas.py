@@ -1,7 +1,13 @@
 from marshmallow import Schema, fields
 
+from . import serialization
+
 
 class MicroservicesResponseSchema(Schema):
+    class Meta:
+        # Render marshalled responses through the fast json path
+        render_module = serialization
+
     message = fields.String(required=True, default='default message', metadata={
         'description': 'The response of the API that can be displayed to non-technical users of a consumer application of the API',
     })
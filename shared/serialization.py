@@ -0,0 +1,83 @@
+import json
+
+from datetime import date, datetime, time
+from typing import Any, Union
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:     # Fall back onto the stdlib json module
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """Encode the non-json types used in API responses.
+
+    Date times are encoded as ISO8601 strings, mirroring the
+    marshmallow ``fields.DateTime(format="iso")`` fields.
+
+    :param obj: The object that json cannot encode natively
+    :return: The json encodable representation of *obj*
+    """
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Serialize *obj* to compact, utf-8 encoded json.
+
+    :param obj: The object to serialize
+    :return: The json bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any, *args, **kwargs) -> str:
+    """Serialize *obj* to a compact json string.
+
+    The extra arguments are accepted for compatibility with the
+    marshmallow ``render_module`` interface, and are ignored.
+
+    :param obj: The object to serialize
+    :return: The json string
+    """
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def loads(data: Union[str, bytes, bytearray], *args, **kwargs) -> Any:
+    """Deserialize json text.
+
+    The extra arguments are accepted for compatibility with the
+    marshmallow ``render_module`` interface, and are ignored.
+
+    :param data: The json text to deserialize
+    :return: The deserialized python object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(JSONProvider):
+    """A Flask json provider that serializes through orjson, if installed.
+
+    Date times are encoded natively, so API endpoints may pass datetime
+    objects into their responses as is. Without orjson, the stdlib json
+    module is used instead.
+    """
+    mimetype = "application/json"
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return dumps(obj)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        """Serialize the arguments straight into the json response body bytes."""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,121 @@
+"""Serve a microservice Flask app.
+
+Usage: ::
+
+    python3 -m shared.server accounts/app.py
+
+In production mode, the default, the app is served by a preloaded,
+multi-worker gunicorn WSGI server. The app module is imported once by
+the master process, after which the workers are forked from it. Sending
+SIGHUP to the master gracefully replaces all workers, and SIGTERM
+gracefully shuts the server down.
+
+In development mode, the app is served by the single process Flask
+development server instead.
+
+The server is configured through the following environment variables:
+
+* ``SERVER_MODE``, either 'production' or 'development'
+* ``SERVER_BIND``, the address to bind to
+* ``SERVER_WORKERS``, the number of worker processes, defaults to 2 * cores + 1
+* ``SERVER_THREADS``, the number of request threads per worker process. These
+  should exceed the admission limit plus queue of a single route, see
+  :mod:`shared.admission`, so one overloaded route never occupies all threads.
+  They may exceed the database connections per worker, ``DB_POOL_SIZE``, since
+  every request returns its connection when it ends, see :class:`shared.database.Database`
+* ``SERVER_GRACEFUL_TIMEOUT``, the seconds workers get to finish their requests on reload or shutdown
+* ``SERVER_MAX_REQUESTS``, recycle a worker after this many requests, 0 disables recycling
+
+The workers of a production server share their metrics and query statistics
+through a fresh directory, see :mod:`shared.workerSnapshots`.
+"""
+import os
+import sys
+import tempfile
+
+from multiprocessing import cpu_count
+
+from flask import Flask
+from flask.cli import prepare_import, locate_app
+
+
+SERVER_MODE = os.environ.get("SERVER_MODE", "production")
+SERVER_BIND = os.environ.get("SERVER_BIND", "0.0.0.0:5000")
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 2 * cpu_count() + 1))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", 16))
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30))
+SERVER_MAX_REQUESTS = int(os.environ.get("SERVER_MAX_REQUESTS", 0))
+
+
+def load_app(app_path: str) -> Flask:
+    """Import the Flask app from the app module at *app_path*.
+
+    The directory of the app module is added to the python path, exactly
+    as ``flask --app <app_path>`` does.
+
+    :param app_path: The file path of the app module, e.g. 'accounts/app.py'
+    :return: The Flask app
+    """
+    module_name = prepare_import(app_path)
+    return locate_app(module_name, None)
+
+
+def gunicorn_options() -> dict:
+    """Get the gunicorn settings of the production server.
+
+    :return: The gunicorn settings
+    """
+    return {
+        "bind": SERVER_BIND,
+        "workers": SERVER_WORKERS,
+        "threads": SERVER_THREADS,
+        "worker_class": "gthread" if SERVER_THREADS > 1 else "sync",
+        "preload_app": True,
+        "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+        "max_requests": SERVER_MAX_REQUESTS,
+        "max_requests_jitter": SERVER_MAX_REQUESTS // 10,
+        "accesslog": "-",
+    }
+
+
+def serve_production(app: Flask, options: dict) -> None:
+    """Serve the app with a preloaded, multi-worker gunicorn server.
+
+    :param app: The Flask app to serve
+    :param options: The gunicorn settings
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class MicroserviceApplication(BaseApplication):
+        """A gunicorn application that serves an already imported Flask app."""
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    MicroserviceApplication().run()
+
+
+def serve(app_path: str) -> None:
+    """Serve the Flask app at *app_path* in the configured server mode.
+
+    :param app_path: The file path of the app module, e.g. 'accounts/app.py'
+    """
+    if SERVER_MODE != "development":
+        # Set before the app is imported, so its config picks it up
+        os.environ.setdefault("WORKER_STATE_DIR", tempfile.mkdtemp(prefix="worker-state-"))
+    app = load_app(app_path)
+
+    if SERVER_MODE == "development":
+        host, _, port = SERVER_BIND.rpartition(":")
+        app.run(host=host, port=int(port))
+    else:
+        serve_production(app, gunicorn_options())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python3 -m shared.server <app path>")
+    serve(sys.argv[1])
@@ -0,0 +1,62 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from typing import Optional
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _signature(payload: str, secret: str) -> str:
+    return _encode(hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def issue_session_token(username: str, secret: str, ttl: float) -> Optional[str]:
+    """Issue a signed, expiring session token for an authenticated user.
+
+    The token is '<payload>.<signature>', where the payload is the base64url
+    encoded json ``{"sub": <username>, "iat": <issued at>, "exp": <expires at>}``
+    and the signature its base64url encoded HMAC-SHA256 under *secret*. Any
+    holder of the secret verifies the token locally, see :func:`verify_session_token`.
+
+    :param username: The username of the authenticated user
+    :param secret: The secret shared by the issuer and the verifiers
+    :param ttl: The time until the token expires, in seconds
+    :return: The session token, or None if no secret is configured
+    """
+    if not secret:
+        return None
+    now = int(time.time())
+    payload = _encode(json.dumps({ "sub": username, "iat": now, "exp": now + int(ttl) }, separators=(",", ":")).encode())
+    return f"{payload}.{_signature(payload, secret)}"
+
+
+def verify_session_token(token: str, secret: str) -> Optional[str]:
+    """Verify a session token, without any database or network access.
+
+    :param token: The session token, see :func:`issue_session_token`
+    :param secret: The secret shared by the issuer and the verifiers
+    :return: The username of the token's user, or None if the token is malformed, forged or expired,
+    or if no secret is configured
+    """
+    if not secret:
+        return None
+    payload, _, signature = token.partition(".")
+    if not payload or not signature or not hmac.compare_digest(signature.encode(), _signature(payload, secret).encode()):
+        return None
+    try:
+        claims = json.loads(_decode(payload))
+    # Explicitly set output values, to ensure graceful failure is handled appropriately
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get("sub"), str) or claims.get("exp", 0) <= time.time():
+        return None
+    return claims["sub"]
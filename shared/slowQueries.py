@@ -0,0 +1,255 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional
+
+import psycopg2
+
+from psycopg2.extensions import connection, cursor
+
+
+logger = logging.getLogger("shared.slow_queries")
+
+
+class StatementStats:
+    """The accumulated execution statistics of a single statement fingerprint."""
+    __slots__ = ("calls", "total", "max", "slow_calls", "plan")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow_calls = 0
+        self.plan: Optional[str] = None
+
+    def snapshot(self) -> list:
+        """Get the json serializable statistics."""
+        return [self.calls, self.total, self.max, self.slow_calls, self.plan]
+
+    @staticmethod
+    def from_snapshot(snapshot: list) -> "StatementStats":
+        stats = StatementStats()
+        stats.calls, stats.total, stats.max, stats.slow_calls, stats.plan = snapshot
+        return stats
+
+    def merge(self, other: "StatementStats") -> "StatementStats":
+        merged = StatementStats()
+        merged.calls = self.calls + other.calls
+        merged.total = self.total + other.total
+        merged.max = max(self.max, other.max)
+        merged.slow_calls = self.slow_calls + other.slow_calls
+        merged.plan = self.plan or other.plan
+        return merged
+
+
+class QueryStats:
+    """Rolling execution statistics per statement fingerprint.
+
+    The statistics are kept in two consecutive windows: the current and the
+    previous one. When the current window expires, it becomes the previous
+    window and the oldest window is dropped. Reports merge both windows, so
+    they always cover between one and two window lengths of history.
+    """
+    # The maximum amount of distinct fingerprints kept per window
+    MAX_STATEMENTS = 1000
+
+    def __init__(self, window: float):
+        """
+        :param window: The length of a single window, in seconds
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._current: Dict[str, StatementStats] = {}
+        self._previous: Dict[str, StatementStats] = {}
+        self._rotated = time.monotonic()
+
+    def _rotate(self) -> None:
+        now = time.monotonic()
+        if now - self._rotated >= self.window:
+            self._previous = self._current if now - self._rotated < 2 * self.window else {}
+            self._current = {}
+            self._rotated = now
+
+    def record(self, statement: str, duration: float, slow: bool) -> None:
+        """Record a single execution of a statement.
+
+        :param statement: The statement fingerprint
+        :param duration: The execution time, in seconds
+        :param slow: Whether the execution exceeded the slow query threshold
+        """
+        with self._lock:
+            self._rotate()
+            stats = self._current.get(statement)
+            if stats is None:
+                if len(self._current) >= QueryStats.MAX_STATEMENTS:
+                    return
+                stats = self._current[statement] = StatementStats()
+            stats.calls += 1
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+            stats.slow_calls += slow
+
+    def record_plan(self, statement: str, plan: str) -> None:
+        """Keep the most recently captured query plan of a statement.
+
+        :param statement: The statement fingerprint
+        :param plan: The EXPLAIN output
+        """
+        with self._lock:
+            stats = self._current.get(statement)
+            if stats is not None:
+                stats.plan = plan
+
+    def snapshot(self) -> Dict[str, list]:
+        """Get the json serializable statistics of both windows, merged per statement."""
+        with self._lock:
+            self._rotate()
+            merged = dict(self._previous)
+            for statement, stats in self._current.items():
+                merged[statement] = merged[statement].merge(stats) if statement in merged else stats
+            return { statement: stats.snapshot() for statement, stats in merged.items() }
+
+    def top(self, n: int) -> List[dict]:
+        """Get the *n* statements of the calling process with the highest total execution time.
+
+        :param n: The maximum amount of statements to report
+        :return: The report of each statement, ordered by descending total time
+        """
+        return QueryStats.report((self.snapshot(),), n)
+
+    @staticmethod
+    def report(snapshots: Iterable[Dict[str, list]], n: int) -> List[dict]:
+        """Get the *n* statements with the highest total execution time, over several processes.
+
+        :param snapshots: The statistics of every process, see :meth:`snapshot`
+        :param n: The maximum amount of statements to report
+        :return: The report of each statement, ordered by descending total time
+        """
+        merged: Dict[str, StatementStats] = {}
+        for snapshot in snapshots:
+            for statement, values in snapshot.items():
+                stats = StatementStats.from_snapshot(values)
+                merged[statement] = merged[statement].merge(stats) if statement in merged else stats
+
+        ranked = sorted(merged.items(), key=lambda item: item[1].total, reverse=True)[:n]
+        return [
+            {
+                "statement": statement,
+                "calls": stats.calls,
+                "total_ms": round(stats.total * 1000, 3),
+                "mean_ms": round(stats.total * 1000 / stats.calls, 3),
+                "max_ms": round(stats.max * 1000, 3),
+                "slow_calls": stats.slow_calls,
+                "plan": stats.plan,
+            }
+            for statement, stats in ranked
+        ]
+
+
+class SlowQueryLog:
+    """Log the statements that exceed a duration threshold, and capture the
+    query plan of a sampled subset of those slow statements.
+
+    The plans are captured with ``EXPLAIN (ANALYZE, BUFFERS)``, which executes
+    the statement once more. Hence, only side effect free SELECT statements
+    are ever explained, in a transaction that is always rolled back. They are
+    explained by a background thread per process, on a connection of its own,
+    so the request that ran the slow statement does not wait for its plan.
+    Slow statements that arrive while *EXPLAIN_QUEUE* others wait to be
+    explained are not explained.
+    """
+    # The maximum amount of slow statements waiting to be explained
+    EXPLAIN_QUEUE = 8
+
+    def __init__(self, threshold: float, explain_rate: float, window: float):
+        """
+        :param threshold: The duration, in seconds, from which a statement is slow
+        :param explain_rate: The fraction of slow statements to capture the query plan of
+        :param window: The length of a rolling statistics window, in seconds
+        """
+        self.threshold = threshold
+        self.explain_rate = explain_rate
+        self.stats = QueryStats(window)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue: Optional[queue.Queue] = None
+
+    def record(self, conn: connection, statement: str, query: str, vars, duration: float, explainable: bool) -> None:
+        """Record the execution of a statement, logging and explaining it if slow.
+
+        :param conn: The connection that executed the statement
+        :param statement: The statement fingerprint
+        :param query: The executed sql query
+        :param vars: The parameters of the executed query
+        :param duration: The execution time, in seconds
+        :param explainable: Whether the statement may be explained, i.e. it
+        executed successfully with a single set of parameters
+        """
+        slow = duration >= self.threshold
+        self.stats.record(statement, duration, slow)
+        if not slow:
+            return
+
+        logger.warning("Slow query (%.1f ms): %s", duration * 1000, statement)
+        database = getattr(conn, "database", None)
+        if explainable and database is not None and random.random() < self.explain_rate and statement.upper().startswith("SELECT"):
+            self._ensure_worker()
+            try:
+                self._queue.put_nowait((database, statement, query, vars))
+            except queue.Full:
+                pass
+
+    def _ensure_worker(self) -> None:
+        """Start the background explainer of the calling process, if not started yet."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=SlowQueryLog.EXPLAIN_QUEUE)
+            self._pid = os.getpid()
+            threading.Thread(target=self._explain_queued, name="query-explainer", daemon=True).start()
+
+    def _explain_queued(self) -> None:
+        explain_queue = self._queue
+        connections = {}    # The explainer's own connection, per Database handle
+        while True:
+            database, statement, query, vars = explain_queue.get()
+            try:
+                conn = connections.get(database)
+                if conn is None or conn.closed:
+                    conn = connections[database] = database.connect()
+                plan = self.explain(conn, query, vars)
+            # Explicitly set output values, to ensure graceful failure is handled appropriately
+            except psycopg2.Error:
+                plan = None
+            if plan is not None:
+                self.stats.record_plan(statement, plan)
+                logger.warning("Query plan of %s:\n%s", statement, plan)
+
+    @staticmethod
+    def explain(conn: connection, query: str, vars) -> Optional[str]:
+        """Capture the actual execution plan of a query.
+
+        :param conn: The connection to explain the query on, which must not be in a transaction
+        :param query: The sql query to explain
+        :param vars: The parameters of the query
+        :return: The EXPLAIN output, or None if the query could not be explained
+        """
+        if conn.closed or conn.autocommit:
+            return None
+
+        try:
+            # A plain cursor, so the EXPLAIN itself is not instrumented
+            with conn.cursor(cursor_factory=cursor) as curs:
+                curs.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+                return "\n".join(row[0] for row in curs.fetchall())
+        except psycopg2.Error:
+            return None
+        finally:
+            if not conn.closed:
+                conn.rollback()
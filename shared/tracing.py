@@ -0,0 +1,317 @@
+import os
+import queue
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import requests
+
+from flask import Flask, Response, g, request
+
+from .serialization import dumps, dumps_bytes
+
+
+TRACEPARENT_HEADER = "traceparent"
+TRACESTATE_HEADER = "tracestate"
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# The maximum length of a propagated tracestate header, longer ones are dropped as a whole
+MAX_TRACESTATE_LENGTH = 512
+
+# The span that is currently active in the calling context
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+# The name of the microservice that records the spans
+_service_name = "unknown"
+
+
+class Span:
+    """A single, timed operation that is part of a trace."""
+    __slots__ = ("trace_id", "span_id", "parent_id", "flags", "state", "name", "kind", "start", "end", "attributes")
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_id: Optional[str] = None, flags: str = "01",
+                 attributes: Optional[Dict[str, Union[str, int, float, bool]]] = None, state: Optional[str] = None):
+        """
+        :param name: The name of the operation
+        :param kind: The span kind, either 'server', 'client' or 'internal'
+        :param trace_id: The 32 hex digit identifier of the trace the span is part of
+        :param parent_id: The 16 hex digit identifier of the parent span, if any
+        :param flags: The W3C trace flags
+        :param attributes: The additional attributes that describe the operation
+        :param state: The W3C tracestate of the trace, propagated unchanged
+        """
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.flags = flags
+        self.state = state
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes if attributes is not None else {}
+
+    @property
+    def traceparent(self) -> str:
+        """The W3C traceparent header value that makes this span the parent of a remote span."""
+        return f"00-{self.trace_id}-{self.span_id}-{self.flags}"
+
+    def finish(self) -> None:
+        """Mark the span as ended, and export it."""
+        self.end = time.time_ns()
+        SINK.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": _service_name,
+            "start_time_unix_nano": self.start,
+            "end_time_unix_nano": self.end,
+            "attributes": self.attributes,
+        }
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, str]]:
+    """Parse a W3C traceparent header.
+
+    :param header: The header value, if any
+    :return: (trace id, parent span id, trace flags), or None if absent or malformed
+    """
+    if not header:
+        return None
+    match = _TRACEPARENT.match(header.strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), match.group(3)
+
+
+def parse_tracestate(header: Optional[str]) -> Optional[str]:
+    """Get the W3C tracestate header value to propagate.
+
+    :param header: The header value, if any
+    :return: The tracestate, or None if absent, empty or too long
+    """
+    if not header or not header.strip() or len(header) > MAX_TRACESTATE_LENGTH:
+        return None
+    return header.strip()
+
+
+def current_span() -> Optional[Span]:
+    """Get the span that is active in the calling context, if any."""
+    return _current_span.get()
+
+
+@contextmanager
+def start_span(name: str, kind: str = "internal", parent: Optional[Tuple[str, str, str]] = None,
+               state: Optional[str] = None, **attributes: Union[str, int, float, bool]) -> Iterator[Span]:
+    """Time an operation as a span, that is active for the duration of the with block.
+
+    The span becomes the child of the explicit *parent* context, if any,
+    or else of the span active in the calling context. Without either, the
+    span starts a new trace. ::
+
+        with start_span("db: SELECT * FROM friend WHERE username = ?;", kind="client") as span:
+            curs.execute(query, vars)
+
+    :param name: The name of the operation
+    :param kind: The span kind, either 'server', 'client' or 'internal'
+    :param parent: The remote parent context, as returned by :func:`parse_traceparent`
+    :param state: The tracestate of the remote parent, as returned by :func:`parse_tracestate`
+    :return: The active span
+    """
+    if parent is not None:
+        trace_id, parent_id, flags = parent
+    elif (active := _current_span.get()) is not None:
+        trace_id, parent_id, flags, state = active.trace_id, active.span_id, active.flags, active.state
+    else:
+        trace_id, parent_id, flags, state = os.urandom(16).hex(), None, "01", None
+
+    span = Span(name, kind, trace_id, parent_id, flags, attributes, state)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        span.finish()
+
+
+def inject_headers(headers: Optional[dict] = None) -> dict:
+    """Add the trace context of the active span to outgoing request headers.
+
+    :param headers: The outgoing request headers, if any
+    :return: The headers, including the traceparent and tracestate headers if a span is active
+    """
+    headers = dict(headers) if headers else {}
+    span = _current_span.get()
+    if span is not None:
+        headers[TRACEPARENT_HEADER] = span.traceparent
+        if span.state is not None:
+            headers[TRACESTATE_HEADER] = span.state
+    return headers
+
+
+class SpanSink:
+    """The destination of finished spans. The base sink discards them."""
+    def export(self, span: Span) -> None:
+        pass
+
+
+class FileSink(SpanSink):
+    """A sink that appends every finished span as a json line to a file.
+
+    Every process opens the file once. Every line is written with a single,
+    appending write, so the workers of a microservice may share the same file.
+    """
+    def __init__(self, path: str):
+        """
+        :param path: The path of the file to append the spans to
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+
+    def _ensure_open(self) -> int:
+        """Open the file for the calling process, if not opened yet."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    self._pid = os.getpid()
+        return self._fd
+
+    def export(self, span: Span) -> None:
+        os.write(self._ensure_open(), dumps_bytes(span.to_dict()) + b"\n")
+
+
+class CollectorSink(SpanSink):
+    """A sink that posts batches of finished spans, as a json array, to a collector url.
+
+    Spans are batched and sent by a background thread, so exporting never
+    blocks a request. Spans are dropped if the collector cannot keep up.
+    """
+    BATCH_SIZE = 256
+    FLUSH_INTERVAL = 1.0
+    QUEUE_SIZE = 10000
+
+    def __init__(self, url: str):
+        """
+        :param url: The url of the collector endpoint
+        """
+        self.url = url
+        self._pid = None
+        self._queue: queue.Queue = None
+
+    def _ensure_worker(self) -> None:
+        """Start the background sender of the calling process, if not started yet."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=CollectorSink.QUEUE_SIZE)
+        threading.Thread(target=self._send_batches, name="span-sender", daemon=True).start()
+
+    def export(self, span: Span) -> None:
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            pass
+
+    def _send_batches(self) -> None:
+        spans_queue = self._queue
+        while True:
+            batch: List[dict] = [spans_queue.get()]
+            deadline = time.monotonic() + CollectorSink.FLUSH_INTERVAL
+            while len(batch) < CollectorSink.BATCH_SIZE and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(spans_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                requests.post(self.url, data=dumps(batch), headers={"Content-Type": "application/json"}, timeout=2)
+            # Explicitly set output values, to ensure graceful failure is handled appropriately
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                pass
+
+
+def make_sink(spec: str) -> SpanSink:
+    """Make the span sink described by a sink specification.
+
+    * 'none' discards all spans
+    * 'file:<path>' appends the spans to a json lines file
+    * 'http://...' or 'https://...' posts batches of spans to a collector
+
+    :param spec: The sink specification
+    :return: The span sink
+    """
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):])
+    if spec.startswith(("http://", "https://")):
+        return CollectorSink(spec)
+    return SpanSink()
+
+
+SINK: SpanSink = SpanSink()
+
+
+def set_sink(sink: SpanSink) -> None:
+    """Replace the sink that all finished spans are exported to.
+
+    :param sink: The new span sink
+    """
+    global SINK
+    SINK = sink
+
+
+def register_tracing(app: Flask) -> None:
+    """Trace every request handled by the app.
+
+    The incoming W3C traceparent header, if any, becomes the parent of the
+    request's server span, and its tracestate header is propagated along. The span sink is configured by the app's
+    TRACING_SINK config value, see :func:`make_sink`.
+
+    :param app: The app to trace
+    """
+    global _service_name
+    _service_name = app.name
+    set_sink(make_sink(app.config["TRACING_SINK"]))
+
+    @app.before_request
+    def start_request_span() -> None:
+        rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        parent = parse_traceparent(request.headers.get(TRACEPARENT_HEADER))
+        # A tracestate without a valid traceparent is ignored
+        state = parse_tracestate(request.headers.get(TRACESTATE_HEADER)) if parent is not None else None
+        g.tracing_span = start_span(f"{request.method} {rule}", kind="server", parent=parent, state=state,
+                                    **{ "http.method": request.method, "http.target": request.full_path })
+        g.tracing_span.__enter__()
+
+    @app.after_request
+    def record_response_status(response: Response) -> Response:
+        span = current_span()
+        if span is not None:
+            span.attributes["http.status_code"] = response.status_code
+            response.headers[TRACEPARENT_HEADER] = span.traceparent
+        return response
+
+    @app.teardown_request
+    def finish_request_span(exception: BaseException = None) -> None:
+        span_context = g.pop("tracing_span", None)
+        if span_context is None:
+            return
+        if exception is not None:
+            span_context.__exit__(type(exception), exception, exception.__traceback__)
+        else:
+            span_context.__exit__(None, None, None)
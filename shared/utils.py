@@ -1,15 +1,26 @@
-import psycopg2
-
-from flask import Flask, Response
+from flask import Flask, Response, current_app, make_response
 from flask_restful import Api, reqparse
 from flask_apispec import FlaskApiSpec, marshal_with
 from marshmallow import Schema, ValidationError
 from json import JSONDecodeError
-from typing import Tuple, Callable, Union
+from typing import Tuple, Callable, Iterable, Union
 
 from shared.APIResponses import make_response_error, GenericResponseMessages as E_MSG
 
 from .config import config as shared_flask_app_config
+from .models import SerializedResponse
+from .serialization import FastJSONProvider, dumps_bytes
+from .middleware import register_response_middleware
+from .metrics import register_metrics
+from .tracing import register_tracing
+from .profiling import register_profiling
+from .admission import register_admission_control
+from .caching import register_cache
+from .database import Database
+from .health import register_health_endpoints
+from .slowQueries import SlowQueryLog
+from .admin import register_admin_endpoints
+from .replicas import register_replica_routing
 
 
 def create_app(app_name: str, apispec_config: dict) -> Tuple[Flask, Api, FlaskApiSpec]:
@@ -23,9 +34,17 @@ def create_app(app_name: str, apispec_config: dict) -> Tuple[Flask, Api, FlaskAp
     app = Flask(app_name)
     app.config.from_mapping(shared_flask_app_config)
     app.config.from_mapping(apispec_config)
+    app.json = FastJSONProvider(app)
+    register_metrics(app)
+    register_tracing(app)
+    register_admission_control(app)
+    register_profiling(app)
+    register_cache(app)
+    register_response_middleware(app)
 
     # Do Flask RESTful api setup
     api = Api(app)
+    api.representation("application/json")(output_json)
 
     # Do Swagger doc generation
     docs = FlaskApiSpec(app)
@@ -33,52 +52,76 @@ def create_app(app_name: str, apispec_config: dict) -> Tuple[Flask, Api, FlaskAp
     return app, api, docs
 
 
-def retry_connect_until_success(db_name: str, user: str, password: str, host: str):
-    """Indefinitely retry establishing a database connection, until successful.
+def output_json(data, code: int, headers: dict = None) -> Response:
+    """A Flask RESTful json representation that serializes through the fast json path.
 
-    :param db_name: The name of the database to connect to
-    :param user: The user name used to authenticate
-    :param password: The password used to authenticate
-    :param host: The database host address
-    :return: The connection
-    """
-    conn = None
+    This only applies to plain, non flask.Response, return values of Flask RESTful resources.
 
-    while conn is None:
-        try:
-            conn = psycopg2.connect(dbname=db_name, user=user, password=password, host=host)
-            print("DB connection succesful")
-            return conn
-        except psycopg2.OperationalError:
-            import time
-            time.sleep(1)
-            print("Retrying DB connection")
+    :param data: The resource's return value
+    :param code: The response status code
+    :param headers: The additional response headers
+    :return: The json response
+    """
+    response = make_response(dumps_bytes(data), code)
+    response.mimetype = "application/json"
+    response.headers.extend(headers or {})
+    return response
 
 
-def initialize_micro_service(microservice_name: str, db_host: Union[str, None], apispec_config: dict):
+def initialize_micro_service(microservice_name: str, db_host: Union[str, None], apispec_config: dict, dependencies: Iterable[str] = ()):
     """Perform the necessary setup to initialize a micro service.
 
+    No database connection is made here, so the microservice starts
+    serving immediately. The returned database handle connects in the
+    background, and lazily checks out a connection of the bounded pool
+    of every (forked worker) process once the database is reachable,
+    which every request returns when it ends. The /healthz
+    and /readyz endpoints report the status of the microservice, and the
+    operator-only /admin endpoints report its query statistics. Reading
+    requests are routed to the database's streaming replicas, if any.
+
     :param microservice_name: The name of the microservice. Used to
     determine the Flask app name and postgresql database name
     :param db_host: The database host address, make connection with a
     persistence container if not None
+    :param dependencies: The names of the microservices this microservice
+    depends on, reported by the readiness endpoint
     :return: The major components of the microservice: (
         Flask app,
         Flask RESTful api,
         FlaskApiSpec docs,
-        psycopg2 connection
+        Database handle
     )
     """
     app, api, docs = create_app(microservice_name, apispec_config)
 
-    conn = None
+    db = None
     if db_host is not None:
-        conn = retry_connect_until_success(db_name=microservice_name,
-                                    user=app.config["POSTGRES_USER"],
-                                    password=app.config["POSTGRES_PASSWORD"],
-                                    host=db_host)
-
-    return app, api, docs, conn
+        db = Database(db_name=microservice_name,
+                      user=app.config["POSTGRES_USER"],
+                      password=app.config["POSTGRES_PASSWORD"],
+                      host=db_host,
+                      query_log=SlowQueryLog(threshold=app.config["SLOW_QUERY_THRESHOLD_MS"] / 1000,
+                                             explain_rate=app.config["SLOW_QUERY_EXPLAIN_RATE"],
+                                             window=app.config["QUERY_STATS_WINDOW"]),
+                      statement_cache_size=app.config["STATEMENT_CACHE_SIZE"],
+                      prepare_threshold=app.config["PREPARE_THRESHOLD"],
+                      replica_hosts=app.config["DB_REPLICA_HOSTS"],
+                      pool_size=app.config["DB_POOL_SIZE"],
+                      pool_timeout=app.config["DB_POOL_TIMEOUT"])
+
+        @app.teardown_request
+        def release_connection(exception: BaseException = None) -> None:
+            db.release()
+
+    register_health_endpoints(app, db, dependencies)
+    register_admin_endpoints(app, db)
+    register_replica_routing(app, db,
+                             max_lag=app.config["REPLICA_MAX_LAG"],
+                             interval=app.config["REPLICA_CHECK_INTERVAL"],
+                             window=app.config["READ_YOUR_WRITES_WINDOW"])
+
+    return app, api, docs, db
 
 
 def marshal_with_flask_enforced(schema, code='default', description='', inherit=None, apply=None):
@@ -91,6 +134,11 @@ def marshal_with_flask_enforced(schema, code='default', description='', inherit=
     is performed, and the flask.Response is simply passed up. This means that this decorator
     is unsuited for use with a *code* parameter in the 400+ range.
 
+    Responses serialized from row models, :class:`shared.models.SerializedResponse`, conform
+    to the schema by construction. They are also passed up without re-validation, unless the
+    app runs in debug or testing mode, where a non-conformant one is answered with a 500 error,
+    like any other response.
+
     This wrapper condences the boilerplate of validating and marshalling all API response
     data into the correct format, using flask-apispec. Its use is recommended for the
     sake of elegance and, more importantly, avoiding code duplication while also somewhat
@@ -186,6 +234,15 @@ def marshal_with_flask_enforced(schema, code='default', description='', inherit=
             if to_marshal_result.status_code >= 400:
                 return to_marshal_result
 
+            # Row model serializers already produce the marshalled format,
+            # which is verified only while debugging or testing
+            if isinstance(to_marshal_result, SerializedResponse):
+                if current_app.debug or current_app.testing:
+                    errors = schema().validate(to_marshal_result.json)
+                    if errors:
+                        return make_response_error(E_MSG.ERROR, f"The serialized response data does not follow the required scheme: {errors}", 500)
+                return to_marshal_result
+
             try:
                 instance: Schema = schema()
                 content: dict = to_marshal_result.json
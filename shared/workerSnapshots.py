@@ -0,0 +1,163 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class WorkerSnapshots:
+    """Snapshots of per-process state, shared between the worker processes of a server.
+
+    Every worker process writes a snapshot of each registered source to
+    ``<name>.<pid>.json`` in a directory shared by the workers of a server,
+    every *interval* seconds, see :func:`shared.server.serve`. A worker
+    that reports on the whole server, e.g. on a /metrics scrape, writes a
+    fresh snapshot of its own and then collects those of all workers. ::
+
+        WORKER_SNAPSHOTS.register("queries", db.query_log.stats.snapshot)
+        ...
+        for snapshot, alive in WORKER_SNAPSHOTS.collect("queries"):
+            ...
+
+    Without a directory, e.g. under the single process development server,
+    only the snapshot of the calling process is collected.
+    """
+    # The name suffix of the snapshot that accumulates those of exited workers, see :meth:`collect`
+    RETIRED = "retired"
+
+    def __init__(self):
+        self.directory = ""
+        self.interval = 1.0
+        self._sources: Dict[str, Callable[[], Any]] = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+        # Threads never survive a fork, so every worker starts its own writer
+        os.register_at_fork(after_in_child=self._ensure_worker)
+
+    def configure(self, directory: str, interval: float) -> None:
+        """
+        :param directory: The directory shared by the workers of the server, snapshots are not shared if empty
+        :param interval: The time between two snapshots of a worker, in seconds
+        """
+        self.directory = directory
+        self.interval = interval
+
+    def register(self, name: str, source: Callable[[], Any]) -> None:
+        """Register a source of per-process state.
+
+        :param name: The name of the state
+        :param source: Get a json serializable snapshot of the state of the calling process
+        """
+        self._sources[name] = source
+
+    def _path(self, name: str, suffix) -> str:
+        return os.path.join(self.directory, f"{name}.{suffix}.json")
+
+    def _ensure_worker(self) -> None:
+        """Start the snapshot writer of the calling process, if not started yet."""
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._write_snapshots, name="worker-snapshots", daemon=True).start()
+
+    def _write_snapshots(self) -> None:
+        while True:
+            for name in list(self._sources):
+                self.write(name)
+            time.sleep(self.interval)
+
+    def write(self, name: str) -> None:
+        """Write a snapshot of a source of the calling process.
+
+        :param name: The name of the state
+        """
+        path = self._path(name, os.getpid())
+        try:
+            with open(path + ".tmp", "w") as file:
+                json.dump(self._sources[name](), file)
+            # Replaced atomically, so readers never see a partial snapshot
+            os.replace(path + ".tmp", path)
+        # Explicitly set output values, to ensure graceful failure is handled appropriately
+        except OSError:
+            pass
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def collect(self, name: str, retire: Optional[Callable[[Any, Any], Any]] = None) -> List[Tuple[Any, bool]]:
+        """Collect the snapshots of a source, of all workers of the server.
+
+        :param name: The name of the state
+        :param retire: Merge the snapshot of an exited worker into the accumulated snapshot of the exited
+        workers, which is then reported instead of the snapshots it merged. The snapshots of exited workers
+        are dropped if None
+        :return: (The snapshot, whether its worker is alive) per worker, and the accumulated snapshot of
+        the exited workers, if any
+        """
+        if not self.directory:
+            return [(self._sources[name](), True)]
+
+        self._ensure_worker()
+        self.write(name)
+        snapshots = []
+        # Collected under an exclusive lock, so no exited worker is both retired and reported
+        with open(os.path.join(self.directory, f".{name}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired = None
+            for filename in sorted(os.listdir(self.directory)):
+                prefix, _, suffix = filename[:-len(".json")].partition(".")
+                if prefix != name or not filename.endswith(".json") or not suffix.isdigit():
+                    continue
+                try:
+                    with open(os.path.join(self.directory, filename)) as file:
+                        snapshot = json.load(file)
+                # Explicitly set output values, to ensure graceful failure is handled appropriately
+                except (OSError, ValueError):
+                    continue
+
+                if int(suffix) == os.getpid() or WorkerSnapshots._alive(int(suffix)):
+                    snapshots.append((snapshot, True))
+                    continue
+                if retire is not None:
+                    if retired is None:
+                        retired = self._read_retired(name)
+                    retired = retire(retired, snapshot)
+                    self._write_retired(name, retired)
+                os.remove(os.path.join(self.directory, filename))
+
+            if retire is not None:
+                if retired is None:
+                    retired = self._read_retired(name)
+                if retired is not None:
+                    snapshots.append((retired, False))
+        return snapshots
+
+    def _read_retired(self, name: str) -> Any:
+        try:
+            with open(self._path(name, WorkerSnapshots.RETIRED)) as file:
+                return json.load(file)
+        # Explicitly set output values, to ensure graceful failure is handled appropriately
+        except (OSError, ValueError):
+            return None
+
+    def _write_retired(self, name: str, snapshot: Any) -> None:
+        path = self._path(name, WorkerSnapshots.RETIRED)
+        with open(path + ".tmp", "w") as file:
+            json.dump(snapshot, file)
+        os.replace(path + ".tmp", path)
+
+
+WORKER_SNAPSHOTS = WorkerSnapshots()
@@ -1,48 +1,143 @@
-from flask import Flask
-from flask_restful import Resource, Api, reqparse
-import psycopg2
+from flask_restful import Resource, reqparse
+
+from shared.utils import initialize_micro_service
+from shared.caching import cached, invalidate
 
 parser = reqparse.RequestParser()
 parser.add_argument('title', required=True, type=str, location=('args',), help="Required param: The title of a song")
 parser.add_argument('artist', required=True, type=str, location=('args',), help="Required param: The artist of a song")
 
-app = Flask("songs")
-api = Api(app)
+page_parser = reqparse.RequestParser()
+page_parser.add_argument('q', required=False, type=str, default='', location=('args',), help="Optional param: The prefix of the artists or titles to search for")
+page_parser.add_argument('after_artist', required=False, type=str, location=('args',), help="Optional param: The artist of the last song of the previous page")
+page_parser.add_argument('after_title', required=False, type=str, location=('args',), help="Optional param: The title of the last song of the previous page")
+page_parser.add_argument('after_match', required=False, type=str, choices=('artist', 'title'), location=('args',), help="Optional param: Whether the last song of the previous search page matched by artist or by title")
+page_parser.add_argument('limit', required=False, type=int, default=50, location=('args',), help="Optional param: The maximum amount of songs in the page")
+
+# The largest page of songs that is served at once
+MAX_PAGE_SIZE = 200
 
-conn = None
+# The orderings of the search results, per matched column, each that of the column's prefix index. The songs
+# whose artist matches come first, followed by those whose title matches, so every page is a range scan.
+SEARCH_ORDERS = {
+    "artist": ('lower(artist) COLLATE "C"', 'artist COLLATE "C"', 'title COLLATE "C"'),
+    "title": ('lower(title) COLLATE "C"', 'title COLLATE "C"', 'artist COLLATE "C"'),
+}
 
-while conn is None:
-    try:
-        conn = psycopg2.connect(dbname="songs", user="postgres", password="postgres", host="songs_persistence")
-        print("DB connection succesful")
-    except psycopg2.OperationalError:
-        import time
-        time.sleep(1)
-        print("Retrying DB connection")
+MICROSERVICE_NAME = "songs"
+DB_HOST = "songs_persistence"
+APISPEC_CONFIG = {
+    'APISPEC_SWAGGER_URL': '/swagger/',
+    'APISPEC_SWAGGER_UI_URL': '/swagger-ui/',
+    'APISPEC_TITLE': 'Microservices Songs',
+    'APISPEC_VERSION': '1.0'
+}
+app, api, docs, db = initialize_micro_service(MICROSERVICE_NAME, DB_HOST, APISPEC_CONFIG)
 
 
 def all_songs(limit=1000):
-    cur = conn.cursor()
+    cur = db.cursor()
     cur.execute(f"SELECT title, artist FROM songs LIMIT {limit};")
     return cur.fetchall()
 
+def songs_page(after, limit):
+    """Get a page of songs, ordered by artist and title.
+
+    The page starts right after the *after* song, so every page is fetched
+    through the primary key index, no matter how deep into the catalogue.
+
+    :param after: The (artist, title) of the last song of the previous page, None for the first page
+    :param limit: The maximum amount of songs in the page
+    :return: The songs as (title, artist) pairs, and the (artist, title) to continue after, None for the last page
+    """
+    where, params = ("WHERE (artist, title) > (%s, %s) ", list(after)) if after is not None else ("", [])
+
+    cur = db.cursor()
+    cur.execute(f"SELECT title, artist FROM songs {where}ORDER BY artist, title LIMIT %s;", params + [limit + 1])
+    songs = cur.fetchall()
+    if len(songs) <= limit:
+        return songs, None
+    title, artist = songs[limit - 1]
+    return songs[:limit], (artist, title)
+
+def search_page(query, after, after_match, limit):
+    """Get a page of the songs whose artist or title starts with a prefix, case-insensitive.
+
+    The songs whose artist matches come first, ordered by artist and title,
+    followed by the other songs whose title matches, ordered by title and
+    artist, see SEARCH_ORDERS. Each part is paginated through its own prefix
+    index, starting right after the *after* song, so a page costs the same
+    no matter how many songs match.
+
+    :param query: The prefix of the artists or titles to search for
+    :param after: The (artist, title) of the last song of the previous page, None for the first page
+    :param after_match: The column that the last song of the previous page matched, 'artist' or 'title'
+    :param limit: The maximum amount of songs in the page
+    :return: The songs as (title, artist) pairs, and the (artist, title, matched column) to continue after,
+    None for the last page
+    """
+    pattern = query.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    songs = []
+    cur = db.cursor()
+    for match in ("artist", "title")[1 if after is not None and after_match == "title" else 0:]:
+        order = SEARCH_ORDERS[match]
+        conditions, params = [f"{order[0]} LIKE %s"], [pattern]
+        if match == "title":
+            # Every song whose artist matches was part of the artist matches already
+            conditions.append(f"NOT {SEARCH_ORDERS['artist'][0]} LIKE %s")
+            params.append(pattern)
+        if after is not None and after_match == match:
+            first, second = after if match == "artist" else reversed(after)
+            conditions.append(f"({', '.join(order)}) > (lower(%s), %s, %s)")
+            params += [first, first, second]
+
+        cur.execute(f"SELECT title, artist FROM songs WHERE {' AND '.join(conditions)} ORDER BY {', '.join(order)} LIMIT %s;",
+                    params + [limit + 1 - len(songs)])
+        songs += [(title, artist, match) for title, artist in cur.fetchall()]
+        if len(songs) > limit:
+            break
+
+    if len(songs) <= limit:
+        return [(title, artist) for title, artist, _ in songs], None
+    title, artist, match = songs[limit - 1]
+    return [(title, artist) for title, artist, _ in songs[:limit]], (artist, title, match)
+
 def add_song(title, artist):
     if not song_exists(title, artist):
-        cur = conn.cursor()
+        cur = db.cursor()
         cur.execute("INSERT INTO songs (title, artist) VALUES (%s, %s);", (title, artist))
-        conn.commit()
+        db.commit()
+        invalidate("songs")
         return True
     return False
 
 def song_exists(title, artist):
-    cur = conn.cursor()
+    cur = db.cursor()
     cur.execute("SELECT COUNT(*) FROM songs WHERE title = %s AND artist = %s;", (title, artist))
     return bool(cur.fetchone()[0])  # Either True or False
 
 class AllSongsResource(Resource):
+    @cached(tags=("songs",))
     def get(self):
         return all_songs()
 
+class SongsPage(Resource):
+    @cached(tags=("songs",))
+    def get(self):
+        args = page_parser.parse_args()
+        after = None
+        if args['after_artist'] is not None and args['after_title'] is not None:
+            after = (args['after_artist'], args['after_title'])
+        limit = max(1, min(args['limit'], MAX_PAGE_SIZE))
+        if args['q']:
+            songs, next_song = search_page(args['q'], after, args['after_match'], limit)
+        else:
+            songs, next_song = songs_page(after, limit)
+        return {
+            "songs": songs,
+            "next": dict(zip(("artist", "title", "match"), next_song)) if next_song is not None else None
+        }
+
 class SongExists(Resource):
     def get(self):
         args = parser.parse_args()
@@ -54,5 +149,6 @@ class AddSong(Resource):
         return add_song(args['title'], args['artist'])
 
 api.add_resource(AllSongsResource, '/songs/')
+api.add_resource(SongsPage, '/songs/page/')
 api.add_resource(SongExists, '/songs/exist/')
 api.add_resource(AddSong, '/songs/add/')
@@ -15,4 +15,6 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "songs" <<-EOSQL
     FROM '/docker-entrypoint-initdb.d/mil_song.csv'
     DELIMITER ','
     CSV HEADER;
+    CREATE INDEX songs_artist_prefix ON songs ((lower(artist) COLLATE "C"), artist COLLATE "C", title COLLATE "C");
+    CREATE INDEX songs_title_prefix ON songs ((lower(title) COLLATE "C"), title COLLATE "C", artist COLLATE "C");
 EOSQL
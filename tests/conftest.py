@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The shared package is imported from the repository root, like the microservices do
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
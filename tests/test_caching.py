@@ -0,0 +1,55 @@
+"""Tests of the response cache, see :mod:`shared.caching`."""
+import pickle
+
+from flask import Flask
+
+from shared.caching import MemoryBackend, ResponseCache
+from shared.models import SerializedResponse, make_response_serialized
+
+
+class Unpickled(Exception):
+    pass
+
+
+class Exploit:
+    def __reduce__(self):
+        return (_unpickled, ())
+
+
+def _unpickled():
+    raise Unpickled()
+
+
+def make_cache() -> ResponseCache:
+    return ResponseCache(MemoryBackend(max_entries=16, max_bytes=2 ** 20), default_ttl=60.0)
+
+
+def test_responses_are_restored():
+    cache, calls = make_cache(), []
+
+    @cache.cached(tags=("user:{username}",))
+    def get(username: str):
+        calls.append(username)
+        return make_response_serialized("Successful", 200, result="[1,2]")
+
+    with Flask("test").test_request_context("/"):
+        first, second = get(username="bob"), get(username="bob")
+        assert isinstance(second, SerializedResponse) and second.status_code == 200
+        assert second.get_data() == first.get_data() and second.headers == first.headers
+        cache.invalidate("user:bob")
+        get(username="bob")
+    assert calls == ["bob", "bob"]
+
+
+def test_pickled_entries_are_never_loaded():
+    cache, calls = make_cache(), []
+
+    @cache.cached(key="songs")
+    def get():
+        calls.append(None)
+        return [["title", "artist"]]
+
+    cache.backend.set("songs", pickle.dumps(Exploit()), ttl=60.0)
+    with Flask("test").test_request_context("/"):
+        assert get() == [["title", "artist"]] and get() == [["title", "artist"]]
+    assert len(calls) == 1
@@ -0,0 +1,122 @@
+"""Tests of the in-memory friend graph, see :mod:`friends.graph`."""
+import fcntl
+import importlib.util
+import os
+
+from datetime import datetime, timedelta
+
+import pytest
+
+spec = importlib.util.spec_from_file_location("friends_graph", os.path.join(os.path.dirname(__file__), "..", "friends", "graph.py"))
+graph_module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(graph_module)
+FriendGraph = graph_module.FriendGraph
+
+START = datetime(2023, 5, 1)
+
+
+class Table:
+    """A stand-in friend table."""
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def load(self, since):
+        return [row for row in self.rows if since is None or row[2] >= since]
+
+
+def make_graph(table: Table, directory: str, reload_interval: float = 3600.0) -> FriendGraph:
+    graph = FriendGraph(table.load, str(directory), refresh_interval=5.0, reload_interval=reload_interval)
+    # Driven by the test instead of a background loader
+    graph._pid = os.getpid()
+    return graph
+
+
+def refresh(graph: FriendGraph) -> None:
+    """Run one iteration of the background loader."""
+    snapshot = graph._latest()
+    if snapshot is None or graph._age(snapshot) >= graph.reload_interval:
+        snapshot = graph._build() or snapshot
+    if snapshot is not None and snapshot != graph._snapshot:
+        graph._attach(snapshot)
+    if graph._graph is not None:
+        graph._poll()
+
+
+@pytest.fixture
+def table() -> Table:
+    names = ["alice", "bob", "carol", "dave", "erin", "frank", "zoë"]
+    return Table((username, friendname, START + timedelta(minutes=i))
+                 for i, (username, friendname) in enumerate((username, friendname) for username in names for friendname in names
+                                                            if username != friendname and (len(username) + len(friendname)) % 3))
+
+
+def expected_friends(table: Table, username: str):
+    return sorted((row for row in table.rows if row[0] == username), key=lambda row: row[1])
+
+
+def test_workers_share_a_snapshot(table, tmp_path):
+    first, second = make_graph(table, tmp_path), make_graph(table, tmp_path)
+    assert first.friends("alice") is None
+    refresh(first)
+    refresh(second)
+    assert second._snapshot == first._snapshot and len(first._snapshots()) == 1
+
+    for username in ("alice", "bob", "zoë", "nobody"):
+        assert sorted(second.friends(username), key=lambda row: row[1]) == expected_friends(table, username)
+        assert sorted(second.added_by(username)) == sorted((row[0], row[2]) for row in table.rows if row[1] == username)
+    friends_of = lambda username: { row[1] for row in table.rows if row[0] == username }
+    assert second.mutual_friends("alice", "bob") == sorted(friends_of("alice") & friends_of("bob"))
+
+
+def test_relations_are_added_on_top_of_the_snapshot(table, tmp_path):
+    graph = make_graph(table, tmp_path)
+    refresh(graph)
+    newest = max(row[2] for row in table.rows)
+
+    added = ("alice", "newcomer", newest + timedelta(seconds=1))
+    table.rows.append(added)
+    graph.add(*added)
+    polled = ("newcomer", "zoë", newest + timedelta(seconds=2))
+    table.rows.append(polled)
+    refresh(graph)
+    refresh(graph)
+
+    assert sorted(graph.friends("alice"), key=lambda row: row[1]) == expected_friends(table, "alice")
+    assert graph.friends("newcomer") == [polled]
+    assert graph._graph.total_edges == len(table.rows)
+    assert [name for name, _, _ in graph.suggestions("alice", 10)] == \
+        [name for name, _, _ in sorted(suggest(table, "alice"), key=lambda row: (-row[1], -row[2].timestamp()))][:10]
+
+
+def suggest(table: Table, username: str):
+    friends = { row[1] for row in table.rows if row[0] == username }
+    candidates = {}
+    for sender, friendname, created in table.rows:
+        if sender in friends and friendname != username and friendname not in friends:
+            count, latest = candidates.get(friendname, (0, created))
+            candidates[friendname] = (count + 1, max(latest, created))
+    return [(name, count, latest) for name, (count, latest) in candidates.items()]
+
+
+def test_a_rebuild_picks_up_relations_committed_late(table, tmp_path):
+    graph = make_graph(table, tmp_path)
+    refresh(graph)
+    newest = max(row[2] for row in table.rows)
+
+    # Its transaction started well before the newest relation, but it committed after the poll covering that time
+    late = ("bob", "latecomer", newest - FriendGraph.COMMIT_DELAY - timedelta(seconds=1))
+    table.rows.append(late)
+    refresh(graph)
+    assert late not in graph.friends("bob")
+
+    graph.reload_interval = 0.0
+    refresh(graph)
+    assert late in graph.friends("bob") and len(graph._snapshots()) == 1
+
+
+def test_a_single_worker_builds(table, tmp_path):
+    graph = make_graph(table, tmp_path)
+    with open(os.path.join(tmp_path, ".friend_graph.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert graph._build() is None
+    assert graph._build() is not None
@@ -0,0 +1,48 @@
+"""Tests of the row models, see :mod:`shared.models`."""
+from datetime import datetime
+
+from flask import Flask
+from marshmallow import Schema, fields
+
+from shared.models import Column, RowModel, make_response_serialized
+from shared.utils import marshal_with_flask_enforced
+
+
+class Share(RowModel):
+    columns = (
+        Column("owner", str, 0),
+        Column("id", int, 1),
+        Column("public", bool, 2),
+        Column("created", datetime, 3),
+        Column("title", str),
+    )
+
+
+class ShareSchema(Schema):
+    owner = fields.String(required=True)
+    id = fields.Integer(required=True)
+
+
+class SharesResponseSchema(Schema):
+    message = fields.String(required=True)
+    result = fields.List(fields.Nested(ShareSchema), required=True)
+
+
+def test_null_values_are_serialized_as_null():
+    assert Share.dumps_rows([(None, None, None, None)]) == '[{"owner":null,"id":null,"public":null,"created":null}]'
+    assert Share.from_row(("bob", 1, True, datetime(2023, 5, 1))).dumps_fields() == \
+        '"owner":"bob","id":1,"public":true,"created":"2023-05-01T00:00:00"'
+    assert make_response_serialized("Success", 200, count=None).get_data() == b'{"message":"Success","count":null}'
+
+
+def test_serialized_responses_are_validated_while_testing():
+    app = Flask("test")
+
+    @marshal_with_flask_enforced(SharesResponseSchema, code=200)
+    def get():
+        return make_response_serialized("Success", 200, result=Share.dumps_rows([(None, 1, True, datetime(2023, 5, 1))]))
+
+    with app.test_request_context("/"):
+        assert get().status_code == 200
+        app.testing = True
+        assert get().status_code == 500
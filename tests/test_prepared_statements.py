@@ -0,0 +1,49 @@
+"""Tests of the prepared statements of the shared database layer, see :mod:`shared.preparedStatements`.
+
+The tests that execute statements need a PostgreSQL server, at the host
+in the TEST_DB_HOST environment variable, with the credentials of the
+shared config, and are skipped without one.
+"""
+import os
+
+import pytest
+
+from shared.config import config
+from shared.database import Database
+from shared.preparedStatements import to_prepared
+
+
+@pytest.fixture
+def conn():
+    host = os.environ.get("TEST_DB_HOST")
+    if not host:
+        pytest.skip("TEST_DB_HOST is not set")
+    database = Database("postgres", config["POSTGRES_USER"], config["POSTGRES_PASSWORD"], host,
+                        statement_cache_size=4, prepare_threshold=config["PREPARE_THRESHOLD"])
+    conn = database.connect()
+    yield conn
+    conn.close()
+
+
+def test_to_prepared():
+    assert to_prepared("SELECT * FROM friend WHERE username = %s AND friendname = %s;", ("bob", "dylan")) \
+        == ("SELECT * FROM friend WHERE username = $1 AND friendname = $2", 2)
+    assert to_prepared("SELECT 1; SELECT 2;", None) is None
+    assert to_prepared("DECLARE c CURSOR FOR SELECT 1;", None) is None
+
+
+def test_unnamed_cursor_is_prepared(conn):
+    for _ in range(config["PREPARE_THRESHOLD"] + 2):
+        with conn.cursor() as curs:
+            curs.execute("SELECT %s + 1;", (1,))
+            assert curs.fetchone()[0] == 2
+    assert len(conn.prepared_statements) == 1
+
+
+def test_named_cursor_is_never_prepared(conn):
+    for i in range(config["PREPARE_THRESHOLD"] * 2 + 1):
+        with conn.cursor(name="streamed") as curs:
+            curs.execute("SELECT generate_series(1, %s);", (i + 1,))
+            assert [row[0] for row in curs] == list(range(1, i + 2))
+        conn.rollback()
+    assert len(conn.prepared_statements) == 0
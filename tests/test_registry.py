@@ -0,0 +1,47 @@
+"""Tests of the client-side load balancing, see :mod:`shared.registry`."""
+from shared.registry import ServiceRegistry
+
+
+def make_registry() -> ServiceRegistry:
+    return ServiceRegistry({ "friends": ["http://friends:5000", "http://friends_2:5000"] },
+                           default_port=5000, eject_after=3, eject_duration=10.0)
+
+
+def test_failures_eject():
+    registry = make_registry()
+    failing, other = registry.endpoints("friends")
+    for _ in range(3):
+        registry.report("friends", failing, healthy=False)
+    assert all(registry.choose("friends") is other for _ in range(20))
+
+
+def test_shed_requests_never_eject():
+    registry = make_registry()
+    busy, other = registry.endpoints("friends")
+    for _ in range(10):
+        registry.report("friends", busy, healthy=False, retry_after=60.0)
+    assert busy.failures == 0 and busy.ejected_until == 0.0
+
+    # While it asks to back off, every shed request weighs as an outstanding request
+    other.outstanding = 9
+    assert all(registry.choose("friends") is other for _ in range(20))
+    other.outstanding = 11
+    assert all(registry.choose("friends") is busy for _ in range(20))
+
+
+def test_shedding_expires():
+    registry = make_registry()
+    busy, other = registry.endpoints("friends")
+    registry.report("friends", busy, healthy=False, retry_after=0.0)
+    other.outstanding = 1
+    assert all(registry.choose("friends") is busy for _ in range(20))
+
+
+def test_answer_ends_shedding():
+    registry = make_registry()
+    busy, other = registry.endpoints("friends")
+    for _ in range(5):
+        registry.report("friends", busy, healthy=False, retry_after=60.0)
+    registry.report("friends", busy, healthy=True)
+    other.outstanding = 1
+    assert all(registry.choose("friends") is busy for _ in range(20))